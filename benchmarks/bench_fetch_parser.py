@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+"""
+Compare parsing X-GM FETCH response lines with the Parsley grammar the
+library used to use against the regex tokenizer in
+`gmailtuilib.parsers.parse_fetch_response()`.
+Parsley is a development dependency, only needed for this benchmark.
+
+Both parsers get the same 10k response lines, shaped like Gmail's answer to
+`UID FETCH ... (X-GM-MSGID X-GM-THRID X-GM-LABELS)`, and must agree on every
+line.
+"""
+
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import parsley  # noqa: E402
+
+from gmailtuilib.parsers import parse_fetch_response  # noqa: E402
+
+NUM_LINES = 10000
+LABELS = [
+    '"\\\\Inbox"',
+    '"\\\\Important"',
+    '"\\\\Starred"',
+    '"\\\\Sent"',
+    '"Receipts"',
+    '"Work/Projects 2024"',
+    '"Family & Friends"',
+]
+
+imap_gmail_uid_fetch_response_grammar = """\
+line = msg_number:m ws plist:x end -> (m, x)
+msg_number = digit+:dl -> int("".join(dl))
+plist = '(' items:x ')' -> x
+items = item_space*:x -> x
+item_space = item:x ws -> x
+item = string_item | plist
+string_item = atom | qstring
+atom = (letterOrDigit | punctuation)+:c -> ''.join(c)
+punctuation = anything:c ?(c in '!#$%&*+,-./:;<=>?@[]^_`{|}~') -> c
+qstring = '"' qstring_contents:a '"' -> a
+qstring_contents = qstring_chars+:c -> ''.join(c)
+qstring_chars = anything:c ?(c not in '"') -> c
+"""
+
+
+def make_lines(num_lines):
+    rng = random.Random(0)
+    lines = []
+    for n in range(1, num_lines + 1):
+        labels = " ".join(rng.sample(LABELS, rng.randint(0, 4)))
+        thrid = rng.randrange(10**18, 10**19)
+        msgid = rng.randrange(10**18, 10**19)
+        line = (
+            f"{n} (X-GM-THRID {thrid} X-GM-MSGID {msgid} "
+            f"X-GM-LABELS ({labels}) UID {n + 1000})"
+        )
+        lines.append(line.encode())
+    return lines
+
+
+def parse_with_parsley(parser, lines):
+    return [parser(line.decode()).line() for line in lines]
+
+
+def parse_with_tokenizer(lines):
+    return list(parse_fetch_response(lines))
+
+
+def time_it(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    lines = make_lines(NUM_LINES)
+    # Compile the grammar before timing.
+    parser = parsley.makeGrammar(imap_gmail_uid_fetch_response_grammar, {})
+    expected, parsley_seconds = time_it(parse_with_parsley, parser, lines)
+    actual, tokenizer_seconds = time_it(parse_with_tokenizer, lines)
+    if actual != expected:
+        raise SystemExit("Parsers disagree.")
+    print(f"{'lines':>7} {'Parsley (ms)':>14} {'tokenizer (ms)':>16} {'speedup':>8}")
+    print(
+        f"{NUM_LINES:>7} {parsley_seconds * 1000:>14.1f} "
+        f"{tokenizer_seconds * 1000:>16.1f} "
+        f"{parsley_seconds / tokenizer_seconds:>7.0f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
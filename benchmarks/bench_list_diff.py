@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+"""
+Measure the cost of refreshing a 500-row message list after a one-message
+change: a message is marked read elsewhere, or a new message arrives.
+
+The positional diff in `Messages.apply_changes()` is compared with redrawing
+the whole list, which is what happens when every row is treated as new.  The
+list runs headless in a 120x40 terminal; the table reports the median time
+until the next frame is drawn, the median time spent in `apply_changes()`
+itself, and how many lines `render_line()` had to produce.
+"""
+
+import asyncio
+import pathlib
+import statistics
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from textual.app import App  # noqa: E402
+
+from gmail_tui import Messages  # noqa: E402
+from gmailtuilib.listdiff import first_difference  # noqa: E402
+
+NUM_ROWS = 500
+REPEAT = 30
+
+
+class CountingMessages(Messages):
+    lines_rendered = 0
+    apply_seconds = 0.0
+
+    def render_line(self, y):
+        self.lines_rendered += 1
+        return super().render_line(y)
+
+    def apply_changes(self, message_threads):
+        start = time.perf_counter()
+        super().apply_changes(message_threads)
+        self.apply_seconds = time.perf_counter() - start
+
+
+class BenchApp(App):
+    label = "INBOX"
+
+    def compose(self):
+        yield CountingMessages(id="messages")
+
+
+def make_threads(uids, read_uids=()):
+    threads = OrderedDict(
+        (
+            uid,
+            {
+                "gmessage_id": str(uid),
+                "Date": "2024-01-01T10:00:00",
+                "From": f"Sender {uid} <sender{uid}@example.com>",
+                "Subject": f"Subject of message {uid}",
+                "unread": uid % 3 == 0,
+                "starred": uid % 7 == 0,
+            },
+        )
+        for uid in uids
+    )
+    for uid in read_uids:
+        threads[uid]["unread"] = False
+    return threads
+
+
+async def time_refreshes(scenario, full_redraw):
+    app = BenchApp()
+    frame_times = []
+    apply_times = []
+    lines = 0
+    async with app.run_test(size=(120, 40)) as pilot:
+        messages = app.query_one(CountingMessages)
+        uids = list(range(NUM_ROWS + REPEAT, REPEAT, -1))
+        read_uids = set()
+        messages.message_threads = make_threads(uids)
+        messages.refresh_listview()
+        await pilot.pause()
+        for n in range(REPEAT):
+            if scenario == "new message":
+                # A new message arrives and the oldest one leaves the window.
+                uids = [NUM_ROWS + REPEAT + n + 1] + uids[:-1]
+            else:
+                # An unread message on screen is read, or marked unread again,
+                # in another client.
+                unread_uids = [uid for uid in uids[:40] if uid % 3 == 0]
+                read_uids ^= {unread_uids[n % len(unread_uids)]}
+            if full_redraw:
+                messages.rows = OrderedDict()
+                messages.uids = []
+            messages.lines_rendered = 0
+            start = time.perf_counter()
+            messages.message_threads = make_threads(uids, read_uids)
+            messages.refresh_listview()
+            await pilot.pause()
+            frame_times.append(time.perf_counter() - start)
+            apply_times.append(messages.apply_seconds)
+            lines += messages.lines_rendered
+    return (
+        statistics.median(frame_times),
+        statistics.median(apply_times),
+        lines / REPEAT,
+    )
+
+
+def time_diff():
+    old_uids = list(range(NUM_ROWS, 0, -1))
+    new_uids = old_uids[:-1] + [0]
+    start = time.perf_counter()
+    for _ in range(1000):
+        first_difference(old_uids, new_uids)
+    return (time.perf_counter() - start) / 1000
+
+
+def main():
+    print(
+        f"first_difference() on {NUM_ROWS} rows, worst case: "
+        f"{time_diff() * 1000:.3f} ms"
+    )
+    print(
+        f"{'change':>12} {'refresh':>12} {'ms/frame':>9} {'ms/apply':>9} "
+        f"{'lines drawn':>12}"
+    )
+    for scenario in ("flag change", "new message"):
+        for full_redraw in (True, False):
+            frame, apply, lines = asyncio.run(time_refreshes(scenario, full_redraw))
+            refresh = "full redraw" if full_redraw else "diff"
+            print(
+                f"{scenario:>12} {refresh:>12} {frame * 1000:>9.1f} "
+                f"{apply * 1000:>9.2f} {lines:>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
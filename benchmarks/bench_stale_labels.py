@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+"""
+Compare ways of removing stale message labels:
+
+- python diff: pull every cached UID into Python and delete the stale rows
+  one at a time;
+- NOT IN: one DELETE that checks every cached row against the server's UIDs
+  sent as a JSON array;
+- gap ranges: `gmailtuilib.ingest.delete_stale_message_labels()`, one
+  DELETE that range-scans only the gaps between the server's UIDs.
+
+Each run caches N messages under one label, tells the reconciliation that the
+server no longer has 1% of them, and times the removal.  The delete trigger
+on message_labels maintains thread_heads for every removed row whatever the
+approach, so the gap ranges are also timed with the triggers dropped to show
+how much of the cost is theirs.
+"""
+
+import json
+import pathlib
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from gmailtuilib.ingest import delete_stale_message_labels  # noqa: E402
+from gmailtuilib.sqllib import (  # noqa: E402
+    sql_drop_message_labels_delete_trigger,
+    sql_drop_message_labels_update_trigger,
+    sql_schema_versions,
+)
+
+LABEL = "INBOX"
+
+
+def create_cache(num_messages):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("PRAGMA foreign_keys = ON")
+    cursor = conn.cursor()
+    for ddl_statements in sql_schema_versions:
+        for sql in ddl_statements:
+            cursor.execute(sql)
+    cursor.execute("INSERT INTO labels (label) VALUES (?)", [LABEL])
+    cursor.executemany(
+        "INSERT INTO messages (id, gmessage_id, gthread_id, thread_id) "
+        "VALUES (?, ?, ?, ?)",
+        ((n, str(n), str(n), n) for n in range(1, num_messages + 1)),
+    )
+    cursor.executemany(
+        "INSERT INTO message_labels (message_id, label_id, uid) VALUES (?, 1, ?)",
+        ((n, n) for n in range(1, num_messages + 1)),
+    )
+    conn.commit()
+    return conn
+
+
+def python_diff(cursor, label, uid_set):
+    """
+    The previous approach: pull every (rowid, uid) into Python and delete the
+    stale rows one at a time.
+    """
+    cursor.execute(
+        """\
+        SELECT message_labels.rowid, message_labels.uid
+        FROM message_labels
+            INNER JOIN labels
+                ON message_labels.label_id = labels.id
+        WHERE labels.label = ?
+        """,
+        [label],
+    )
+    row_ids = [row_id for row_id, uid in cursor.fetchall() if uid not in uid_set]
+    for row_id in row_ids:
+        cursor.execute("DELETE FROM message_labels WHERE rowid = ?", [row_id])
+    return len(row_ids)
+
+
+def not_in(cursor, label, uid_set):
+    """
+    The previous set-based DELETE.
+    """
+    cursor.execute(
+        """\
+        DELETE FROM message_labels
+        WHERE label_id = (
+            SELECT id
+            FROM labels
+            WHERE label = ?
+        )
+        AND uid NOT IN (
+            SELECT value
+            FROM json_each(?)
+        )
+        """,
+        [label, json.dumps(sorted(uid_set))],
+    )
+    return cursor.rowcount
+
+
+def gap_ranges(cursor, label, uid_set):
+    return delete_stale_message_labels(cursor, label, uid_set)
+
+
+def time_reconciliation(func, num_messages, triggers=True):
+    conn = create_cache(num_messages)
+    if not triggers:
+        conn.execute(sql_drop_message_labels_delete_trigger)
+        conn.execute(sql_drop_message_labels_update_trigger)
+    server_uids = set(uid for uid in range(1, num_messages + 1) if uid % 100 != 0)
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    deleted = func(cursor, LABEL, server_uids)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed, deleted
+
+
+def main():
+    columns = ["python diff", "NOT IN", "gap ranges", "no triggers"]
+    print(f"{'UIDs':>8}" + "".join(f"{name + ' (ms)':>18}" for name in columns))
+    for num_messages in (1_000, 10_000, 100_000):
+        timings = []
+        deleted = set()
+        for func, triggers in (
+            (python_diff, True),
+            (not_in, True),
+            (gap_ranges, True),
+            (gap_ranges, False),
+        ):
+            elapsed, count = min(
+                time_reconciliation(func, num_messages, triggers) for _ in range(3)
+            )
+            timings.append(elapsed)
+            deleted.add(count)
+        assert len(deleted) == 1
+        print(f"{num_messages:>8}" + "".join(f"{t * 1000:>18.1f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,82 @@
 #! /usr/bin/env python
-import os
+import asyncio
+import email
 import pathlib
+import queue
 import sqlite3
+import threading
+import time
 import tomllib
 from collections import OrderedDict
 from contextlib import contextmanager
 from email.mime.text import MIMEText
-from email.parser import HeaderParser, Parser
+from email.parser import HeaderParser
 from email.policy import default as default_policy
 
 import logzero
-from dateutil.parser import parse as parse_date
 from dateutil.tz import tzlocal
 from imap_tools import A
-from imap_tools.consts import MailMessageFlags
 from logzero import logger
+from rich.text import Text
 from textual import work
 from textual.app import App, ComposeResult
 from textual.binding import Binding
+from textual.geometry import Region, Size
 from textual.logging import TextualHandler
 from textual.message import Message
-from textual.widgets import (Button, Footer, Header, ListItem, ListView,
-                             LoadingIndicator, Static)
-
-from gmailtuilib.imap import (compress_uids, fetch_google_messages,
-                              get_mailbox, is_starred, is_unread,
-                              uid_seq_to_criteria)
-from gmailtuilib.message import (CompositionScreen, MessageDismissResult,
-                                 MessageItem, MessageScreen, InboxMessageScreen)
-from gmailtuilib.oauth2 import get_oauth2_access_token
+from textual.reactive import reactive
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.widgets import Button, Footer, Header, LoadingIndicator, Static
+from textual.worker import get_current_worker
+
+from gmailtuilib.attachments import AttachmentStore
+from gmailtuilib.bodyqueue import (PRIORITY_OPENED, PRIORITY_VISIBLE,
+                                   PRIORITY_WINDOW, BodyQueue)
+from gmailtuilib.compression import (CODEC_NONE, codec_from_name,
+                                     decode_message_string,
+                                     encode_message_string)
+from gmailtuilib.imap import (UID_UPPER_BOUND, AsyncIMAPPool,
+                              IMAPConnectionPool, UIDSet, enable_qresync,
+                              fetch_changed_flags,
+                              fetch_google_message_batches, get_capabilities,
+                              get_highestmodseq, get_mailbox,
+                              get_select_status, is_starred, is_unread,
+                              iterate_from_thread,
+                              stream_google_message_batches)
+from gmailtuilib.ingest import (delete_message_labels,
+                                delete_stale_message_labels,
+                                find_cached_gmessage_ids, index_message_text,
+                                ingest_messages, search_index_params)
+from gmailtuilib.listdiff import first_difference
+from gmailtuilib.lru import LRUCache
+from gmailtuilib.message import (CompositionScreen, InboxMessageScreen,
+                                 MessageDismissResult, MessageScreen,
+                                 format_date_epoch, get_display_fields,
+                                 render_message)
+from gmailtuilib.oauth2 import get_oauth2_access_token, get_token_manager
+from gmailtuilib.outbox import (ACTION_ARCHIVE, ACTION_SEEN, ACTION_TRASH,
+                                ACTION_UNSEEN, pending_action_groups,
+                                queue_actions, remove_failed_actions,
+                                send_action)
 from gmailtuilib.search import SearchResultsScreen, SearchScreen
 from gmailtuilib.smtp import gmail_smtp
-from gmailtuilib.sqllib import (sql_all_uids_for_label, sql_ddl_labels,
-                                sql_ddl_labels_idx0, sql_ddl_message_labels,
-                                sql_ddl_messages, sql_ddl_messages_idx0,
-                                sql_delete_message_label,
-                                sql_fetch_msgs_for_label, sql_find_ml,
-                                sql_get_message_labels_in_uid_range,
+from gmailtuilib.sqllib import (sql_delete_label_sync_state,
+                                sql_delete_message_labels_for_label,
+                                sql_delete_outbox_action,
+                                sql_fetch_thread_heads_for_label,
+                                sql_get_label_sync_state,
                                 sql_get_message_string_by_uid_and_label,
-                                sql_insert_ml, sql_message_exists,
-                                sql_update_message_unread)
+                                sql_message_exists,
+                                sql_message_uids_without_body_for_label,
+                                sql_messages_missing_display_fields,
+                                sql_messages_to_index, sql_messages_to_recode,
+                                sql_outbox_action_failed,
+                                sql_reapply_outbox_read_status,
+                                sql_save_label_sync_state, sql_schema_versions,
+                                sql_update_message_display_fields,
+                                sql_update_message_flags_by_uid_and_label,
+                                sql_update_message_string)
 
 handlers = logzero.logger.handlers[:]
 for handler in handlers:
@@ -47,22 +84,75 @@ for handler in handlers:
 logzero.logger.addHandler(TextualHandler())
 
 
-class Messages(ListView):
+class Messages(ScrollView, can_focus=True):
+    """
+    Virtualized list of message threads.
+    The rows are kept in `message_threads` and only the rows in the viewport
+    are rendered, one line each.
+    """
+
     BINDINGS = [
         ("a", "archive", "Archive message"),
         ("t", "trash", "Trash message"),
         ("u", "toggle_unread", "Toggle (un)read"),
+        Binding("enter", "select_cursor", "Select", show=False),
+        Binding("up", "cursor_up", "Cursor up", show=False),
+        Binding("down", "cursor_down", "Cursor down", show=False),
+        Binding("pageup", "page_up", "Page up", show=False),
+        Binding("pagedown", "page_down", "Page down", show=False),
+        Binding("home", "cursor_first", "First message", show=False),
+        Binding("end", "cursor_last", "Last message", show=False),
+        Binding("space", "toggle_selected", "Select message"),
+        Binding("shift+up", "select_up", "Extend selection up", show=False),
+        Binding("shift+down", "select_down", "Extend selection down", show=False),
+        Binding("asterisk", "select_all", "Select all", show=False),
+        Binding("escape", "clear_selection", "Clear selection", show=False),
     ]
+    COMPONENT_CLASSES = {
+        "messages--even",
+        "messages--odd",
+        "messages--unread",
+        "messages--selected",
+        "messages--cursor",
+    }
     message_threads = OrderedDict()
-    uids_in_view = set([])
-    skip_refresh = False
+    cursor = reactive(0)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.message_threads = OrderedDict()
+        # The threads on display, and their UIDs in display order.
+        self.rows = OrderedDict()
+        self.uids = []
+        # UIDs of the selected rows, which bulk actions apply to.
+        self.selected = set()
+        self.selection_anchor = 0
 
     class Mounted(Message):
         pass
 
+    class Selected(Message):
+        """
+        Posted when a message is chosen with Enter or a click.
+        """
+
+        def __init__(self, uid, gmessage_id, unread):
+            super().__init__()
+            self.uid = uid
+            self.gmessage_id = gmessage_id
+            self.unread = unread
+
+    class Highlighted(Message):
+        """
+        Posted when the cursor moves to another message.
+        `rows` holds (uid, gmessage_id) for the message under the cursor,
+        followed by its neighbors.
+        """
+
+        def __init__(self, rows):
+            super().__init__()
+            self.rows = rows
+
     def on_mount(self):
         self.post_message(self.Mounted())
 
@@ -70,10 +160,6 @@ class Messages(ListView):
         """
         Refresh the list view to match the data.
         """
-        skip_refresh = self.skip_refresh
-        if skip_refresh:
-            self.skip_refresh = False
-            return
         message_threads = self.message_threads
         try:
             loader = self.parent.query_one("#loading")
@@ -83,122 +169,309 @@ class Messages(ListView):
                 loader.add_class("invisible")
         except Exception as ex:
             logger.debug(f"Could not get loader: {ex}")
-        uids_should_be_in_view = set(message_threads.keys())
-        uids_in_view = self.uids_in_view
-        uids_to_be_removed_from_view = uids_in_view - uids_should_be_in_view
-        uids_to_be_added_to_view = uids_should_be_in_view - uids_in_view
-        messages_need_to_be_added = len(uids_to_be_added_to_view) > 0
-        messages_need_to_be_deleted = len(uids_to_be_removed_from_view) > 0
-        if not (messages_need_to_be_added or messages_need_to_be_deleted):
-            for minfo, list_item in zip(message_threads.values(), self.children):
-                unread = minfo["unread"]
-                starred = minfo["starred"]
-                message_item = list_item.children[0]
-                message_item.unread = unread
-                message_item.starred = starred
+        self.apply_changes(message_threads)
+
+    def show_page(self, message_threads):
+        """
+        Show a different page of threads, starting at its first row.
+        """
+        self.message_threads = message_threads
+        self.selected = set()
+        self.set_reactive(Messages.cursor, 0)
+        self.scroll_to(y=0, animate=False)
+        self.refresh_listview()
+
+    def apply_changes(self, message_threads):
+        """
+        Show `message_threads` in place of the rows on display, redrawing only
+        the lines that changed.  The cursor stays on its UID, and unless the
+        view is scrolled to the top, so does the first visible row.
+        """
+        old_uids = self.uids
+        old_rows = self.rows
+        new_uids = list(message_threads.keys())
+        # Lines are drawn by position, so every row from the first position
+        # that holds a different UID onwards has to be redrawn, while the
+        # rows above it only need redrawing if their thread changed.
+        first_shifted = first_difference(old_uids, new_uids)
+        unchanged_uids = first_shifted == len(old_uids) == len(new_uids)
+        updated = [
+            pos
+            for pos, uid in enumerate(new_uids[:first_shifted])
+            if old_rows[uid] != message_threads[uid]
+        ]
+        if unchanged_uids and len(updated) == 0:
+            self.rows = message_threads
             return
-        # Just clear out the view and rebuild it.
-        curr_index = self.index
-        new_index = None
-        if curr_index is None:
-            curr_uid = None
+        curr_uid = self.cursor_uid
+        scroll_y = round(self.scroll_y)
+        top_uid = None
+        if scroll_y > 0 and scroll_y < len(old_uids):
+            top_uid = old_uids[scroll_y]
+        self.rows = message_threads
+        self.uids = new_uids
+        self.selected.intersection_update(message_threads)
+        self.virtual_size = Size(self.size.width, len(new_uids))
+        new_positions = {uid: pos for pos, uid in enumerate(new_uids)}
+        if top_uid in new_positions and new_positions[top_uid] != scroll_y:
+            self.scroll_to(y=new_positions[top_uid], animate=False)
+            first_shifted = 0
+            unchanged_uids = False
+        cursor = new_positions.get(curr_uid)
+        if cursor is None and curr_uid is not None:
+            # The row under the cursor is gone, so move to the first row after
+            # it that is still there, e.g. the row below an archived block.
+            following = (new_positions.get(uid) for uid in old_uids[self.cursor + 1 :])
+            cursor = next(
+                (pos for pos in following if pos is not None), len(new_uids) - 1
+            )
+        if cursor is None:
+            cursor = min(self.cursor, len(new_uids) - 1)
+        self.set_reactive(Messages.cursor, max(cursor, 0))
+        if not unchanged_uids:
+            self.refresh_rows_from(first_shifted)
+        for pos in updated:
+            self.refresh_row(pos)
+        if self.cursor_uid != curr_uid:
+            self.post_highlighted()
+
+    @property
+    def cursor_uid(self):
+        """
+        The UID of the row under the cursor, or None.
+        """
+        if 0 <= self.cursor < len(self.uids):
+            return self.uids[self.cursor]
+        return None
+
+    def watch_cursor(self, old_cursor, new_cursor):
+        self.refresh_row(old_cursor)
+        self.refresh_row(new_cursor)
+        self.scroll_to_region(Region(0, new_cursor, self.size.width, 1), animate=False)
+        self.post_highlighted()
+
+    def post_highlighted(self):
+        """
+        Post a Highlighted message for the row under the cursor.
+        """
+        if self.cursor_uid is None:
+            return
+        indexes = [self.cursor, self.cursor + 1, self.cursor - 1]
+        rows = [
+            (self.uids[index], self.rows[self.uids[index]]["gmessage_id"])
+            for index in indexes
+            if 0 <= index < len(self.uids)
+        ]
+        self.post_message(self.Highlighted(rows))
+
+    def refresh_row(self, index):
+        """
+        Redraw a single row.
+        """
+        self.refresh(Region(0, index - round(self.scroll_y), self.size.width, 1))
+
+    def refresh_rows_from(self, index):
+        """
+        Redraw the visible rows from `index` onwards.
+        """
+        y = max(index - round(self.scroll_y), 0)
+        height = self.size.height - y
+        if height > 0:
+            self.refresh(Region(0, y, self.size.width, height))
+
+    def render_line(self, y):
+        width = self.size.width
+        index = y + round(self.scroll_y)
+        if index >= len(self.uids):
+            return Strip.blank(width, self.rich_style)
+        uid = self.uids[index]
+        minfo = self.rows[uid]
+        if index % 2 == 0:
+            style = self.get_component_rich_style("messages--even")
         else:
-            curr_uid = self.children[curr_index].children[0].uid
-        self.clear()
-        for n, (uid, minfo) in enumerate(message_threads.items()):
-            widget = self.create_message_item(uid, minfo)
-            list_item = ListItem(widget)
-            if uid == curr_uid:
-                list_item.highlighted = True
-                new_index = n
-            if n % 2 == 0:
-                widget.add_class("item-even")
-            else:
-                widget.add_class("item-odd")
-            unread = minfo["unread"]
-            if unread:
-                list_item.add_class("unread")
-            self.append(list_item)
-        if new_index is None and len(message_threads) > 0:
-            new_index = 1
-        self.index = new_index
-        uids_in_view.clear()
-        uids_in_view.update(set(message_threads.keys()))
-
-    def create_message_item(self, uid, minfo):
-        gmessage_id = minfo["gmessage_id"]
-        date_str = minfo["Date"]
-        sender = minfo["From"]
-        subject = minfo["Subject"]
-        unread = minfo["unread"]
-        starred = minfo["starred"]
+            style = self.get_component_rich_style("messages--odd")
+        if minfo["unread"]:
+            style += self.get_component_rich_style("messages--unread")
+        selected = uid in self.selected
+        if selected:
+            style += self.get_component_rich_style("messages--selected")
+        if index == self.cursor:
+            style += self.get_component_rich_style("messages--cursor")
+        text = Text(self.format_row(minfo, selected), style=style, no_wrap=True, end="")
+        text.truncate(width, overflow="ellipsis", pad=True)
+        return Strip(text.render(self.app.console), width)
+
+    def format_row(self, minfo, selected=False):
+        """
+        Return the one-line representation of a thread.
+        """
+        icons = ["✔" if selected else " "]
+        if minfo["starred"]:
+            icons.append("⭐")
+        if minfo["unread"]:
+            icons.append("")
+        else:
+            icons.append("")
         if self.app.label == "INBOX":
-            inbox = True
+            icons.append("📥")
+        status = " ".join(icons)
+        date_str = minfo["Date"][:16].replace("T", " ")
+        sender = " ".join(minfo["From"].split())
+        subject = " ".join(minfo["Subject"].split())
+        return f"{status}  {date_str}  {sender[:30]:<30}  {subject}"
+
+    def on_click(self, event):
+        index = event.y + round(self.scroll_y)
+        if 0 <= index < len(self.uids):
+            if event.shift:
+                self.select_range(self.selection_anchor, index)
+                self.cursor = index
+                return
+            if event.ctrl:
+                self.cursor = index
+                self.action_toggle_selected(advance=False)
+                return
+            self.cursor = index
+            self.action_select_cursor()
+
+    def action_select_cursor(self):
+        uid = self.cursor_uid
+        if uid is None:
+            return
+        minfo = self.rows[uid]
+        unread = minfo["unread"]
+        if unread:
+            # Opening a message marks it read.  Show that right away rather
+            # than when the cache refresh comes around.
+            minfo["unread"] = False
+            self.refresh_row(self.cursor)
+        self.post_message(self.Selected(uid, minfo["gmessage_id"], unread))
+
+    def action_cursor_up(self):
+        self.cursor = max(self.cursor - 1, 0)
+
+    def action_cursor_down(self):
+        self.cursor = max(min(self.cursor + 1, len(self.uids) - 1), 0)
+
+    def action_page_up(self):
+        self.cursor = max(self.cursor - self.scrollable_content_region.height, 0)
+
+    def action_page_down(self):
+        self.cursor = max(
+            min(
+                self.cursor + self.scrollable_content_region.height,
+                len(self.uids) - 1,
+            ),
+            0,
+        )
+
+    def action_cursor_first(self):
+        self.cursor = 0
+
+    def action_cursor_last(self):
+        self.cursor = max(len(self.uids) - 1, 0)
+
+    def action_toggle_selected(self, advance=True):
+        """
+        Select or deselect the row under the cursor.
+        """
+        uid = self.cursor_uid
+        if uid is None:
+            return
+        if uid in self.selected:
+            self.selected.discard(uid)
         else:
-            inbox = False
-        widget = MessageItem(
-            gmessage_id,
-            uid,
-            date_str,
-            sender,
-            subject,
-            starred=starred,
-            unread=unread,
-            inbox=inbox,
+            self.selected.add(uid)
+        self.selection_anchor = self.cursor
+        self.refresh_row(self.cursor)
+        if advance:
+            self.action_cursor_down()
+
+    def select_range(self, start, end):
+        """
+        Add the rows from index `start` to `end` (inclusive) to the selection.
+        """
+        start, end = sorted((start, end))
+        start = max(start, 0)
+        end = min(end, len(self.uids) - 1)
+        self.selected.update(self.uids[start : end + 1])
+        self.refresh_rows_from(start)
+
+    def action_select_up(self):
+        self.select_range(self.cursor, self.cursor - 1)
+        self.action_cursor_up()
+
+    def action_select_down(self):
+        self.select_range(self.cursor, self.cursor + 1)
+        self.action_cursor_down()
+
+    def action_select_all(self):
+        self.select_range(0, len(self.uids) - 1)
+
+    def action_clear_selection(self):
+        if len(self.selected) == 0:
+            return
+        self.selected = set()
+        self.refresh_rows_from(0)
+
+    def target_uids(self):
+        """
+        Return the UIDs an action applies to: the selected rows in display
+        order, or else the row under the cursor.
+        """
+        if len(self.selected) > 0:
+            return [uid for uid in self.uids if uid in self.selected]
+        uid = self.cursor_uid
+        if uid is None:
+            return []
+        return [uid]
+
+    def remove_rows(self, uids):
+        """
+        Remove rows from the view.
+        """
+        uids = set(uids)
+        message_threads = OrderedDict(
+            (uid, minfo) for uid, minfo in self.rows.items() if uid not in uids
         )
-        return widget
+        self.message_threads = message_threads
+        self.apply_changes(message_threads)
 
     def action_archive(self):
         """
-        Archive a message.
+        Archive the selected messages, or the message under the cursor.
         """
-        index = self.index
-        if index is None or index < 0:
+        uids = self.target_uids()
+        if len(uids) == 0:
             return
-        li = self.children[index]
-        mi = li.children[0]
-        uid = mi.uid
-        del self.message_threads[uid]
-        logger.debug(f"Preparing to archive INBOX message with UID: {uid} ...")
-        self.app.archive_message(uid)
-        self.pop(index)
-        index -= 1
-        if index <= 0:
-            index = 1
-        self.index = index
-        self.skip_refresh = True
+        self.remove_rows(uids)
+        logger.debug(f"Preparing to archive {len(uids)} INBOX message(s) ...")
+        self.app.archive_messages(uids)
 
     def action_trash(self):
         """
-        Trash message.
+        Trash the selected messages, or the message under the cursor.
         """
-        index = self.index
-        if index is None or index < 0:
+        uids = self.target_uids()
+        if len(uids) == 0:
             return
-        li = self.children[index]
-        mi = li.children[0]
-        uid = mi.uid
-        del self.message_threads[uid]
-        self.app.trash_message(uid, self.app.label)
-        self.remove_items([index])
-        index -= 1
-        if index <= 0:
-            index = 1
-        self.index = index
-        self.skip_refresh = True
+        self.remove_rows(uids)
+        self.app.trash_messages(uids, self.app.label)
 
     def action_toggle_unread(self):
-        index = self.index
-        if index is None or index < 0:
+        """
+        Mark the selected messages, or the message under the cursor, read if
+        any of them are unread, and unread otherwise.
+        """
+        uids = self.target_uids()
+        if len(uids) == 0:
             return
-        li = self.children[index]
-        mi = li.children[0]
-        uid = mi.uid
-        gmessage_id = mi.gmessage_id
-        unread = mi.unread
-        mi.unread = not unread
-        self.app.mark_message_read_status(uid, self.app.label, read=unread)
-        self.app.mark_cached_message_read_status(None, gmessage_id, read=unread)
+        read = any(self.rows[uid]["unread"] for uid in uids)
+        for uid in uids:
+            self.rows[uid]["unread"] = not read
+        self.selected = set()
+        self.refresh_rows_from(0)
+        self.app.mark_messages_read_status(uids, self.app.label, read=read)
 
 
 class ButtonBar(Static):
@@ -235,14 +508,76 @@ class GMailApp(App):
         ("q", "quit", "Quit"),
         ("c", "compose", "Compose message"),
         ("s", "search", "Search for messages"),
+        Binding("less_than_sign", "previous_page", "Newer messages", show=False),
+        Binding("greater_than_sign", "next_page", "Older messages", show=False),
     ]
 
     page_size = 50
     page = 0
+    # The list view shows the threads whose newest message has a UID below
+    # this one.  None shows the newest threads.
+    page_before_uid = None
+    # Anchors (`page_before_uid` values) of the newer pages, oldest last.
+    page_anchors = ()
+    has_next_page = False
+    # Cached pages, keyed by (label, page_before_uid): the current page and
+    # its neighbors.
+    page_cache_size = 3
+    page_cache = None
     label = "INBOX"
     sync_messages_flag = True
     min_uid = None
     max_uid = None
+    condstore = False
+    qresync = False
+    # Number of newest messages re-fetched on each check without CONDSTORE.
+    resync_window_size = 500
+    # Number of IDLE timeouts without any server responses after which
+    # changes are checked for anyway.
+    max_quiet_idle_cycles = 10
+    # Storage format for newly cached message bodies.
+    message_codec = CODEC_NONE
+    # Memory budget for parsed and rendered messages, in MiB.
+    message_cache_mb = 64
+    message_cache = None
+    # Messages cached with headers only, waiting for their bodies.
+    body_queue = None
+    body_batch_size = 10
+    # Seconds to wait before retrying after a body download failed.
+    body_retry_delay = 5
+    # Downloads of a message body to try before giving up on it.
+    max_body_attempts = 5
+    # Failed downloads so far, by UID.
+    body_attempts = None
+    # (uid, gmessage_id) of the opened message if its body is on its way.
+    awaiting_body = None
+    # Actions waiting to be written to the outbox, see
+    # `write_message_actions()`.
+    pending_actions = None
+    # Seconds to wait before retrying when the database is locked.
+    action_write_retry_delay = 0.2
+    # Attempts to write a batch of actions before giving up on it.
+    max_action_write_attempts = 10
+    # Set when actions are added to the outbox.
+    outbox_event = None
+    # Seconds to let a burst of actions gather before sending them.
+    outbox_flush_delay = 0.2
+    # Seconds before failed actions are retried; doubled after each failure.
+    outbox_retry_delay = 5
+    max_outbox_retry_delay = 300
+    max_outbox_attempts = 10
+    # Cache changes within this many seconds are shown with one list refresh.
+    listview_refresh_delay = 0.05
+    listview_refresh_timer = None
+
+    class CacheChanged(Message):
+        """
+        Posted after a commit changed the cached messages of a label.
+        """
+
+        def __init__(self, label):
+            super().__init__()
+            self.label = label
 
     def compose(self) -> ComposeResult:
         """Create child widgets for the app."""
@@ -250,33 +585,57 @@ class GMailApp(App):
         yield MainPanel()
         yield Footer()
 
-    def on_list_view_selected(self, event):
-        list_item = event.item
-        logger.debug(f"item: {list_item}")
-        mi = list_item.children[0]
-        uid = mi.uid
-        gmessage_id = mi.gmessage_id
+    def notify_cache_changed(self, label=None):
+        """
+        Tell the UI that the cached messages of `label` (by default the
+        current label) changed.  Safe to call from any thread.
+        """
+        if label is None:
+            label = self.label
+        self.post_message(self.CacheChanged(label))
+
+    def on_gmail_app_cache_changed(self, event):
+        if event.label != self.label:
+            return
+        if self.page_cache is not None:
+            self.page_cache.clear()
+        if self.listview_refresh_timer is not None:
+            # A refresh is already scheduled and will pick up this change.
+            return
+        self.listview_refresh_timer = self.set_timer(
+            self.listview_refresh_delay, self.refresh_listview_after_change
+        )
+
+    def refresh_listview_after_change(self):
+        self.listview_refresh_timer = None
+        self.refresh_listview()
+
+    def on_messages_selected(self, event):
+        uid = event.uid
+        gmessage_id = event.gmessage_id
         logger.debug(f"Selected message with UID {uid}.")
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("PRAGMA journal_mode=WAL;")
-            conn.execute("PRAGMA foreign_keys = ON;")
-            cursor = conn.cursor()
-            cursor.execute(sql_get_message_string_by_uid_and_label, [self.label, uid])
-            row = cursor.fetchone()
-            if row is None:
+        rendered = self.message_cache.get(gmessage_id)
+        if rendered is None:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("PRAGMA journal_mode=WAL;")
+                conn.execute("PRAGMA foreign_keys = ON;")
+                cursor = conn.cursor()
+                rendered = self.load_rendered_message(cursor, self.label, uid)
+            if rendered is None:
                 return
-            message_string = row[0]
-            parser = Parser(policy=default_policy)
-            msg = parser.parsestr(message_string)
-            # Get plain text from message
-            screen = self.SCREENS["inbox_msg_screen"]
-            logger.debug(f"Selected message subject: {msg['subject']}")
-            screen.msg = msg
-            # Mark remote message as read
-            self.mark_message_read_status(uid, self.label, read=True)
-            # Mark cached message as read
-            self.mark_cached_message_read_status(cursor, gmessage_id, read=True)
-            conn.commit()
+            if rendered.has_body:
+                self.message_cache.put(gmessage_id, rendered)
+        if rendered.has_body:
+            self.awaiting_body = None
+        else:
+            # Show the headers now and the body once it has been downloaded.
+            self.awaiting_body = (uid, gmessage_id)
+            self.body_queue.put([uid], PRIORITY_OPENED)
+        screen = self.SCREENS["inbox_msg_screen"]
+        logger.debug(f"Selected message subject: {rendered.msg['subject']}")
+        screen.show_message(rendered)
+        if event.unread:
+            self.mark_messages_read_status([uid], self.label, read=True)
 
         def handle_message_exit(result):
             if result is None:
@@ -285,81 +644,472 @@ class GMailApp(App):
                 return
             if result == MessageDismissResult.ARCHIVE:
                 logger.debug("Archiving message ...")
-                self.archive_message(uid)
+                self.archive_messages([uid])
                 return
             if result == MessageDismissResult.TRASH:
                 logger.debug("Trashing message ...")
-                self.trash_message(uid, self.label)
+                self.trash_messages([uid], self.label)
                 return
 
         self.push_screen(screen, handle_message_exit)
 
+    def on_messages_highlighted(self, event):
+        self.prefetch_messages(event.rows)
+
+    @work(exclusive=True, group="prefetch-messages", thread=True)
+    def prefetch_messages(self, rows):
+        """
+        Parse and render the messages in `rows`, a list of (uid, gmessage_id),
+        into the message cache ahead of their selection.
+        """
+        worker = get_current_worker()
+        label = self.label
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            for uid, gmessage_id in rows:
+                if worker.is_cancelled:
+                    return
+                # A hit also keeps the message from being evicted next.
+                if self.message_cache.get(gmessage_id) is not None:
+                    continue
+                rendered = self.load_rendered_message(cursor, label, uid)
+                if rendered is not None and rendered.has_body:
+                    self.message_cache.put(gmessage_id, rendered)
+
+    def load_rendered_message(self, cursor, label, uid):
+        """
+        Load the cached message with `uid` in `label`, then parse and render
+        it.  Returns a RenderedMessage, or None if it is not cached.
+        """
+        cursor.execute(sql_get_message_string_by_uid_and_label, [label, int(uid)])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        message_string, codec, has_body = row
+        return render_message(
+            decode_message_string(message_string, codec), has_body=bool(has_body)
+        )
+
+    def show_downloaded_message(self):
+        """
+        Replace the headers-only message on display with the message whose
+        body just arrived.
+        """
+        if self.awaiting_body is None:
+            return
+        uid, gmessage_id = self.awaiting_body
+        self.awaiting_body = None
+        screen = self.SCREENS["inbox_msg_screen"]
+        if self.screen is not screen:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            rendered = self.load_rendered_message(cursor, self.label, uid)
+        if rendered is None or not rendered.has_body:
+            return
+        self.message_cache.put(gmessage_id, rendered)
+        screen.show_message(rendered)
+
+    @work(exclusive=True, group="body-download", thread=True)
+    def download_message_bodies(self):
+        """
+        Download the bodies of messages cached with their headers only, most
+        urgent first.
+        """
+        while self.sync_messages_flag:
+            priority, uids = self.body_queue.take(self.body_batch_size, timeout=1)
+            if len(uids) == 0:
+                continue
+            label = self.label
+            try:
+                with self.imap_pool.mailbox(label) as mailbox, sqlite3.connect(
+                    self.db_path
+                ) as conn:
+                    conn.execute("PRAGMA journal_mode=WAL;")
+                    conn.execute("PRAGMA foreign_keys = ON;")
+                    cursor = conn.cursor()
+                    for batch in fetch_google_message_batches(
+                        mailbox,
+                        criteria=A(uid=str(UIDSet(uids))),
+                        headers_only=False,
+                    ):
+                        self.ingest_message_batch(cursor, batch)
+                        conn.commit()
+                        self.notify_cache_changed(label)
+                        awaiting = self.awaiting_body
+                        if awaiting is not None and any(
+                            gmessage_id == awaiting[1] for gmessage_id, _, _, _ in batch
+                        ):
+                            self.call_from_thread(self.show_downloaded_message)
+            except Exception as ex:
+                logger.debug(f"Could not download message bodies: {ex}")
+                self.retry_message_bodies(uids, priority)
+                time.sleep(self.body_retry_delay)
+                continue
+            for uid in uids:
+                self.body_attempts.pop(uid, None)
+
+    def retry_message_bodies(self, uids, priority):
+        """
+        Queue the bodies of `uids` again after a failed download, at the
+        priority they had, unless they have failed too often.
+        """
+        retry_uids = []
+        for uid in uids:
+            attempts = self.body_attempts.get(uid, 0) + 1
+            self.body_attempts[uid] = attempts
+            if attempts < self.max_body_attempts:
+                retry_uids.append(uid)
+                continue
+            logger.debug(f"Giving up on the body of message with UID {uid}.")
+            awaiting = self.awaiting_body
+            if awaiting is not None and awaiting[0] == uid:
+                self.awaiting_body = None
+                self.call_from_thread(
+                    self.notify,
+                    "The message body could not be downloaded.",
+                    severity="error",
+                )
+        self.body_queue.put(retry_uids, priority)
+
+    def queue_missing_bodies(self, cursor):
+        """
+        Queue the messages of the current label whose bodies have not been
+        downloaded yet.
+        """
+        cursor.execute(sql_message_uids_without_body_for_label, [self.label])
+        uids = [row[0] for row in cursor.fetchall()]
+        if len(uids) > 0:
+            logger.debug(f"{len(uids)} message bodies to download.")
+            self.body_queue.put(uids, PRIORITY_WINDOW)
+
     def on_mount(self):
         with open(pathlib.Path("~/.gmail_tui/conf.toml").expanduser(), "rb") as f:
             self.config = tomllib.load(f)
+        cache_config = self.config.get("cache", {})
+        self.message_codec = codec_from_name(cache_config.get("compression"))
+        message_cache_mb = cache_config.get("message_cache_mb", self.message_cache_mb)
+        self.message_cache = LRUCache(
+            maxweight=message_cache_mb * 2**20, weigh=lambda rendered: rendered.size
+        )
 
+        token_manager = get_token_manager(self.config)
+        self.imap_pool = IMAPConnectionPool(self.config, token_manager.get_access_token)
+        self.open_imap_pool()
+        # Sync fetches run on this loop, see `stream_message_batches()`.
+        self.event_loop = asyncio.get_running_loop()
+        self.async_imap_pool = AsyncIMAPPool(
+            self.config, token_manager.get_access_token
+        )
         self.db_path = pathlib.Path("~/.gmail_tui/mail.db").expanduser()
-        if not os.path.exists(self.db_path):
-            self.create_db()
+        self.attachment_store = AttachmentStore(
+            pathlib.Path("~/.gmail_tui/attachments").expanduser()
+        )
+        self.migrate_db()
+        self.backfill_display_fields()
+        self.recode_cached_messages()
+        self.build_search_index()
+        self.page_cache = LRUCache(self.page_cache_size)
+        self.body_queue = BodyQueue()
+        self.body_attempts = {}
+        self.pending_actions = queue.Queue()
+        self.outbox_event = threading.Event()
+        # Send whatever the last session left in the outbox.
+        self.outbox_event.set()
+        self.refresh_listview()
         self.sync_messages_flag = True
         self.sync_messages()
-        self.set_interval(10, callback=self.refresh_listview, pause=False)
+        self.download_message_bodies()
+        self.write_message_actions()
+        self.flush_outbox()
+
+    @work(exclusive=True, group="imap-pool", thread=True)
+    def open_imap_pool(self):
+        """
+        Start background token renewal and warm up the pool of IMAP sessions
+        used by user actions.
+        """
+        try:
+            get_token_manager(self.config).start()
+            self.imap_pool.open()
+        except Exception as ex:
+            logger.debug(f"Could not warm up IMAP connection pool: {ex}")
+
+    @work(exclusive=True, group="backfill-display-fields", thread=True)
+    def backfill_display_fields(self, batch_size=500):
+        """
+        Extract the list view display fields for messages cached before they
+        were stored in their own columns.
+        """
+        total = 0
+        last_id = 0
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            while True:
+                # Paging by id scans the table once overall rather than once
+                # per batch.
+                cursor.execute(
+                    sql_messages_missing_display_fields, [last_id, batch_size]
+                )
+                rows = cursor.fetchall()
+                if len(rows) == 0:
+                    break
+                last_id = rows[-1][0]
+                params = []
+                for db_id, message_string, codec in rows:
+                    message_string = decode_message_string(message_string, codec)
+                    msg = parse_string_message_headers(message_string)
+                    fields = get_display_fields(msg, len(message_string))
+                    params.append(
+                        [
+                            fields["date_epoch"],
+                            fields["sender"],
+                            fields["subject"],
+                            fields["size"],
+                            db_id,
+                        ]
+                    )
+                cursor.executemany(sql_update_message_display_fields, params)
+                conn.commit()
+                self.notify_cache_changed()
+                total += len(rows)
+        if total > 0:
+            logger.debug(f"Extracted display fields for {total} cached messages.")
+
+    @work(exclusive=True, group="recode-cached-messages", thread=True)
+    def recode_cached_messages(self, batch_size=200):
+        """
+        Re-encode cached message bodies that were stored with a different
+        codec than the configured one, e.g. compress an existing cache after
+        compression was turned on.
+        """
+        codec = self.message_codec
+        total = 0
+        last_id = 0
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            while True:
+                cursor.execute(sql_messages_to_recode, [last_id, codec, batch_size])
+                rows = cursor.fetchall()
+                if len(rows) == 0:
+                    break
+                params = []
+                for db_id, stored, stored_codec, has_body in rows:
+                    message_string = decode_message_string(stored, stored_codec)
+                    params.append(
+                        [
+                            encode_message_string(message_string, codec),
+                            codec,
+                            db_id,
+                            stored_codec,
+                            has_body,
+                        ]
+                    )
+                cursor.executemany(sql_update_message_string, params)
+                conn.commit()
+                total += len(rows)
+                last_id = rows[-1][0]
+        if total > 0:
+            logger.debug(f"Re-encoded {total} cached messages with codec {codec}.")
+
+    @work(exclusive=True, group="build-search-index", thread=True)
+    def build_search_index(self, batch_size=200):
+        """
+        Add cached messages that are not in the local search index yet, e.g.
+        messages cached before the index existed.
+        """
+        total = 0
+        last_id = 0
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            while True:
+                cursor.execute(sql_messages_to_index, [last_id, batch_size])
+                rows = cursor.fetchall()
+                if len(rows) == 0:
+                    break
+                index_params = []
+                for db_id, gmessage_id, message_string, codec in rows:
+                    message_string = decode_message_string(message_string, codec)
+                    msg = email.message_from_string(message_string)
+                    index_params.append(search_index_params(msg, gmessage_id))
+                index_message_text(cursor, index_params)
+                conn.commit()
+                total += len(rows)
+                last_id = rows[-1][0]
+        if total > 0:
+            logger.debug(f"Added {total} cached messages to the search index.")
 
     @work(exclusive=True, group="refresh-listview", thread=True)
-    def refresh_listview(self):
+    def refresh_listview(self, new_page=False):
         """
         Refresh the UI listview.
         """
+        label = self.label
+        before_uid = self.page_before_uid
+        generation = self.page_cache.generation
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            message_threads = self.load_page(cursor, label, before_uid)
+        logger.debug(f"Retrieved {len(message_threads)} rows for list view.")
+        self.page_cache.put((label, before_uid), message_threads, generation)
+        if label != self.label or before_uid != self.page_before_uid:
+            # The user moved to another page in the meantime.
+            return
+        self.call_from_thread(self.display_page, message_threads, new_page)
+
+    def load_page(self, cursor, label, before_uid):
+        """
+        Load the page of thread heads of `label` with UIDs below `before_uid`
+        (None for the newest threads).
+        Returns an ordered mapping of UID to row info, newest first.
+        """
+        if before_uid is None:
+            before_uid = UID_UPPER_BOUND
+        cursor.execute(
+            sql_fetch_thread_heads_for_label,
+            [label, before_uid, self.page_size],
+        )
+        message_threads = OrderedDict()
+        tz = tzlocal()
+        for (
+            gmessage_id,
+            gthread_id,
+            date_epoch,
+            sender,
+            subject,
+            unparsed_message_string,
+            codec,
+            unread,
+            starred,
+            has_body,
+            uid,
+        ) in fetchrows(cursor, cursor.arraysize):
+            if unparsed_message_string is not None:
+                # Display fields have not been extracted for this row yet.
+                unparsed_message_string = decode_message_string(
+                    unparsed_message_string, codec
+                )
+                msg = parse_string_message_headers(unparsed_message_string)
+                fields = get_display_fields(msg, len(unparsed_message_string))
+                date_epoch = fields["date_epoch"]
+                sender = fields["sender"]
+                subject = fields["subject"]
+            date_str = format_date_epoch(date_epoch, tz)
+            unread = bool(unread)
+            starred = bool(starred)
+            minfo = {
+                "gmessage_id": gmessage_id,
+                "Date": date_str,
+                "From": sender,
+                "Subject": subject,
+                "unread": unread,
+                "starred": starred,
+                "has_body": bool(has_body),
+            }
+            message_threads[int(uid)] = minfo
+            if len(message_threads) >= self.page_size:
+                break
+        return message_threads
+
+    def display_page(self, message_threads, new_page=False):
+        """
+        Show a loaded page in the list view and prefetch its neighbors.
+        """
         try:
             messages_widget = self.query_one("#messages")
         except Exception:
             return
-        skip_rows = self.page * self.page_size
-        message_threads = OrderedDict()
+        if len(message_threads) == 0 and not new_page:
+            return
+        if len(message_threads) > 0:
+            self.min_uid = min(message_threads.keys())
+            self.max_uid = max(message_threads.keys())
+        self.has_next_page = len(message_threads) >= self.page_size
+        try:
+            self.query_one("#btn-backwards").disabled = len(self.page_anchors) == 0
+            self.query_one("#btn-forwards").disabled = not self.has_next_page
+        except Exception as ex:
+            logger.debug(f"Could not update page buttons: {ex}")
+        if new_page:
+            messages_widget.show_page(message_threads)
+        else:
+            messages_widget.message_threads = message_threads
+            messages_widget.refresh_listview()
+        self.body_queue.put(
+            [uid for uid, minfo in message_threads.items() if not minfo["has_body"]],
+            PRIORITY_VISIBLE,
+        )
+        self.prefetch_pages()
+
+    @work(exclusive=True, group="prefetch-pages", thread=True)
+    def prefetch_pages(self):
+        """
+        Load the pages next to the current page into the page cache.
+        """
+        label = self.label
+        generation = self.page_cache.generation
+        anchors = []
+        if len(self.page_anchors) > 0:
+            anchors.append(self.page_anchors[-1])
+        if self.has_next_page:
+            anchors.append(self.min_uid)
         with sqlite3.connect(self.db_path) as conn:
             conn.execute("PRAGMA journal_mode=WAL;")
             conn.execute("PRAGMA foreign_keys = ON;")
             cursor = conn.cursor()
-            cursor.execute(sql_fetch_msgs_for_label, [self.label, skip_rows])
-            n = 0
-            uids = []
-            for (
-                gmessage_id,
-                gthread_id,
-                message_string,
-                unread,
-                starred,
-                uid,
-            ) in fetchrows(cursor, cursor.arraysize):
-                uids.append(int(uid))
-                msg = parse_string_message_headers(message_string)
-                date = msg.get("Date")
-                dt = parse_date(date)
-                dt = dt.astimezone(tzlocal())
-                date_str = dt.isoformat()
-                sender = msg.get("From")
-                subject = msg.get("Subject")
-                unread = bool(unread)
-                starred = bool(starred)
-                minfo = {
-                    "gmessage_id": gmessage_id,
-                    "Date": date_str,
-                    "From": sender,
-                    "Subject": subject,
-                    "unread": unread,
-                    "starred": starred,
-                }
-                message_threads[uid] = minfo
-                n += 1
-                if n >= self.page_size:
-                    break
-        logger.debug(f"Retrieved {n} rows for list view.")
-        if len(uids) == 0:
+            for before_uid in anchors:
+                key = (label, before_uid)
+                # A hit also keeps the neighbor from being evicted next.
+                message_threads = self.page_cache.get(key)
+                if message_threads is None:
+                    message_threads = self.load_page(cursor, label, before_uid)
+                    self.page_cache.put(key, message_threads, generation)
+                if len(message_threads) == 0 and before_uid == self.min_uid:
+                    # The current page is full but nothing is older.
+                    self.has_next_page = False
+                    self.call_from_thread(self.disable_next_page)
+
+    def disable_next_page(self):
+        try:
+            self.query_one("#btn-forwards").disabled = True
+        except Exception as ex:
+            logger.debug(f"Could not update page buttons: {ex}")
+
+    def show_page(self, before_uid, page_anchors):
+        """
+        Show the page of threads with UIDs below `before_uid`, straight from
+        the page cache when it is there.
+        """
+        self.page_before_uid = before_uid
+        self.page_anchors = page_anchors
+        self.page = len(page_anchors)
+        message_threads = self.page_cache.get((self.label, before_uid))
+        if message_threads is None:
+            self.refresh_listview(new_page=True)
+            return
+        self.display_page(message_threads, new_page=True)
+
+    def action_next_page(self):
+        if not self.has_next_page or self.min_uid is None:
+            return
+        self.show_page(self.min_uid, self.page_anchors + (self.page_before_uid,))
+
+    def action_previous_page(self):
+        if len(self.page_anchors) == 0:
             return
-        self.min_uid = min(uids)
-        self.max_uid = max(uids)
-        messages_widget.message_threads = message_threads
-        self.call_from_thread(messages_widget.refresh_listview)
+        self.show_page(self.page_anchors[-1], self.page_anchors[:-1])
 
     @work(exclusive=True, group="message-sync", thread=True)
     def sync_messages(self):
@@ -367,80 +1117,190 @@ class GMailApp(App):
         while self.sync_messages_flag:
             try:
                 access_token = get_oauth2_access_token(self.config)
-                with get_mailbox(self.config, access_token) as mailbox, sqlite3.connect(
-                    self.db_path
-                ) as conn:
+                with get_mailbox(
+                    self.config, access_token, initial_folder=None
+                ) as mailbox, sqlite3.connect(self.db_path) as conn:
                     conn.execute("PRAGMA journal_mode=WAL;")
                     conn.execute("PRAGMA foreign_keys = ON;")
                     cursor = conn.cursor()
                     self.insert_current_label(cursor)
                     conn.commit()
-                    uid_set = set([])
-                    uncached_message_uids = set([])
+                    capabilities = get_capabilities(mailbox)
+                    self.condstore = "CONDSTORE" in capabilities
+                    self.qresync = "QRESYNC" in capabilities and enable_qresync(mailbox)
                     mailbox.folder.set(self.label)
-                    # Get the set of messages that are in the mailbox.
-                    for gmessage_id, gthread_id, glabels, msg in fetch_google_messages(
-                        mailbox, headers_only=True, limit=500
+                    status = get_select_status(mailbox)
+                    state = self.get_sync_state(cursor)
+                    uidvalidity = status["UIDVALIDITY"]
+                    stored_uidvalidity = None if state is None else state["uidvalidity"]
+                    if (
+                        stored_uidvalidity is not None
+                        and stored_uidvalidity == uidvalidity
                     ):
-                        # Record message UID
-                        uid_set.add(int(msg.uid))
-                        # Update any cached messages
-                        # Record any uncached messages that should be cached.
-                        if self.get_cached_message(cursor, gmessage_id):
-                            self.insert_or_update_message(
-                                cursor,
-                                gmessage_id,
-                                gthread_id,
-                                glabels,
-                                msg,
-                                update_only=True,
+                        last_uid = self.incremental_sync(mailbox, cursor, state, status)
+                    else:
+                        if stored_uidvalidity is not None:
+                            logger.debug(
+                                f"UIDVALIDITY changed for label {self.label}.  "
+                                "Rebuilding its cached message labels ..."
                             )
-                        else:
-                            uncached_message_uids.add(int(msg.uid))
-                    # Remove any cached labels that are no longer applied.
-                    self.remove_cached_labels(cursor, uid_set)
-                    # Download and cache any uncached messages.
-                    all_uids = list(uid_set)
-                    all_uids.sort()
-                    uncached_message_uids = list(uncached_message_uids)
-                    uncached_message_uids.sort()
-                    uid_seq = compress_uids(all_uids, uncached_message_uids)
-                    if len(uid_seq) > 0:
-                        uid_criteria = uid_seq_to_criteria(uid_seq)
-                        for (
-                            gmessage_id,
-                            gthread_id,
-                            glabels,
-                            msg,
-                        ) in fetch_google_messages(
-                            mailbox,
-                            criteria=A(uid=uid_criteria),
-                            headers_only=False,
-                            limit=500,
-                        ):
-                            self.insert_or_update_message(
-                                cursor, gmessage_id, gthread_id, glabels, msg
+                            cursor.execute(
+                                sql_delete_message_labels_for_label, [self.label]
                             )
+                            cursor.execute(sql_delete_label_sync_state, [self.label])
+                        last_uid = self.full_sync(mailbox, cursor)
+                    if status["UIDNEXT"] is not None:
+                        last_uid = max(last_uid, status["UIDNEXT"] - 1)
+                    self.update_sync_state(
+                        cursor,
+                        uidvalidity=uidvalidity,
+                        uidnext=status["UIDNEXT"],
+                        last_uid=last_uid,
+                        highestmodseq=status["HIGHESTMODSEQ"],
+                    )
+                    self.queue_missing_bodies(cursor)
                     conn.commit()
+                    self.notify_cache_changed()
                     logger.debug(f"Message sync complete for query: {self.label}")
                     self.accept_imap_updates(mailbox, conn)
             except Exception as ex:
                 logger.debug(f"[DEGUB] exception closed imap mailbox: {type(ex)}, {ex}")
 
+    def full_sync(self, mailbox, cursor):
+        """
+        Scan the newest messages in the current label and cache the headers
+        of any that are missing.  Their bodies are downloaded later by
+        `download_message_bodies()`.
+        Returns the highest UID seen.
+        """
+        uid_set = set([])
+        # Get the set of messages that are in the mailbox.
+        for batch in self.stream_message_batches(mailbox, limit=500):
+            cached_gmessage_ids = find_cached_gmessage_ids(
+                cursor, (gmessage_id for gmessage_id, _, _, _ in batch)
+            )
+            uid_set.update(int(msg.uid) for _, _, _, msg in batch)
+            # Update any cached messages
+            cached = [item for item in batch if item[0] in cached_gmessage_ids]
+            ingest_messages(cursor, self.label, cached, update_only=True)
+            # Cache the headers of the others so the list can show them now.
+            uncached = [item for item in batch if item[0] not in cached_gmessage_ids]
+            self.ingest_message_batch(cursor, uncached, headers_only=True)
+            cursor.connection.commit()
+            if len(uncached) > 0:
+                self.notify_cache_changed()
+        # Remove any cached labels that are no longer applied.
+        self.remove_cached_labels(cursor, uid_set)
+        return max(uid_set, default=0)
+
+    def incremental_sync(self, mailbox, cursor, state, status):
+        """
+        Bring the current label up to date from its stored sync state.
+        Only messages with UIDs above the last synced UID are downloaded, and
+        nothing is fetched at all if UIDNEXT and HIGHESTMODSEQ are unchanged.
+        Returns the highest UID seen.
+        """
+        last_uid = state["last_uid"] or 0
+        uidnext = status["UIDNEXT"]
+        if uidnext is None or uidnext > last_uid + 1:
+            for batch in self.stream_message_batches(
+                mailbox, criteria=A(uid=f"{last_uid + 1}:*")
+            ):
+                # `n:*` always matches the newest message.
+                batch = [item for item in batch if int(item[3].uid) > last_uid]
+                self.ingest_message_batch(cursor, batch, headers_only=True)
+                cursor.connection.commit()
+                self.notify_cache_changed()
+                last_uid = max([last_uid] + [int(item[3].uid) for item in batch])
+        if not self.condstore:
+            self.resync_message_window(mailbox, cursor)
+            return last_uid
+        stored_modseq = state["highestmodseq"]
+        highestmodseq = status["HIGHESTMODSEQ"]
+        if stored_modseq is None or highestmodseq is None:
+            self.resync_message_window(mailbox, cursor)
+        elif highestmodseq > stored_modseq:
+            self.sync_changed_messages(mailbox, cursor, [])
+            if not self.qresync:
+                self.check_for_expunged_messages(mailbox, cursor)
+        return last_uid
+
+    def stream_message_batches(self, mailbox, criteria="All", limit=None):
+        """
+        Produce batches of (gmessage_id, gthread_id, glabels, msg) for the
+        headers of the messages in the current label that match `criteria`,
+        newest first, like `fetch_google_message_batches()`.
+        `mailbox` only runs the search.  The batch FETCHes are pipelined over
+        the asyncio IMAP pool on the app's event loop, so later batches
+        download and parse while the caller stores earlier ones.
+        """
+        uids = list(reversed(mailbox.uids(criteria)))
+        if limit is not None:
+            uids = uids[:limit]
+        return iterate_from_thread(
+            self.event_loop,
+            stream_google_message_batches(
+                self.async_imap_pool, self.label, uids, headers_only=True
+            ),
+        )
+
+    def get_sync_state(self, cursor):
+        """
+        Return the stored sync state of the current label as a dict, or None.
+        """
+        cursor.execute(sql_get_label_sync_state, [self.label])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        names = ["uidvalidity", "uidnext", "last_uid", "highestmodseq"]
+        return dict(zip(names, row))
+
+    def update_sync_state(
+        self, cursor, uidvalidity=None, uidnext=None, last_uid=None, highestmodseq=None
+    ):
+        """
+        Record sync progress for the current label.
+        Counters that are None keep their stored values, and none of them
+        move backwards.
+        """
+        state = self.get_sync_state(cursor) or {}
+        if uidvalidity is None:
+            uidvalidity = state.get("uidvalidity")
+
+        def newest(name, value):
+            values = [v for v in (state.get(name), value) if v is not None]
+            return max(values, default=None)
+
+        cursor.execute(
+            sql_save_label_sync_state,
+            [
+                self.label,
+                uidvalidity,
+                newest("uidnext", uidnext),
+                newest("last_uid", last_uid),
+                newest("highestmodseq", highestmodseq),
+            ],
+        )
+
     def remove_cached_labels(self, cursor, uid_set):
         """
         Remove cached labels for UIDs no longer in the mailbox.
         """
-        cursor.execute(sql_all_uids_for_label, [self.label])
-        message_labels_to_delete = []
-        for row in fetchrows(cursor, num_rows=cursor.arraysize):
-            row_id, uid = row
-            if uid not in uid_set:
-                logger.debug(f"UID {uid} to be deleted from label {self.label} ...")
-                message_labels_to_delete.append(row_id)
-        logger.debug(f"Row IDs of message labels to delete: {message_labels_to_delete}")
-        for row_id in message_labels_to_delete:
-            cursor.execute(sql_delete_message_label, [row_id])
+        deleted = delete_stale_message_labels(cursor, self.label, uid_set)
+        logger.debug(f"Deleted {deleted} message label(s) from label {self.label}.")
+
+    def ingest_message_batch(self, cursor, batch, headers_only=False):
+        """
+        Cache a batch of downloaded messages under the current label.
+        """
+        ingest_messages(
+            cursor,
+            self.label,
+            batch,
+            codec=self.message_codec,
+            attachment_store=self.attachment_store,
+            headers_only=headers_only,
+        )
 
     def get_cached_message(self, cursor, gmessage_id):
         """
@@ -464,34 +1324,24 @@ class GMailApp(App):
                 """
             cursor.execute(sql, [self.label])
 
-    def check_for_deleted_messages(self, cursor, found_uids):
+    def check_for_deleted_messages(self, cursor, found_uids, lower_bound=0):
         """
         Check for messages that have been removed from the current label with UID
         between self.min_uid and self.max_uid.
+        `found_uids` must hold every UID of the label from `lower_bound` up.
         """
         logger.debug("Checking for deleted messages ...")
         min_uid = self.min_uid
         max_uid = self.max_uid
         if min_uid is None or max_uid is None:
             return
+        min_uid = max(min_uid, lower_bound)
+        if min_uid > max_uid:
+            return
         logger.debug(f"min UID: {min_uid}, max UID: {max_uid}")
-        cursor.execute(sql_get_message_labels_in_uid_range, [min_uid, max_uid])
-        rows_to_delete = []
-        for row in fetchrows(cursor, cursor.arraysize):
-            row_id, uid = row
-            if uid not in found_uids:
-                rows_to_delete.append(row_id)
-        for row_id in rows_to_delete:
-            cursor.execute(sql_delete_message_label, [row_id])
-
-    def mark_cached_message_read_status(self, cursor, gmessage_id, read=True):
-        """
-        Alter the cached read/unread status of a message.
-        `cursor` may be None, in which case a new connection will be created.
-        """
-        with self.get_cursor_if_needed(cursor) as cursor:
-            unread = int(not read)
-            cursor.execute(sql_update_message_unread, [unread, gmessage_id])
+        delete_stale_message_labels(
+            cursor, self.label, found_uids, min_uid=min_uid, max_uid=max_uid
+        )
 
     @contextmanager
     def get_cursor_if_needed(self, cursor=None):
@@ -509,147 +1359,323 @@ class GMailApp(App):
         else:
             yield cursor
 
-    def insert_or_update_message(
-        self, cursor, gmessage_id, gthread_id, glabels, msg, update_only=False
-    ):
-        """
-        `msg` must be an imap_tools.message.Message.
-        """
-        flags = msg.flags
-        unread = is_unread(flags)
-        starred = is_starred(flags)
-        cursor.execute("SELECT id FROM messages WHERE gmessage_id = ?", [gmessage_id])
-        row = cursor.fetchone()
-        if row is None:
-            if update_only:
-                return
-            sql = """\
-                INSERT INTO messages
-                    (gmessage_id, gthread_id, message_string, unread, starred)
-                    VALUES (?, ?, ?, ?, ?)
-                """
-            cursor.execute(
-                sql,
-                [gmessage_id, gthread_id, msg.obj.as_string(), unread, starred],
-            )
-        else:
-            db_id = row[0]
-            sql = "UPDATE messages SET unread = ?, starred = ? WHERE id = ?"
-            cursor.execute(sql, [unread, starred, db_id])
-        cursor.execute(sql_find_ml, [gmessage_id, self.label])
-        row = cursor.fetchone()
-        if row is None:
-            logger.debug(
-                "INSERTing message label for "
-                f"gmessage_id {gmessage_id}, uid: {msg.uid}, label: {self.label}"
-            )
-            cursor.execute(sql_insert_ml, [gmessage_id, self.label, msg.uid])
-
     def accept_imap_updates(self, mailbox, conn):
         logger.debug("Accepting IMAP IDLE updates ...")
+        quiet_cycles = 0
         while self.sync_messages_flag:
             with mailbox.idle as idle:
                 responses = idle.poll(timeout=30)
             logger.debug(f"IDLE responses: {responses}")
+            if self.condstore:
+                # Nothing changed in the selected folder if the server was
+                # silent, so only check occasionally as a safety net.
+                if len(responses) == 0 and quiet_cycles < self.max_quiet_idle_cycles:
+                    quiet_cycles += 1
+                    continue
+                quiet_cycles = 0
+            total_changes = conn.total_changes
             cursor = conn.cursor()
-            # Check for changes to currently viewed UIDs
-            found_uids = set([])
-            for gmessage_id, gthread_id, glabels, msg in fetch_google_messages(
-                mailbox,
-                headers_only=True,
-                limit=500,
-            ):
-                self.insert_or_update_message(
-                    cursor, gmessage_id, gthread_id, glabels, msg, update_only=True
-                )
-                found_uids.add(int(msg.uid))
-            # Check for deleted messages.
-            self.check_for_deleted_messages(cursor, found_uids)
-            # Check for new (unseen) messages.
-            for gmessage_id, gthread_id, glabels, msg in fetch_google_messages(
-                mailbox,
-                criteria=A(seen=False),
-                headers_only=False,
-            ):
-                self.insert_or_update_message(
-                    cursor, gmessage_id, gthread_id, glabels, msg
-                )
+            if self.condstore:
+                self.sync_changed_messages(mailbox, cursor, responses)
+            else:
+                self.resync_message_window(mailbox, cursor)
             cursor.close()
             conn.commit()
+            if conn.total_changes != total_changes:
+                self.notify_cache_changed()
         logger.debug("No longer accepting IMAP IDLE updates.")
 
-    def create_db(self):
+    def sync_changed_messages(self, mailbox, cursor, idle_responses):
         """
-        Create local DB for storing mail.
+        Apply the changes made to the current label since the stored
+        HIGHESTMODSEQ (CONDSTORE/QRESYNC).
+        """
+        state = self.get_sync_state(cursor)
+        if state is None or state["highestmodseq"] is None:
+            self.resync_message_window(mailbox, cursor)
+            return
+        modseq = state["highestmodseq"]
+        # Read before the changes are fetched, so anything that changes in
+        # between is fetched again next time rather than skipped.
+        server_modseq = get_highestmodseq(mailbox)
+        changes, vanished_uids = fetch_changed_flags(
+            mailbox, modseq, vanished=self.qresync
+        )
+        logger.debug(f"{len(changes)} message(s) changed since MODSEQ {modseq}.")
+        new_uids = []
+        for uid, flags, changed_modseq in changes:
+            unread = is_unread(flags)
+            starred = is_starred(flags)
+            cursor.execute(
+                sql_update_message_flags_by_uid_and_label,
+                [unread, starred, self.label, uid],
+            )
+            if cursor.rowcount == 0:
+                new_uids.append(uid)
+            if changed_modseq is not None:
+                modseq = max(modseq, changed_modseq)
+        cursor.execute(sql_reapply_outbox_read_status)
+        if self.qresync:
+            delete_message_labels(cursor, self.label, vanished_uids)
+        elif any(b"EXPUNGE" in response for response in idle_responses):
+            self.check_for_expunged_messages(mailbox, cursor)
+        if len(new_uids) > 0:
+            uid_criteria = str(UIDSet(new_uids))
+            for batch in fetch_google_message_batches(
+                mailbox,
+                criteria=A(uid=uid_criteria),
+                headers_only=False,
+            ):
+                self.ingest_message_batch(cursor, batch)
+        # Expunges do not show up as changed flags, so the stored value only
+        # moves past them with the server's HIGHESTMODSEQ.
+        if server_modseq is not None:
+            modseq = max(modseq, server_modseq)
+        self.update_sync_state(
+            cursor, last_uid=max(new_uids, default=None), highestmodseq=modseq
+        )
+
+    def check_for_expunged_messages(self, mailbox, cursor):
+        """
+        Reconcile deletions in the viewed UID range using only a UID SEARCH.
+        """
+        min_uid = self.min_uid
+        max_uid = self.max_uid
+        if min_uid is None or max_uid is None:
+            return
+        found_uids = set(
+            int(uid)
+            for uid in mailbox.uids(A(uid=str(UIDSet.from_range(min_uid, max_uid))))
+        )
+        self.check_for_deleted_messages(cursor, found_uids)
+
+    def resync_message_window(self, mailbox, cursor):
+        """
+        Re-fetch the headers of the newest messages to pick up flag changes and
+        deletions.  Used when the server does not support CONDSTORE.
+        """
+        # Check for changes to currently viewed UIDs
+        found_uids = set([])
+        for batch in fetch_google_message_batches(
+            mailbox,
+            headers_only=True,
+            limit=self.resync_window_size,
+        ):
+            ingest_messages(cursor, self.label, batch, update_only=True)
+            found_uids.update(int(msg.uid) for _, _, _, msg in batch)
+        # Check for deleted messages.  When the window is full, older pages
+        # may reach below it, and only its UIDs are known.
+        lower_bound = 0
+        if len(found_uids) >= self.resync_window_size:
+            lower_bound = min(found_uids)
+        self.check_for_deleted_messages(cursor, found_uids, lower_bound=lower_bound)
+        # Check for new (unseen) messages.
+        for batch in fetch_google_message_batches(
+            mailbox,
+            criteria=A(seen=False),
+            headers_only=False,
+        ):
+            self.ingest_message_batch(cursor, batch)
+
+    def migrate_db(self):
+        """
+        Create the local DB for storing mail, or upgrade it to the current
+        schema version.
         """
-        ddl_statements = [
-            sql_ddl_messages,
-            sql_ddl_messages_idx0,
-            sql_ddl_labels,
-            sql_ddl_labels_idx0,
-            sql_ddl_message_labels,
-        ]
         with sqlite3.connect(self.db_path) as conn:
             conn.execute("PRAGMA journal_mode=WAL;")
             conn.execute("PRAGMA foreign_keys = ON")
             cursor = conn.cursor()
-            for sql in ddl_statements:
-                logger.debug(f"Executing DDL: {sql}")
-                cursor.execute(sql)
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            for n, ddl_statements in enumerate(sql_schema_versions):
+                if n < version:
+                    continue
+                for sql in ddl_statements:
+                    logger.debug(f"Executing DDL: {sql}")
+                    cursor.execute(sql)
+                cursor.execute(f"PRAGMA user_version = {n + 1}")
             conn.commit()
 
-    @work(exclusive=True, group="toggle-message-seen", thread=True)
-    def mark_message_read_status(self, uid, label, read=True):
+    def mark_messages_read_status(self, uids, label, read=True):
         """
         Mark messages read/unread.
         """
-        access_token = get_oauth2_access_token(self.config)
-        with get_mailbox(self.config, access_token) as mailbox:
-            mailbox.folder.set(label)
-            uids = [str(uid)]
-            flags = MailMessageFlags.SEEN
-            value = read
-            mailbox.flag(uids, flags, value)
+        action = ACTION_SEEN if read else ACTION_UNSEEN
+        self.queue_message_actions(label, uids, action)
+
+    def archive_messages(self, uids):
+        """
+        Archive GMail Inbox messages.
+        """
+        self.queue_message_actions("INBOX", uids, ACTION_ARCHIVE)
+
+    def trash_messages(self, uids, label):
+        """
+        Move messages to the trash.
+        """
+        self.queue_message_actions(label, uids, ACTION_TRASH)
+
+    def queue_message_actions(self, folder, uids, action):
+        """
+        Queue an action on the cached messages with `uids` in `folder`.
+        `write_message_actions()` applies it to the cache and adds it to the
+        outbox to be sent to the server.
+        """
+        self.pending_actions.put((folder, list(uids), action))
+
+    @work(exclusive=True, group="outbox-writer", thread=True)
+    def write_message_actions(self):
+        """
+        Apply queued actions to the cache and add them to the outbox, in the
+        order they were queued.
+        The writes happen here rather than on the UI thread because the sync
+        worker can hold the database's write lock for a while.  Writes that
+        find the database locked are retried up to `max_action_write_attempts`
+        times; after that the actions are dropped and the list shows the
+        cache as it is.  Other database errors are raised.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            while self.sync_messages_flag or not self.pending_actions.empty():
+                try:
+                    actions = [self.pending_actions.get(timeout=1)]
+                except queue.Empty:
+                    continue
+                while not self.pending_actions.empty():
+                    actions.append(self.pending_actions.get())
+                for attempt in range(self.max_action_write_attempts):
+                    try:
+                        for folder, uids, action in actions:
+                            queue_actions(cursor, folder, uids, action)
+                        conn.commit()
+                        break
+                    except sqlite3.OperationalError as ex:
+                        conn.rollback()
+                        if not is_database_busy(ex):
+                            raise
+                        logger.debug(f"Could not write message actions: {ex}")
+                        time.sleep(self.action_write_retry_delay)
+                else:
+                    self.call_from_thread(
+                        self.notify,
+                        f"{len(actions)} message action(s) could not be saved "
+                        "and were undone.",
+                        severity="error",
+                    )
+                for folder in set(folder for folder, _, _ in actions):
+                    self.notify_cache_changed(folder)
+                self.outbox_event.set()
 
-    @work(exclusive=True, group="archive-message", thread=True)
-    def archive_message(self, uid):
+    @work(exclusive=True, group="outbox", thread=True)
+    def flush_outbox(self):
         """
-        Archive a GMail Inbox message.
+        Send the actions in the outbox to the server.  Actions queued in a
+        burst are merged into one command per folder and action, and failed
+        commands are retried with a growing delay.
         """
-        access_token = get_oauth2_access_token(self.config)
-        with get_mailbox(self.config, access_token) as mailbox:
-            mailbox.folder.set("INBOX")
-            uids = [str(uid)]
-            result = mailbox.delete(uids)
-            logger.debug(f"Result of mailbox.delete([{uid}]): {result}")
+        retry_delay = self.outbox_retry_delay
+        retry_at = None
+        while self.sync_messages_flag:
+            # Wake up every second to notice when the app quits.
+            woken = self.outbox_event.wait(timeout=1)
+            if not woken and (retry_at is None or time.monotonic() < retry_at):
+                continue
+            self.outbox_event.clear()
+            # Let the rest of a burst of actions arrive.
+            time.sleep(self.outbox_flush_delay)
+            failed = False
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("PRAGMA journal_mode=WAL;")
+                conn.execute("PRAGMA foreign_keys = ON;")
+                cursor = conn.cursor()
+                for folder, action, uid_set, outbox_ids in pending_action_groups(
+                    cursor
+                ):
+                    try:
+                        with self.imap_pool.mailbox(folder) as mailbox:
+                            send_action(mailbox, action, uid_set)
+                    except Exception as ex:
+                        logger.debug(f"Could not {action} {uid_set} in {folder}: {ex}")
+                        cursor.executemany(
+                            sql_outbox_action_failed, ([id_] for id_ in outbox_ids)
+                        )
+                        failed = True
+                    else:
+                        logger.debug(f"Sent {action} for {uid_set} in {folder}.")
+                        cursor.executemany(
+                            sql_delete_outbox_action, ([id_] for id_ in outbox_ids)
+                        )
+                    conn.commit()
+                abandoned = remove_failed_actions(cursor, self.max_outbox_attempts)
+                conn.commit()
+                if len(abandoned) > 0:
+                    self.undo_abandoned_actions(conn, abandoned)
+            if failed:
+                retry_at = time.monotonic() + retry_delay
+                retry_delay = min(retry_delay * 2, self.max_outbox_retry_delay)
+            else:
+                retry_at = None
+                retry_delay = self.outbox_retry_delay
 
-    @work(exclusive=True, group="trash-message", thread=True)
-    def trash_message(self, uid, label):
+    def undo_abandoned_actions(self, conn, abandoned):
         """
-        Move message to the trash.
+        Tell the user about the outbox actions given up on, and re-sync the
+        cached messages they had been applied to from the server.  If that
+        fails too, the folder is fully synced the next time it is opened.
+        Each batch is committed as soon as it is stored, so the database is
+        not locked while the next one downloads.
         """
-        access_token = get_oauth2_access_token(self.config)
-        with get_mailbox(self.config, access_token) as mailbox:
-            mailbox.folder.set(label)
-            uids = [str(uid)]
-            mailbox.move(uids, "[Gmail]/Trash")
+        cursor = conn.cursor()
+        count = sum(len(uid_set) for _, _, uid_set in abandoned)
+        logger.debug(f"Gave up on {count} outbox action(s).")
+        resync = {}
+        for folder, action, uid_set in abandoned:
+            resync[folder] = resync.get(folder, UIDSet()) | uid_set
+        for folder, uid_set in resync.items():
+            try:
+                with self.imap_pool.mailbox(folder) as mailbox:
+                    for batch in fetch_google_message_batches(
+                        mailbox, criteria=A(uid=str(uid_set)), headers_only=True
+                    ):
+                        ingest_messages(cursor, folder, batch, update_only=True)
+                        conn.commit()
+            except Exception as ex:
+                conn.rollback()
+                logger.debug(f"Could not re-sync {uid_set} in {folder}: {ex}")
+                cursor.execute(sql_delete_label_sync_state, [folder])
+                conn.commit()
+            self.notify_cache_changed(folder)
+        self.call_from_thread(
+            self.notify,
+            f"{count} message action(s) could not be sent to the server and "
+            "were undone.",
+            severity="error",
+        )
 
     @work(exclusive=True, group="restore-message", thread=True)
-    def restore_to_inbox(self, uid, from_curr_label=False):
+    def restore_to_inbox(self, uid, from_curr_label=False, gmessage_id=None):
         """
         Restore a message to the inbox.
         uid: UID of the message to restore.
         from_curr_label: If True, copy from the current label.
             Otherwise, copy from "[Gmail]/All Mail".
+        gmessage_id: Google message ID used to find the message if `uid` is
+            None.
         """
         if from_curr_label:
             folder = self.label
         else:
             folder = "[Gmail]/All Mail"
-        access_token = get_oauth2_access_token(self.config)
-        with get_mailbox(self.config, access_token) as mailbox:
-            mailbox.folder.set(folder)
-            uids = [str(uid)]
+        with self.imap_pool.mailbox(folder) as mailbox:
+            if uid is None:
+                uids = mailbox.uids(f"X-GM-MSGID {gmessage_id}")
+            else:
+                uids = [str(uid)]
+            if len(uids) == 0:
+                return
             mailbox.copy(uids, "INBOX")
 
     @work(exclusive=False, group="smtp-send", thread=True)
@@ -664,6 +1690,9 @@ class GMailApp(App):
     def action_quit(self):
         self.sync_messages_flag = False
         self.workers.cancel_all()
+        self.imap_pool.close()
+        self.async_imap_pool.close()
+        get_token_manager(self.config).stop()
         self.exit()
         logger.debug("Shutting down ...")
 
@@ -708,7 +1737,9 @@ class GMailApp(App):
     def on_button_pressed(self, event: Button.Pressed):
         button = event.button
         if button.id == "btn-forwards":
-            pass
+            self.action_next_page()
+        elif button.id == "btn-backwards":
+            self.action_previous_page()
 
 
 def fetchrows(cursor, num_rows=10, row_wrapper=None):
@@ -726,6 +1757,15 @@ def fetchrows(cursor, num_rows=10, row_wrapper=None):
             yield row
 
 
+def is_database_busy(ex):
+    """
+    Return True if the sqlite3.OperationalError `ex` means another connection
+    holds a lock, so the statement may succeed if it is retried.
+    """
+    message = str(ex).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
 def parse_string_message_headers(message_string):
     """
     Parse a string into structured message headers.
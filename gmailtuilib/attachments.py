@@ -0,0 +1,227 @@
+import binascii
+import email
+import hashlib
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+
+from logzero import logger
+
+# Header added to an attachment part whose payload was moved to the
+# attachment store.  Its value is the SHA-256 digest of the decoded payload.
+STORE_HEADER = "X-Gmail-TUI-Attachment-SHA256"
+
+# Attachments smaller than this stay inline in the cached message.
+MIN_STORED_SIZE = 4096
+
+# Attachments are decoded and saved in chunks of this many encoded bytes.
+CHUNK_SIZE = 2**16
+
+# ioctl(2) request that clones a file's extents on Linux file systems with
+# reflink support (Btrfs, XFS, ...).
+FICLONE = 0x40049409
+
+
+class AttachmentStore:
+    """
+    Content-addressed store of decoded attachment payloads.
+    Each payload is kept once in a file named after its SHA-256 digest, no
+    matter how many messages it is attached to.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        """
+        Return the path of the payload with SHA-256 digest `digest`.
+        """
+        return self.root.joinpath(digest[:2], digest)
+
+    def put(self, data):
+        """
+        Store `data` if it is not stored yet.
+        Returns its SHA-256 digest.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if path.exists():
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".attachment-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return digest
+
+    def copy_to(self, digest, dest_path):
+        """
+        Copy a stored payload to `dest_path`, sharing its blocks with the
+        store where the file system supports it.
+        """
+        copy_file(self.path(digest), dest_path)
+
+
+def copy_file(src_path, dest_path):
+    """
+    Copy `src_path` to `dest_path`.  On Linux a reflink is tried first, and
+    the data is copied in the kernel otherwise.
+    """
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+            try:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+    shutil.copyfile(src_path, dest_path)
+
+
+def iter_attachment_parts(msg):
+    """
+    Yield (part_index, part) for the attachment parts of an email message.
+    """
+    for part_index, part in enumerate(msg.walk()):
+        if part.is_multipart():
+            continue
+        if part.get_content_disposition() != "attachment":
+            continue
+        yield part_index, part
+
+
+def store_message_attachments(message_string, store):
+    """
+    Move the payloads of the attachments of a serialized message to `store`.
+    Each stored attachment part keeps its headers, gains a STORE_HEADER, and
+    is left with an empty body.
+    Returns the stubbed message string and a list of
+    (part_index, digest, filename, content_type, size) tuples, one per stored
+    attachment.  The message string is returned unchanged if nothing was
+    stored.
+    """
+    msg = email.message_from_string(message_string)
+    refs = []
+    for part_index, part in iter_attachment_parts(msg):
+        if part.get(STORE_HEADER) is not None:
+            continue
+        data = part.get_payload(decode=True)
+        if data is None or len(data) < MIN_STORED_SIZE:
+            continue
+        digest = store.put(data)
+        part.set_payload("")
+        part[STORE_HEADER] = digest
+        refs.append(
+            (
+                part_index,
+                digest,
+                part.get_filename(),
+                part.get_content_type(),
+                len(data),
+            )
+        )
+    if len(refs) == 0:
+        return message_string, refs
+    logger.debug(f"Moved {len(refs)} attachment(s) to the attachment store.")
+    return msg.as_string(), refs
+
+
+def has_attachment_parts(msg):
+    """
+    Return True if an email message has any attachment parts.
+    """
+    for _ in iter_attachment_parts(msg):
+        return True
+    return False
+
+
+def get_part_size(part, store=None):
+    """
+    Return the decoded size in bytes of an attachment part without decoding
+    it, or None if it is not known.  Base64 payloads are measured from their
+    encoded length.
+    """
+    digest = part.get(STORE_HEADER)
+    if digest is not None:
+        if store is None:
+            return None
+        try:
+            return store.path(digest).stat().st_size
+        except OSError:
+            return None
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return None
+    if part.get("content-transfer-encoding", "").strip().lower() != "base64":
+        return len(payload)
+    encoded_size = len(payload) - sum(payload.count(c) for c in " \t\r\n")
+    # Only the tail is copied; the payload may be many megabytes.
+    padding = payload[-8:].rstrip().count("=")
+    return max(encoded_size * 3 // 4 - padding, 0)
+
+
+def iter_decoded_payload(part, chunk_size=CHUNK_SIZE):
+    """
+    Yield the decoded payload of a non-multipart part in chunks.
+    A base64 payload is decoded `chunk_size` encoded characters at a time, so
+    the whole decoded payload is never held in memory.
+    """
+    payload = part.get_payload()
+    encoding = part.get("content-transfer-encoding", "").strip().lower()
+    if encoding != "base64" or not isinstance(payload, str):
+        data = part.get_payload(decode=True) or b""
+        for start in range(0, len(data), chunk_size):
+            yield data[start : start + chunk_size]
+        return
+    pending = ""
+    for start in range(0, len(payload), chunk_size):
+        chunk = pending + "".join(payload[start : start + chunk_size].split())
+        # Base64 decodes in groups of 4 characters.
+        usable = len(chunk) - len(chunk) % 4
+        pending = chunk[usable:]
+        if usable > 0:
+            yield binascii.a2b_base64(chunk[:usable])
+    pending = pending.rstrip("=")
+    if len(pending) > 1:
+        # Missing padding, which the email package also tolerates.
+        yield binascii.a2b_base64(pending + "=" * (-len(pending) % 4))
+
+
+def save_attachment(part, dest_path, store=None, progress=None):
+    """
+    Save the decoded payload of an attachment part to `dest_path`.
+    Payloads in `store` are copied from it; others are decoded from the
+    message a chunk at a time.  `progress` is called with the number of bytes
+    written so far and the total (None if unknown) after each chunk.
+    The file only appears at `dest_path` once it is complete.
+    """
+    total = get_part_size(part, store)
+    digest = part.get(STORE_HEADER)
+    if digest is not None:
+        store.copy_to(digest, dest_path)
+        if progress is not None:
+            progress(total, total)
+        return
+    dest_path = pathlib.Path(dest_path)
+    fd, temp_path = tempfile.mkstemp(dir=dest_path.parent, prefix=".attachment-")
+    try:
+        written = 0
+        with os.fdopen(fd, "wb") as f:
+            for data in iter_decoded_payload(part):
+                f.write(data)
+                written += len(data)
+                if progress is not None:
+                    progress(written, total)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
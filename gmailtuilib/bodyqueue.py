@@ -0,0 +1,75 @@
+import heapq
+import itertools
+import threading
+
+# Priorities of message body downloads, most urgent first.
+PRIORITY_OPENED = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_WINDOW = 2
+
+
+class BodyQueue:
+    """
+    Thread-safe queue of the UIDs whose message bodies still have to be
+    downloaded.
+    UIDs come out in priority order, newest first within a priority.
+    Queueing a UID that is already queued can only raise its priority.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.priorities = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.priorities)
+
+    def put(self, uids, priority):
+        """
+        Queue `uids` with `priority`.
+        """
+        with self.condition:
+            added = False
+            for uid in uids:
+                uid = int(uid)
+                if self.priorities.get(uid, priority + 1) <= priority:
+                    continue
+                self.priorities[uid] = priority
+                # Older entries for the UID are skipped when they come up.
+                heapq.heappush(self.heap, (priority, -uid, next(self.counter)))
+                added = True
+            if added:
+                self.condition.notify_all()
+
+    def take(self, max_count, timeout=None):
+        """
+        Remove up to `max_count` UIDs that share the most urgent priority in
+        the queue, waiting up to `timeout` seconds for any.
+        Returns (priority, uids), or (None, []) if none arrived in time.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.priorities) > 0, timeout)
+            uids = []
+            top_priority = None
+            while self.heap and len(uids) < max_count:
+                priority, neg_uid, _ = self.heap[0]
+                uid = -neg_uid
+                if self.priorities.get(uid) != priority:
+                    heapq.heappop(self.heap)
+                    continue
+                if top_priority is not None and priority != top_priority:
+                    break
+                top_priority = priority
+                heapq.heappop(self.heap)
+                del self.priorities[uid]
+                uids.append(uid)
+            return top_priority, uids
+
+    def clear(self):
+        """
+        Forget all queued UIDs.
+        """
+        with self.condition:
+            self.heap = []
+            self.priorities = {}
@@ -0,0 +1,135 @@
+import zlib
+
+# Storage formats for `messages.message_string`.  The codec of each row is
+# recorded in `messages.codec` so rows written with different settings can be
+# read side by side.
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZLIB_DICT = 2
+
+CODEC_NAMES = {
+    "none": CODEC_NONE,
+    "zlib": CODEC_ZLIB,
+    "zlib-dict": CODEC_ZLIB_DICT,
+}
+
+COMPRESSION_LEVEL = 6
+
+# Preset dictionary for CODEC_ZLIB_DICT.  Gmail messages share long runs of
+# header boilerplate that plain zlib cannot reference until it has seen them
+# once in the same message.  zlib favours matches near the end of the
+# dictionary, so the most common strings come last.
+# The contents must never change once rows have been written with it; a new
+# dictionary needs a new codec number.
+MESSAGE_ZDICT = b"".join(
+    [
+        b"List-Unsubscribe-Post: List-Unsubscribe=One-Click\n",
+        b"List-Unsubscribe: <mailto:",
+        b"Feedback-ID: ",
+        b"X-Mailer: ",
+        b"Precedence: bulk\n",
+        b"Auto-Submitted: auto-generated\n",
+        b"Thread-Topic: ",
+        b"Thread-Index: ",
+        b"In-Reply-To: <",
+        b"References: <",
+        b"Reply-To: ",
+        b'Content-Disposition: attachment; filename="',
+        b"Content-Disposition: inline\n",
+        b'Content-Type: multipart/related; boundary="',
+        b'Content-Type: multipart/mixed; boundary="',
+        b'Content-Type: multipart/alternative; boundary="',
+        b'Content-Type: text/html; charset="UTF-8"\n',
+        b'Content-Type: text/plain; charset="UTF-8"\n',
+        b"Content-Type: text/html; charset=UTF-8\n",
+        b"Content-Type: text/plain; charset=UTF-8\n",
+        b"Content-Transfer-Encoding: base64\n",
+        b"Content-Transfer-Encoding: 7bit\n",
+        b"Content-Transfer-Encoding: quoted-printable\n",
+        b"MIME-Version: 1.0\n",
+        b"X-Google-Smtp-Source: ",
+        b"X-Gm-Message-State: ",
+        b"X-Google-DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed;\n",
+        b"        d=1e100.net; s=20230601; t=",
+        b"DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed;\n",
+        b"        d=gmail.com; s=20230601; t=",
+        b"        h=to:subject:message-id:date:from:mime-version:from:to:cc:subject\n",
+        b"         :date:message-id:reply-to;\n",
+        b"        bh=",
+        b"        b=",
+        b"ARC-Seal: i=1; a=rsa-sha256; t=",
+        b"ARC-Message-Signature: i=1; a=rsa-sha256; c=relaxed/relaxed;",
+        b" d=google.com; s=arc-20160816;\n",
+        b"ARC-Authentication-Results: i=1; mx.google.com;\n",
+        b"Authentication-Results: mx.google.com;\n",
+        b"       dkim=pass header.i=@",
+        b"       spf=pass (google.com: domain of ",
+        b" designates ",
+        b" as permitted sender) smtp.mailfrom=",
+        b"       dmarc=pass (p=REJECT sp=REJECT dis=NONE) header.from=",
+        b"Received-SPF: pass (google.com: domain of ",
+        b"Return-Path: <",
+        b"X-Received: by 2002:a05:",
+        b" with SMTP id ",
+        b"        for <",
+        b"        by mx.google.com with ESMTPS id ",
+        b"        (version=TLS1_3 cipher=TLS_AES_256_GCM_SHA384 bits=256/256);\n",
+        b"Received: from ",
+        b"Delivered-To: ",
+        b"Message-ID: <",
+        b"Subject: ",
+        b"Date: ",
+        b"From: ",
+        b"To: ",
+        b"Cc: ",
+        b" -0400 (EDT)\n",
+        b" -0500 (EST)\n",
+        b" +0000 (UTC)\n",
+        b"@mail.gmail.com>\n",
+        b"@gmail.com>\n",
+    ]
+)
+
+
+def codec_from_name(name):
+    """
+    Return the codec number for a `compression` setting.
+    """
+    if name is None:
+        return CODEC_NONE
+    try:
+        return CODEC_NAMES[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown message compression: {name!r}")
+
+
+def encode_message_string(message_string, codec):
+    """
+    Encode a message string for storage with `codec`.
+    Returns a str for CODEC_NONE and bytes otherwise.
+    """
+    if codec == CODEC_NONE:
+        return message_string
+    data = message_string.encode("utf-8", "surrogateescape")
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, COMPRESSION_LEVEL)
+    if codec == CODEC_ZLIB_DICT:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=MESSAGE_ZDICT)
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError(f"Unknown message codec: {codec}")
+
+
+def decode_message_string(stored, codec):
+    """
+    Decode a stored message string that was encoded with `codec`.
+    """
+    if codec == CODEC_NONE or codec is None:
+        return stored
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(stored)
+    elif codec == CODEC_ZLIB_DICT:
+        decompressor = zlib.decompressobj(zdict=MESSAGE_ZDICT)
+        data = decompressor.decompress(stored) + decompressor.flush()
+    else:
+        raise ValueError(f"Unknown message codec: {codec}")
+    return data.decode("utf-8", "surrogateescape")
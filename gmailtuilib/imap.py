@@ -1,26 +1,177 @@
+import asyncio
+import base64
+import bisect
 import contextlib
-from collections import OrderedDict
+import heapq
+import imaplib
+import itertools
+import re
+import ssl
+import threading
+import time
+from collections import deque
 from itertools import islice
 
-from imap_tools import MailBox
+from imap_tools import MailBox, MailMessage
 from imap_tools.consts import MailMessageFlags
-from imap_tools.utils import quote
+from imap_tools.errors import MailboxFetchError, MailboxLoginError
+from imap_tools.imap_utf7 import utf7_encode
+from imap_tools.utils import check_command_status, encode_folder, quote
+from logzero import logger
 
-from gmailtuilib.parsers import imap_gmail_uid_fetch_response_parser
+from gmailtuilib.parsers import parse_fetch_response
 
 quote_imap_string = quote
 
+# Errors that leave an IMAP session unusable.
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, ssl.SSLError)
+
+# UIDs are unsigned 32-bit integers, so every UID is below this bound.
+UID_UPPER_BOUND = 2**32
+
 
 @contextlib.contextmanager
-def get_mailbox(config, access_token):
+def get_mailbox(config, access_token, initial_folder="INBOX"):
     """
     Returns an authenticated imap_tools.MailBox.
     """
     email = config["oauth2"]["email"]
-    with MailBox("imap.gmail.com").xoauth2(email, access_token) as mailbox:
+    with MailBox("imap.gmail.com").xoauth2(
+        email, access_token, initial_folder=initial_folder
+    ) as mailbox:
         yield mailbox
 
 
+class IMAPConnectionPool:
+    """
+    A pool of authenticated IMAP sessions that are kept warm between user
+    actions.
+
+    Each pooled session remembers which folder it has selected, so handing
+    out a session for the folder it is already on costs no round-trips.
+    Sessions that have been idle for a while are checked with NOOP before
+    they are handed out, and replaced if the server has dropped them.
+    """
+
+    def __init__(self, config, get_access_token, max_size=4, noop_after=30):
+        """
+        `get_access_token` is a callable that returns a valid OAuth2 access
+        token.  It is only called when a new session must be established.
+        """
+        self.config = config
+        self.get_access_token = get_access_token
+        self.max_size = max_size
+        self.noop_after = noop_after
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def open(self, warm=1):
+        """
+        Open the pool and establish `warm` sessions ahead of time.
+        """
+        self._closed = False
+        for _ in range(min(warm, self.max_size)):
+            mailbox = self._connect()
+            self._checkin(mailbox)
+        logger.debug(f"IMAP connection pool opened with {warm} warm session(s).")
+
+    def close(self):
+        """
+        Log out of all idle sessions and refuse to hand out new ones.
+        """
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+        for mailbox, last_used in idle:
+            self._logout(mailbox)
+
+    @contextlib.contextmanager
+    def mailbox(self, folder=None):
+        """
+        Context manager.
+        Check out an authenticated imap_tools.MailBox, with `folder` selected
+        if it is not None.  The session is returned to the pool afterwards,
+        unless the connection failed while it was in use.
+        """
+        self._slots.acquire()
+        try:
+            mailbox = self._checkout(folder)
+            try:
+                if folder is not None and mailbox.folder.get() != folder:
+                    mailbox.folder.set(folder)
+                yield mailbox
+            except CONNECTION_ERRORS:
+                self._logout(mailbox)
+                raise
+            except Exception:
+                # An application error leaves the session usable.
+                self._checkin(mailbox)
+                raise
+            except BaseException:
+                self._logout(mailbox)
+                raise
+            self._checkin(mailbox)
+        finally:
+            self._slots.release()
+
+    def _connect(self):
+        email = self.config["oauth2"]["email"]
+        access_token = self.get_access_token()
+        mailbox = MailBox("imap.gmail.com")
+        mailbox.xoauth2(email, access_token, initial_folder=None)
+        return mailbox
+
+    def _checkout(self, folder):
+        """
+        Return an idle session, preferring one that already has `folder`
+        selected.  Establish a new session if none are usable.
+        """
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise Exception("IMAP connection pool is closed.")
+                entry = None
+                for n, (mailbox, last_used) in enumerate(self._idle):
+                    if mailbox.folder.get() == folder:
+                        entry = self._idle.pop(n)
+                        break
+                if entry is None and len(self._idle) > 0:
+                    entry = self._idle.pop()
+            if entry is None:
+                return self._connect()
+            mailbox, last_used = entry
+            if time.monotonic() - last_used < self.noop_after:
+                return mailbox
+            if self._is_healthy(mailbox):
+                return mailbox
+            logger.debug("Discarding stale IMAP session.")
+            self._logout(mailbox)
+
+    def _checkin(self, mailbox):
+        with self._lock:
+            if not self._closed:
+                self._idle.append((mailbox, time.monotonic()))
+                return
+        self._logout(mailbox)
+
+    def _is_healthy(self, mailbox):
+        try:
+            typ, data = mailbox.client.noop()
+        except Exception as ex:
+            logger.debug(f"IMAP NOOP failed: {ex}")
+            return False
+        return typ == "OK"
+
+    def _logout(self, mailbox):
+        try:
+            mailbox.logout()
+        except Exception as ex:
+            logger.debug(f"Error logging out of IMAP session: {ex}")
+
+
 def batched(iterable, n):
     "Batch data into tuples of length n. The last batch may be shorter."
     # batched('ABCDEFG', 3) --> ABC DEF G
@@ -36,135 +187,890 @@ def fetch_google_messages(
 ):
     """
     Fetch messages in batches and decorate with Google IDs.
-    Generator produces (gmessage_id, gthread_id, msg).
+    Generator produces (gmessage_id, gthread_id, glabels, msg).
     """
-    msg_generator = mailbox.fetch(
+    for batch in fetch_google_message_batches(
+        mailbox,
         criteria=criteria,
-        reverse=True,
+        batch_size=batch_size,
         headers_only=headers_only,
-        mark_seen=False,
-        bulk=batch_size,
         limit=limit,
-    )
-    for msg_batch in batched(msg_generator, batch_size):
-        messages = OrderedDict()
-        for msg in msg_batch:
-            messages[msg.uid] = dict(msg=msg)
-        uids = list(int(uid) for uid in messages.keys())
-        max_uid = max(uids)
-        min_uid = min(uids)
-        all_uids = list(range(min_uid, max_uid + 1))
-        uid_seq = compress_uids(all_uids, uids)
-        criteria_str = uid_seq_to_criteria(uid_seq)
-        client = mailbox.client
-        response = client.uid(
-            "fetch", f"{criteria_str}", "(X-GM-MSGID X-GM-THRID X-GM-LABELS)"
+    ):
+        yield from batch
+
+
+def fetch_google_message_batches(
+    mailbox, criteria="All", batch_size=100, headers_only=True, limit=None
+):
+    """
+    Like `fetch_google_messages()`, but produces a list of
+    (gmessage_id, gthread_id, glabels, msg) tuples for each batch fetched.
+    Messages are produced newest first.
+
+    Each batch is a single UID FETCH that returns the Gmail IDs and labels
+    together with the flags and the header or full message.
+    """
+    uids = list(reversed(mailbox.uids(criteria)))
+    if limit is not None:
+        uids = uids[:limit]
+    message_items, body_item = google_message_fetch_items(headers_only)
+    for uid_batch in batched(uids, batch_size):
+        response = mailbox.client.uid("fetch", str(UIDSet(uid_batch)), message_items)
+        check_command_status(response, MailboxFetchError)
+        batch = google_message_batch_from_response(response, uid_batch, body_item)
+        if len(batch) > 0:
+            yield batch
+
+
+def google_message_fetch_items(headers_only=True):
+    """
+    Return the FETCH items that retrieve a message with its Gmail IDs and
+    labels, and the name of the item the message arrives in.
+    """
+    if headers_only:
+        message_part, body_item = "BODY.PEEK[HEADER]", "BODY[HEADER]"
+    else:
+        message_part, body_item = "BODY.PEEK[]", "BODY[]"
+    items = f"(UID FLAGS RFC822.SIZE X-GM-MSGID X-GM-THRID X-GM-LABELS {message_part})"
+    return items, body_item
+
+
+def google_message_batch_from_response(response, uid_batch, body_item):
+    """
+    Return the (gmessage_id, gthread_id, glabels, msg) tuples for `uid_batch`
+    from the response to the UID FETCH of its messages, in `uid_batch`
+    order.
+    """
+    messages = {}
+    for fields in parse_fetch_google_messages_response(response, body_item):
+        if fields["X-GM-MSGID"] is None:
+            # An unsolicited FETCH that only reports changed flags.
+            continue
+        messages[fields["UID"]] = fields
+    batch = []
+    for uid in uid_batch:
+        fields = messages.get(str(uid))
+        if fields is None:
+            # The message was expunged after the search.
+            continue
+        batch.append(
+            (
+                fields["X-GM-MSGID"],
+                fields["X-GM-THRID"],
+                fields["X-GM-LABELS"],
+                fields["msg"],
+            )
         )
-        results = parse_fetch_google_ids_response(response)
-        for fields in results:
-            uid = fields["UID"]
-            gmessage_id = fields["X-GM-MSGID"]
-            gthread_id = fields["X-GM-THRID"]
-            glabels = fields["X-GM-LABELS"]
-            if glabels is None:
-                glabels = []
-            if gmessage_id is None or gthread_id is None:
-                # Just skip a message if we can't get the Google IDs.
-                continue
-            msg_wrapper = messages.get(uid)
-            if msg_wrapper:
-                msg_wrapper["gmessage_id"] = gmessage_id
-                msg_wrapper["gthread_id"] = gthread_id
-                msg_wrapper["glabels"] = glabels
-        for msg_wrapper in messages.values():
-            msg = msg_wrapper["msg"]
-            gmessage_id = msg_wrapper.get("gmessage_id")
-            gthread_id = msg_wrapper.get("gthread_id")
-            glabels = msg_wrapper.get("glabels", [])
-            yield gmessage_id, gthread_id, glabels, msg
+    return batch
 
 
-def parse_fetch_google_ids_response(response):
+def parse_fetch_google_messages_response(response, body_item):
     """
-    Parse fetch response for Google IDs.
+    Parse the response to a UID FETCH of Gmail IDs, labels, flags and the
+    message item `body_item`.
+    Produces a dict per message with the Gmail fields, "UID", and "msg", an
+    imap_tools.MailMessage.
     """
-    status = response[0]
-    if status != "OK":
-        return []
-    lines = response[1]
-    for ascii_7bit_line in lines:
-        line = ascii_7bit_line.decode()
-        data = imap_gmail_uid_fetch_response_parser(line).line()
-        msg_number, response_parts = data
-        fields = {"MESSAGE_NUMBER": msg_number}
-        names = ["X-GM-THRID", "X-GM-MSGID", "X-GM-LABELS", "UID"]
-        for name in names:
-            pos = response_parts.index(name)
-            if pos == -1:
-                value = None
-            else:
-                value = response_parts[pos + 1]
-            fields[name] = value
-        yield fields
+    for msg_number, response_parts in parse_fetch_response(response[1]):
+        values = dict(zip(response_parts[::2], response_parts[1::2]))
+        uid = values.get("UID")
+        if uid is None:
+            continue
+        flags = " ".join(values.get("FLAGS") or [])
+        size = values.get("RFC822.SIZE", "0")
+        body = values.get(body_item) or b""
+        # MailMessage reads the UID, flags and size from the FETCH line that
+        # precedes the message literal.
+        fetch_line = f"{msg_number} (UID {uid} FLAGS ({flags}) RFC822.SIZE {size}"
+        msg = MailMessage([(fetch_line.encode(), body), b")"])
+        yield {
+            "UID": uid,
+            "X-GM-MSGID": values.get("X-GM-MSGID"),
+            "X-GM-THRID": values.get("X-GM-THRID"),
+            "X-GM-LABELS": decode_glabels(values.get("X-GM-LABELS")),
+            "msg": msg,
+        }
 
 
-def compress_uids(all_uids, selected_uids):
+def decode_glabels(glabels):
     """
-    Compress a sorted selection of UIDs into ranges given the complete sorted
-    sequence of UIDs.
+    Return a list of Gmail labels from an X-GM-LABELS value.
     """
-    if len(selected_uids) == 0:
+    if glabels is None:
         return []
-    results = []
-    selected_uids = selected_uids[:]
-    range_max_uid = selected_uids.pop()
-    range_min_uid = None
-    current_uid = range_max_uid
-    pos1 = all_uids.index(current_uid)
-    while len(selected_uids):
-        candidate_uid = selected_uids.pop()
-        # Are the uids between candidate and current?
-        pos0 = all_uids.index(candidate_uid)
-        if pos0 + 1 == pos1:
-            # No in-between UIDs
-            range_min_uid = candidate_uid
-            pos1 = pos0
+    # Labels sent as literals arrive as bytes.
+    return [label.decode() if isinstance(label, bytes) else label for label in glabels]
+
+
+imap_literal_pattern = re.compile(rb"\{(\d+)\+?\}$")
+imap_status_code_pattern = re.compile(rb"\[([^\s\]]+)(?: ([^\]]*))?\]")
+
+
+class AsyncIMAPClient:
+    """
+    An IMAP session that runs on an asyncio event loop.
+
+    Commands are pipelined: each is written as soon as it is issued and
+    completes when its tagged response arrives, so many logical operations
+    can share one connection without waiting for each other's round-trips.
+    A command names the untagged response types it collects, and each
+    untagged response goes to the oldest pending command that asked for its
+    type and accepts it.  The last `max_untagged_responses` of each other
+    type are kept in `untagged_responses`.
+    Responses are returned in imaplib's (typ, data) form.  A command that
+    gets no tagged response within `timeout` seconds closes the session, so
+    a dead connection cannot stall its callers.
+    """
+
+    max_untagged_responses = 100
+
+    def __init__(self, reader, writer, timeout=60):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.folder = None
+        # Number of operations sharing the session, see `AsyncIMAPPool`.
+        self.users = 0
+        self.pending = {}
+        self.untagged_responses = {}
+        self.tags = itertools.count(1)
+        self.error = None
+        self.last_activity = time.monotonic()
+        self.reader_task = asyncio.create_task(self._read_responses())
+
+    @classmethod
+    async def connect(cls, host, port=993, ssl=True, timeout=60):
+        """
+        Connect to an IMAP server and wait for its greeting.
+        `ssl` is passed on to `asyncio.open_connection()`.
+        """
+
+        async def open_connection():
+            reader, writer = await asyncio.open_connection(
+                host, port, ssl=ssl, limit=2**20
+            )
+            try:
+                return reader, writer, await reader.readline()
+            except BaseException:
+                writer.close()
+                raise
+
+        try:
+            reader, writer, greeting = await asyncio.wait_for(
+                open_connection(), timeout
+            )
+        except asyncio.TimeoutError:
+            raise imaplib.IMAP4.abort(f"Timed out connecting to {host}:{port}.")
+        if not greeting.startswith((b"* OK", b"* PREAUTH")):
+            writer.close()
+            raise imaplib.IMAP4.error(f"Unexpected IMAP greeting: {greeting!r}")
+        return cls(reader, writer, timeout=timeout)
+
+    def is_closed(self):
+        return self.error is not None
+
+    async def command(self, name, *args, untagged=(), accepts=None, timeout=None):
+        """
+        Send a command and return its (typ, data) result.
+        `data` holds the untagged responses of the types in `untagged` that
+        `accepts` (if given) returned True for, or the text of the tagged
+        response if there were none.
+        If the command has not completed after `timeout` seconds (the
+        session's `timeout` by default), the session is closed and
+        imaplib.IMAP4.abort is raised.
+        """
+        if self.error is not None:
+            raise self.error
+        tag = f"A{next(self.tags):04d}"
+        words = [tag, name] + list(args)
+        line = b" ".join(w if isinstance(w, bytes) else w.encode() for w in words)
+        command = PendingCommand(untagged, accepts)
+        self.pending[tag.encode()] = command
+
+        async def send():
+            self.writer.write(line + b"\r\n")
+            await self.writer.drain()
+            return await command.future
+
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return await asyncio.wait_for(send(), timeout)
+        except asyncio.TimeoutError:
+            self._abort(imaplib.IMAP4.abort(f"IMAP {name} timed out."))
+            self.reader_task.cancel()
+            raise self.error
+
+    async def uid(self, name, *args, untagged=(), accepts=None):
+        """
+        Send a UID command, e.g. `uid("FETCH", "1:5", "(FLAGS)")`.
+        """
+        return await self.command(
+            "UID", name, *args, untagged=untagged, accepts=accepts
+        )
+
+    async def noop(self, timeout=None):
+        """
+        Check that the server still answers, raising imaplib.IMAP4.abort if
+        it does not.
+        """
+        response = await self.command("NOOP", timeout=timeout)
+        check_command_status(response, imaplib.IMAP4.abort)
+
+    async def xoauth2(self, email, access_token):
+        """
+        Authenticate with an OAuth2 access token.
+        """
+        auth_string = f"user={email}\x01auth=Bearer {access_token}\x01\x01"
+        response = await self.command(
+            "AUTHENTICATE", "XOAUTH2", base64.b64encode(auth_string.encode())
+        )
+        check_command_status(response, MailboxLoginError)
+
+    async def select(self, folder):
+        """
+        Select `folder` and return its UIDVALIDITY, UIDNEXT and HIGHESTMODSEQ
+        like `get_select_status()`.
+        """
+        self.folder = None
+        typ, data = await self.command(
+            "SELECT", quote_imap_string(utf7_encode(folder)), untagged=["OK"]
+        )
+        check_command_status((typ, data), imaplib.IMAP4.error)
+        self.folder = folder
+        status = dict(UIDVALIDITY=None, UIDNEXT=None, HIGHESTMODSEQ=None)
+        for line in data:
+            match = imap_status_code_pattern.search(line)
+            if match is None:
+                continue
+            name = match.group(1).decode().upper()
+            if name in status and match.group(2):
+                status[name] = int(match.group(2))
+        return status
+
+    async def uid_search(self, criteria="ALL"):
+        """
+        Return the UIDs in the selected folder that match `criteria`.
+        """
+        typ, data = await self.uid("SEARCH", str(criteria), untagged=["SEARCH"])
+        check_command_status((typ, data), imaplib.IMAP4.error)
+        uids = []
+        for line in data:
+            uids.extend(int(uid) for uid in line.split()[1:])
+        return uids
+
+    def close(self):
+        """
+        Log out without waiting for the server and drop the connection.
+        Pending commands fail with imaplib.IMAP4.abort.
+        """
+        if self.error is None:
+            self.writer.write(f"A{next(self.tags):04d} LOGOUT\r\n".encode())
+        self._abort(imaplib.IMAP4.abort("IMAP session closed."))
+        self.reader_task.cancel()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                response = await self._read_response()
+                self.last_activity = time.monotonic()
+                self._dispatch(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            self._abort(imaplib.IMAP4.abort(f"IMAP connection lost: {ex!r}"))
+
+    async def _read_response(self):
+        """
+        Read one response in imaplib's form: bytes for each line, and a
+        (line, literal) tuple for a line that ends by announcing a literal.
+        """
+        chunks = []
+        while True:
+            line = (await self.reader.readuntil(b"\r\n"))[:-2]
+            match = imap_literal_pattern.search(line)
+            if match is None:
+                chunks.append(line)
+                return chunks
+            literal = await self.reader.readexactly(int(match.group(1)))
+            chunks.append((line, literal))
+
+    def _dispatch(self, chunks):
+        first = chunks[0][0] if isinstance(chunks[0], tuple) else chunks[0]
+        if first.startswith(b"+"):
+            # Only SASL sends continuation requests; an empty response
+            # cancels the exchange so the command fails.
+            self.writer.write(b"\r\n")
+            return
+        if first.startswith(b"* "):
+            self._dispatch_untagged(chunks)
+            return
+        tag, _, rest = first.partition(b" ")
+        typ, _, text = rest.partition(b" ")
+        command = self.pending.pop(tag, None)
+        if command is None or command.future.done():
+            return
+        data = command.data if len(command.data) > 0 else [text]
+        command.future.set_result((typ.decode().upper(), data))
+
+    def _dispatch_untagged(self, chunks):
+        if isinstance(chunks[0], tuple):
+            chunks[0] = (chunks[0][0][2:], chunks[0][1])
+            first = chunks[0][0]
         else:
-            # There is at least 1 in-between UID we don't want to include.
-            item = uid_or_range(range_min_uid, range_max_uid)
-            results.append(item)
-            range_max_uid = candidate_uid
-            pos1 = pos0
-            range_min_uid = None
-    if range_max_uid is not None:
-        item = uid_or_range(range_min_uid, range_max_uid)
-        results.append(item)
-    return results
+            chunks[0] = first = chunks[0][2:]
+        words = first.split(b" ", 2)
+        if words[0].isdigit() and len(words) > 1:
+            typ = words[1].decode().upper()
+        else:
+            typ = words[0].decode().upper()
+        for command in self.pending.values():
+            if typ not in command.untagged:
+                continue
+            if command.accepts is not None and not command.accepts(chunks):
+                continue
+            command.data.extend(chunks)
+            return
+        responses = self.untagged_responses.get(typ)
+        if responses is None:
+            responses = deque(maxlen=self.max_untagged_responses)
+            self.untagged_responses[typ] = responses
+        responses.append(chunks)
 
+    def _abort(self, error):
+        if self.error is None:
+            self.error = error
+        for command in self.pending.values():
+            if not command.future.done():
+                command.future.set_exception(self.error)
+        self.pending = {}
+        self.writer.close()
 
-def uid_or_range(min_uid, max_uid):
+
+class PendingCommand:
     """
-    Return a single UID or a tuple representing a pair (min_uid, max_uid).
+    A command sent by `AsyncIMAPClient` that awaits its tagged response.
     """
-    if min_uid is None:
-        return max_uid
-    else:
-        return (min_uid, max_uid)
 
+    def __init__(self, untagged=(), accepts=None):
+        self.untagged = set(name.upper() for name in untagged)
+        self.accepts = accepts
+        self.data = []
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class AsyncIMAPPool:
+    """
+    A few `AsyncIMAPClient` sessions shared by the coroutines on one event
+    loop.
 
-def uid_seq_to_criteria(uids):
+    Because commands are pipelined, every operation on a folder shares the
+    session that has it selected.  A session only switches folders once no
+    operation is using it, and new sessions are opened up to `max_size`.
+    Sessions that have been quiet for `noop_after` seconds are checked with
+    NOOP before they are handed out, and a session whose connection fails
+    or times out is discarded.
     """
-    Convert a list of items into a string representation of a UID set.
-    Items may be integers or ranges.
-    Ranges are tuple(min_uid, max_uid).
+
+    def __init__(
+        self,
+        config,
+        get_access_token,
+        max_size=2,
+        host="imap.gmail.com",
+        port=993,
+        ssl=True,
+        timeout=60,
+        noop_after=30,
+    ):
+        """
+        `get_access_token` is a callable that returns a valid OAuth2 access
+        token.  It is called in a worker thread when a session is opened.
+        `timeout` bounds each connection attempt and command, in seconds.
+        """
+        self.config = config
+        self.get_access_token = get_access_token
+        self.max_size = max_size
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.timeout = timeout
+        self.noop_after = noop_after
+        self.clients = []
+        self.condition = asyncio.Condition()
+        self._closed = False
+
+    @contextlib.asynccontextmanager
+    async def client(self, folder=None):
+        """
+        Async context manager.
+        Check out an authenticated `AsyncIMAPClient`, with `folder` selected
+        if it is not None.  Other operations on the same folder may use the
+        session at the same time.
+        """
+        client = await self._checkout(folder)
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            client.close()
+            raise
+        finally:
+            async with self.condition:
+                client.users -= 1
+                self.condition.notify_all()
+
+    def close(self):
+        """
+        Close all sessions and refuse to hand out new ones.
+        """
+        self._closed = True
+        clients = self.clients
+        self.clients = []
+        for client in clients:
+            client.close()
+
+    async def _checkout(self, folder):
+        async with self.condition:
+            while True:
+                if self._closed:
+                    raise Exception("IMAP connection pool is closed.")
+                self.clients = [c for c in self.clients if not c.is_closed()]
+                client = self._find_client(folder)
+                if client is not None and not await self._is_healthy(client):
+                    logger.debug("Discarding stale IMAP session.")
+                    client.close()
+                    continue
+                if client is None and len(self.clients) < self.max_size:
+                    client = await self._connect()
+                    self.clients.append(client)
+                if client is not None:
+                    break
+                await self.condition.wait()
+            if folder is not None and client.folder != folder:
+                try:
+                    await client.select(folder)
+                except CONNECTION_ERRORS:
+                    client.close()
+                    raise
+            client.users += 1
+            return client
+
+    def _find_client(self, folder):
+        """
+        Return a session already on `folder`, or else an unused one.
+        """
+        for client in self.clients:
+            if folder is None or client.folder == folder:
+                return client
+        for client in self.clients:
+            if client.users == 0:
+                return client
+        return None
+
+    async def _is_healthy(self, client):
+        """
+        Send NOOP on a session nobody is using if it has been quiet for
+        `noop_after` seconds.  Sessions in use are covered by their commands'
+        timeouts.
+        """
+        if client.users > 0:
+            return True
+        if time.monotonic() - client.last_activity < self.noop_after:
+            return True
+        try:
+            await client.noop()
+        except CONNECTION_ERRORS as ex:
+            logger.debug(f"IMAP NOOP failed: {ex}")
+            return False
+        return True
+
+    async def _connect(self):
+        email = self.config["oauth2"]["email"]
+        access_token = await asyncio.to_thread(self.get_access_token)
+        client = await AsyncIMAPClient.connect(
+            self.host, self.port, ssl=self.ssl, timeout=self.timeout
+        )
+        try:
+            await client.xoauth2(email, access_token)
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+
+async def fetch_google_message_batch(client, uid_batch, headers_only=True):
     """
-    criteria = []
-    for item in uids:
+    Fetch the messages in `uid_batch` from the selected folder with a single
+    UID FETCH, like one batch of `fetch_google_message_batches()`.
+    The response is parsed in a worker thread.
+    """
+    message_items, body_item = google_message_fetch_items(headers_only)
+    uid_set = UIDSet(uid_batch)
+
+    def accepts(chunks):
+        uid = fetch_response_uid(chunks)
+        return uid is not None and uid in uid_set
+
+    response = await client.uid(
+        "FETCH", str(uid_set), message_items, untagged=["FETCH"], accepts=accepts
+    )
+    check_command_status(response, MailboxFetchError)
+    return await asyncio.to_thread(
+        google_message_batch_from_response, response, uid_batch, body_item
+    )
+
+
+def fetch_response_uid(chunks):
+    """
+    Return the UID in an untagged FETCH response, or None.
+    The whole response is parsed, because Gmail may send the UID after
+    literals such as X-GM-LABELS, and quoted strings may contain "UID n".
+    """
+    for msg_number, response_parts in parse_fetch_response(chunks):
+        values = dict(zip(response_parts[::2], response_parts[1::2]))
+        uid = values.get("UID")
+        if isinstance(uid, str) and uid.isdigit():
+            return int(uid)
+    return None
+
+
+async def stream_google_message_batches(
+    pool, folder, uids, batch_size=100, headers_only=True, window=4
+):
+    """
+    Async generator.
+    Fetch the messages with `uids` from `folder` over the `AsyncIMAPPool`
+    `pool` and produce a list of (gmessage_id, gthread_id, glabels, msg)
+    tuples per batch, in `uids` order.
+    Up to `window` batch FETCHes are in flight at once, so later batches
+    download and parse while the consumer stores earlier ones.
+    """
+    async with pool.client(folder) as client:
+        uid_batches = batched(uids, batch_size)
+        fetches = deque()
+
+        def start_fetches(n):
+            for uid_batch in islice(uid_batches, n):
+                fetch = fetch_google_message_batch(client, uid_batch, headers_only)
+                fetches.append(asyncio.ensure_future(fetch))
+
+        try:
+            start_fetches(window)
+            while len(fetches) > 0:
+                batch = await fetches.popleft()
+                start_fetches(1)
+                if len(batch) > 0:
+                    yield batch
+        finally:
+            for fetch in fetches:
+                fetch.cancel()
+
+
+def iterate_from_thread(loop, aiterable, poll_interval=1):
+    """
+    Iterate over the async iterable `aiterable`, running it on the event
+    loop `loop`, from a worker thread.
+    Closing the iterator early closes `aiterable` as well.  Raises
+    imaplib.IMAP4.abort if the loop stops while an item is awaited.
+    """
+    iterator = aiterable.__aiter__()
+
+    async def next_item():
+        return await iterator.__anext__()
+
+    async def close():
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def run(coro):
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        while True:
+            try:
+                return future.result(poll_interval)
+            except TimeoutError:
+                if not loop.is_running():
+                    future.cancel()
+                    raise imaplib.IMAP4.abort("The event loop has stopped.")
+
+    try:
+        while True:
+            try:
+                yield run(next_item())
+            except StopAsyncIteration:
+                return
+    finally:
+        if loop.is_running():
+            run(close())
+
+
+def get_capabilities(mailbox):
+    """
+    Return the set of capabilities the server advertises to an
+    authenticated session.
+    """
+    typ, data = mailbox.client.capability()
+    if typ != "OK" or not data:
+        return set([])
+    return set(data[-1].decode().upper().split())
+
+
+def enable_qresync(mailbox):
+    """
+    Enable the QRESYNC extension.
+    Must be called before the folder is selected.
+    Returns True if the server enabled it.
+    """
+    client = mailbox.client
+    typ, data = client._simple_command("ENABLE", "QRESYNC")
+    if typ != "OK":
+        return False
+    typ, data = client._untagged_response(typ, data, "ENABLED")
+    enabled = b" ".join(item for item in data if item)
+    return b"QRESYNC" in enabled.upper()
+
+
+def get_select_status(mailbox):
+    """
+    Return the UIDVALIDITY, UIDNEXT and HIGHESTMODSEQ values the server
+    reported when the current folder was selected.
+    Values the server did not report are None.
+    """
+    untagged_responses = mailbox.client.untagged_responses
+    status = {}
+    for name in ("UIDVALIDITY", "UIDNEXT", "HIGHESTMODSEQ"):
+        data = untagged_responses.get(name)
+        status[name] = int(data[-1]) if data else None
+    return status
+
+
+status_highestmodseq_pattern = re.compile(rb"HIGHESTMODSEQ (\d+)")
+
+
+def get_highestmodseq(mailbox):
+    """
+    Return the current HIGHESTMODSEQ of the selected folder from a STATUS
+    command, or None if the server does not report it.
+    """
+    client = mailbox.client
+    typ, data = client._simple_command(
+        "STATUS", encode_folder(mailbox.folder.get()), "(HIGHESTMODSEQ)"
+    )
+    if typ != "OK":
+        return None
+    typ, data = client._untagged_response(typ, data, "STATUS")
+    for item in data:
         if isinstance(item, tuple):
-            criteria.append(f"{str(item[0])}:{str(item[1])}")
+            item = item[-1]
+        match = status_highestmodseq_pattern.search(item or b"")
+        if match is not None:
+            return int(match.group(1))
+    return None
+
+
+fetch_uid_pattern = re.compile(rb"UID (\d+)")
+fetch_modseq_pattern = re.compile(rb"MODSEQ \((\d+)\)")
+
+
+def fetch_changed_flags(mailbox, modseq, vanished=False):
+    """
+    Fetch the flags of every message in the current folder whose mod-sequence
+    is greater than `modseq`.
+    If `vanished` is True (QRESYNC must be enabled), also collect the UIDs
+    expunged since `modseq`.
+    Returns (changes, vanished_uids) where `changes` is a list of
+    (uid, flags, modseq) tuples and `vanished_uids` is a UIDSet.
+    """
+    client = mailbox.client
+    modifiers = f"CHANGEDSINCE {modseq}"
+    if vanished:
+        modifiers = f"{modifiers} VANISHED"
+    typ, data = client.uid("FETCH", "1:*", f"(UID FLAGS) ({modifiers})")
+    changes = []
+    if typ != "OK":
+        return changes, UIDSet()
+    for line in data:
+        if isinstance(line, tuple):
+            line = line[0]
+        if not line:
+            continue
+        uid_match = fetch_uid_pattern.search(line)
+        if uid_match is None:
+            continue
+        uid = int(uid_match.group(1))
+        modseq_match = fetch_modseq_pattern.search(line)
+        line_modseq = None if modseq_match is None else int(modseq_match.group(1))
+        flags = tuple(flag.decode() for flag in imaplib.ParseFlags(line))
+        changes.append((uid, flags, line_modseq))
+    vanished_uids = UIDSet()
+    for item in client.untagged_responses.pop("VANISHED", []):
+        if isinstance(item, tuple):
+            item = item[0]
+        text = item.decode()
+        if text.upper().startswith("(EARLIER)"):
+            text = text[len("(EARLIER)") :]
+        vanished_uids = vanished_uids | UIDSet.parse(text.strip())
+    return changes, vanished_uids
+
+
+class UIDSet:
+    """
+    A set of UIDs stored as sorted, disjoint, non-adjacent inclusive ranges.
+    Serializes to and parses from IMAP sequence-set syntax, e.g. "1,3:5".
+    """
+
+    def __init__(self, uids=()):
+        uids = sorted(set(map(int, uids)))
+        if len(uids) == 0:
+            self.ranges = []
+            return
+        # A range ends wherever the next UID is not adjacent.
+        breaks = [(lo, hi) for lo, hi in zip(uids, uids[1:]) if hi - lo > 1]
+        starts = [uids[0]] + [hi for lo, hi in breaks]
+        ends = [lo for lo, hi in breaks] + [uids[-1]]
+        self.ranges = list(zip(starts, ends))
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """
+        Create a UID set from (min_uid, max_uid) pairs in any order.
+        """
+        return cls._from_sorted_ranges(sorted(ranges))
+
+    @classmethod
+    def _from_sorted_ranges(cls, ranges):
+        uid_set = cls()
+        uid_set.ranges = coalesce_uid_ranges(ranges)
+        return uid_set
+
+    @classmethod
+    def from_range(cls, min_uid, max_uid):
+        """
+        Create a UID set of all UIDs from `min_uid` to `max_uid` (inclusive).
+        """
+        if min_uid > max_uid:
+            return cls()
+        return cls.from_ranges([(min_uid, max_uid)])
+
+    @classmethod
+    def parse(cls, s):
+        """
+        Parse an IMAP sequence set of UIDs, e.g. "1,3:5".
+        """
+        ranges = []
+        for item in s.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if ":" in item:
+                lo, hi = sorted(int(n) for n in item.split(":"))
+            else:
+                lo = hi = int(item)
+            ranges.append((lo, hi))
+        return cls.from_ranges(ranges)
+
+    def __str__(self):
+        return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in self.ranges)
+
+    def __repr__(self):
+        return f"UIDSet({str(self)!r})"
+
+    def __iter__(self):
+        for lo, hi in self.ranges:
+            yield from range(lo, hi + 1)
+
+    def __len__(self):
+        return sum(hi - lo + 1 for lo, hi in self.ranges)
+
+    def __bool__(self):
+        return len(self.ranges) > 0
+
+    def __contains__(self, uid):
+        pos = bisect.bisect_right(self.ranges, (int(uid), UID_UPPER_BOUND))
+        return pos > 0 and self.ranges[pos - 1][1] >= int(uid)
+
+    def __eq__(self, other):
+        if not isinstance(other, UIDSet):
+            return NotImplemented
+        return self.ranges == other.ranges
+
+    def min(self):
+        return self.ranges[0][0] if self.ranges else None
+
+    def max(self):
+        return self.ranges[-1][1] if self.ranges else None
+
+    def union(self, other):
+        """
+        Return the UIDs in either set.
+        """
+        merged = list(heapq.merge(self.ranges, other.ranges))
+        return self._from_sorted_ranges(merged)
+
+    def intersection(self, other):
+        """
+        Return the UIDs in both sets.
+        """
+        ranges = []
+        a, b = self.ranges, other.ranges
+        i = j = 0
+        while i < len(a) and j < len(b):
+            lo = max(a[i][0], b[j][0])
+            hi = min(a[i][1], b[j][1])
+            if lo <= hi:
+                ranges.append((lo, hi))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return self._from_sorted_ranges(ranges)
+
+    def difference(self, other):
+        """
+        Return the UIDs in this set that are not in `other`.
+        """
+        ranges = []
+        b = other.ranges
+        j = 0
+        for lo, hi in self.ranges:
+            while j < len(b) and b[j][1] < lo:
+                j += 1
+            k = j
+            while k < len(b) and b[k][0] <= hi:
+                if b[k][0] > lo:
+                    ranges.append((lo, b[k][0] - 1))
+                lo = b[k][1] + 1
+                k += 1
+            if lo <= hi:
+                ranges.append((lo, hi))
+        return self._from_sorted_ranges(ranges)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+def coalesce_uid_ranges(ranges):
+    """
+    Merge sorted (min_uid, max_uid) pairs that overlap or touch.
+    """
+    results = []
+    for lo, hi in ranges:
+        if len(results) > 0 and lo <= results[-1][1] + 1:
+            if hi > results[-1][1]:
+                results[-1] = (results[-1][0], hi)
         else:
-            criteria.append(str(item))
-    return ",".join(criteria)
+            results.append((lo, hi))
+    return results
+
+
+def gthread_id_to_int(gthread_id):
+    """
+    Convert an X-GM-THRID to an integer, or None if it is missing.
+    """
+    if gthread_id is None:
+        return None
+    return int(gthread_id)
 
 
 def is_unread(flags):
@@ -0,0 +1,184 @@
+import json
+
+from gmailtuilib.attachments import has_attachment_parts, store_message_attachments
+from gmailtuilib.compression import CODEC_NONE, encode_message_string
+from gmailtuilib.imap import (
+    UID_UPPER_BOUND,
+    UIDSet,
+    gthread_id_to_int,
+    is_starred,
+    is_unread,
+)
+from gmailtuilib.message import get_display_fields, get_search_fields
+from gmailtuilib.sqllib import (
+    sql_delete_message_labels_in_uid_ranges,
+    sql_get_label_id,
+    sql_index_message_text,
+    sql_insert_message_attachment,
+    sql_mark_message_text_indexed,
+    sql_reapply_outbox_read_status,
+    sql_update_message_flags,
+    sql_upsert_message,
+    sql_upsert_message_label,
+)
+
+
+def ingest_messages(
+    cursor,
+    label,
+    batch,
+    update_only=False,
+    codec=CODEC_NONE,
+    attachment_store=None,
+    headers_only=False,
+):
+    """
+    Write a batch of (gmessage_id, gthread_id, glabels, msg) tuples, as
+    produced by `fetch_google_message_batches()`, to the cache.
+    `msg` must be an imap_tools.message.Message.
+
+    Messages are upserted with one statement each via `executemany()`.  If
+    `update_only` is True, only the flags of messages that are already cached
+    are updated.  If `label` is not None, the messages are recorded under that
+    label with their UIDs.  New message bodies are stored encoded with
+    `codec`.  If `attachment_store` is not None, attachment payloads are moved
+    to it and only stubs are kept in the cached message.  If `headers_only` is
+    True, the messages were fetched without their bodies; their headers are
+    cached until the bodies are ingested, and they are not added to the
+    search index yet.  The caller is responsible for committing.
+    """
+    label_id = None
+    if label is not None:
+        cursor.execute(sql_get_label_id, [label])
+        row = cursor.fetchone()
+        if row is not None:
+            label_id = row[0]
+    message_params = []
+    message_label_params = []
+    attachment_params = []
+    index_params = []
+    for gmessage_id, gthread_id, glabels, msg in batch:
+        if gmessage_id is None:
+            continue
+        flags = msg.flags
+        unread = is_unread(flags)
+        starred = is_starred(flags)
+        if update_only:
+            message_params.append([unread, starred, gmessage_id])
+        else:
+            message_string = msg.obj.as_string()
+            fields = get_display_fields(msg.obj, msg.size_rfc822 or len(message_string))
+            if not headers_only:
+                index_params.append(search_index_params(msg.obj, gmessage_id))
+            if (
+                not headers_only
+                and attachment_store is not None
+                and has_attachment_parts(msg.obj)
+            ):
+                message_string, refs = store_message_attachments(
+                    message_string, attachment_store
+                )
+                for part_index, digest, filename, content_type, size in refs:
+                    attachment_params.append(
+                        [part_index, digest, filename, content_type, size, gmessage_id]
+                    )
+            message_params.append(
+                [
+                    gmessage_id,
+                    gthread_id,
+                    encode_message_string(message_string, codec),
+                    unread,
+                    starred,
+                    fields["date_epoch"],
+                    fields["sender"],
+                    fields["subject"],
+                    fields["size"],
+                    gthread_id_to_int(gthread_id),
+                    codec,
+                    int(not headers_only),
+                ]
+            )
+        if label_id is not None:
+            message_label_params.append([label_id, int(msg.uid), gmessage_id])
+    if update_only:
+        cursor.executemany(sql_update_message_flags, message_params)
+        cursor.execute(sql_reapply_outbox_read_status)
+    else:
+        cursor.executemany(sql_upsert_message, message_params)
+        cursor.executemany(sql_insert_message_attachment, attachment_params)
+        index_message_text(cursor, index_params)
+    cursor.executemany(sql_upsert_message_label, message_label_params)
+
+
+def search_index_params(msg, gmessage_id):
+    """
+    Return the parameters that add an email message to the local search
+    index.
+    """
+    fields = get_search_fields(msg)
+    return [
+        fields["subject"],
+        fields["sender"],
+        fields["recipients"],
+        fields["body"],
+        gmessage_id,
+    ]
+
+
+def index_message_text(cursor, index_params):
+    """
+    Add messages to the local search index.  `index_params` is a list of
+    values returned by `search_index_params()`.  Messages that are already
+    indexed are skipped.
+    """
+    cursor.executemany(sql_index_message_text, index_params)
+    cursor.executemany(
+        sql_mark_message_text_indexed, ([params[-1]] for params in index_params)
+    )
+
+
+def find_cached_gmessage_ids(cursor, gmessage_ids):
+    """
+    Return the subset of `gmessage_ids` that are already cached.
+    """
+    gmessage_ids = list(gmessage_ids)
+    if len(gmessage_ids) == 0:
+        return set([])
+    placeholders = ", ".join("?" for _ in gmessage_ids)
+    cursor.execute(
+        f"SELECT gmessage_id FROM messages WHERE gmessage_id IN ({placeholders})",
+        gmessage_ids,
+    )
+    return set(row[0] for row in cursor.fetchall())
+
+
+def delete_stale_message_labels(cursor, label, uids, min_uid=0, max_uid=None):
+    """
+    Delete the cached message labels for `label` with UIDs between `min_uid`
+    and `max_uid` (inclusive) that are not in `uids`, the UIDs the server
+    reported.
+    Only the gaps between the server's UIDs are sent, as a JSON array of
+    (min_uid, max_uid) ranges, so the DELETE does one index range scan per
+    gap instead of checking every cached row.
+    Returns the number of message labels deleted.
+    """
+    if max_uid is None:
+        max_uid = UID_UPPER_BOUND
+    gaps = UIDSet.from_range(min_uid, max_uid) - UIDSet(uids)
+    return delete_message_labels(cursor, label, gaps)
+
+
+def delete_message_labels(cursor, label, uid_set):
+    """
+    Delete the cached message labels for `label` with UIDs in the UIDSet
+    `uid_set`.
+    The ranges of `uid_set` are sent as a JSON array, so each range costs
+    one index range scan however many UIDs it covers.
+    Returns the number of message labels deleted.
+    """
+    if not uid_set:
+        return 0
+    cursor.execute(
+        sql_delete_message_labels_in_uid_ranges, [json.dumps(uid_set.ranges), label]
+    )
+    return cursor.rowcount
@@ -0,0 +1,12 @@
+def first_difference(old_keys, new_keys):
+    """
+    Return the first position at which the sequences `old_keys` and
+    `new_keys` hold different keys.  If one is a prefix of the other, that
+    is the length of the shorter one, so equal sequences return their
+    length.
+    Runs in time proportional to the common prefix.
+    """
+    for pos, (old_key, new_key) in enumerate(zip(old_keys, new_keys)):
+        if old_key != new_key:
+            return pos
+    return min(len(old_keys), len(new_keys))
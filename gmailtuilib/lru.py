@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that discards the least recently used entries once it
+    holds more than `maxsize` entries, or once the total weight of its values
+    exceeds `maxweight`.  `weigh` returns the weight of a value, e.g. its size
+    in bytes.
+    `clear()` starts a new generation.  A `put()` made with the generation
+    read before its value was computed is dropped if the cache was cleared in
+    the meantime, so a slow loader cannot store data that is already stale.
+    """
+
+    def __init__(self, maxsize=None, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.entries = OrderedDict()
+        self.weights = {}
+        self.weight = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """
+        Return the value for `key` and mark it as most recently used.
+        """
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self.entries[key]
+
+    def put(self, key, value, generation=None):
+        """
+        Store `value` under `key` as the most recently used entry.
+        Returns False if the value was dropped because `generation` is stale
+        or because it weighs more than the whole cache may.
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._remove(key)
+            self.entries[key] = value
+            if self.weigh is not None:
+                weight = self.weigh(value)
+                self.weights[key] = weight
+                self.weight += weight
+            while len(self.entries) > 0 and self._is_full():
+                self._remove(next(iter(self.entries)))
+            return key in self.entries
+
+    def _is_full(self):
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            return True
+        return self.maxweight is not None and self.weight > self.maxweight
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        self.weight -= self.weights.pop(key, 0)
+
+    def discard(self, key):
+        """
+        Remove `key` if it is present.
+        """
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        """
+        Remove all entries and start a new generation.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.weights.clear()
+            self.weight = 0
+            self.generation += 1
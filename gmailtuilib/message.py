@@ -1,7 +1,12 @@
+import datetime
+import html
 import os
 import pathlib
+import re
 import subprocess
+import sys
 import tempfile
+from email.header import decode_header, make_header
 from email.mime.text import MIMEText
 from email.parser import Parser
 from email.policy import default as default_policy
@@ -9,7 +14,9 @@ from enum import IntEnum
 
 import html2text
 import logzero
+from dateutil.parser import parse as parse_date
 from logzero import logger
+from textual import work
 from textual.containers import (Horizontal, HorizontalScroll,
                                 ScrollableContainer)
 from textual.reactive import reactive
@@ -17,9 +24,15 @@ from textual.screen import ModalScreen
 from textual.widgets import (Button, Footer, Header, Input, Label, Static,
                              TextArea)
 
+from gmailtuilib.attachments import get_part_size, save_attachment
 from gmailtuilib.oauth2 import get_oauth2_access_token
 from gmailtuilib.parsers import parse_maybe_quoted_csv
 
+# Matches HTML tags, and script and style elements with their contents.
+html_tag_pattern = re.compile(
+    r"<(?:script|style)\b.*?</(?:script|style)\s*>|<[^>]*>", re.I | re.S
+)
+
 
 class MessageDismissResult(IntEnum):
     EXIT = 0
@@ -249,22 +262,57 @@ class CompositionScreen(ModalScreen):
 
 
 class AttachmentButton(Button):
-    binary_data = None
+    part_id = None
     fname = None
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fname = kwargs.get("label")
+    attachment_size = None
+    saved_percent = None
 
     def on_button_pressed(self):
+        msg = self.screen.msg
+        part = get_message_part(msg, self.part_id)
+        if part is None:
+            logger.debug(f"Attachment part {self.part_id} not found.")
+            return
+        self.disabled = True
+        self.save_attachment(part)
+
+    @work(thread=True)
+    def save_attachment(self, part):
+        """
+        Save the attachment to ~/Downloads, showing the progress on the button.
+        """
         full_path = (
             pathlib.Path("~/Downloads")
             .expanduser()
-            .joinpath(pathlib.Path(self.fname).name)
+            .joinpath(pathlib.Path(self.fname or "attachment").name)
         )
-        with open(full_path, "wb") as f:
-            f.write(self.binary_data)
+        self.saved_percent = None
+        try:
+            save_attachment(
+                part,
+                full_path,
+                store=self.app.attachment_store,
+                progress=self.report_progress,
+            )
+        except Exception as ex:
+            logger.debug(f"Could not save attachment to {full_path}: {ex}")
+            self.app.call_from_thread(self.finish_saving, "failed")
+            return
         logger.debug(f"Saved attachment to {full_path}.")
+        self.app.call_from_thread(self.finish_saving, "saved")
+
+    def report_progress(self, written, total):
+        if not total:
+            return
+        percent = min(written * 100 // total, 100)
+        if percent == self.saved_percent:
+            return
+        self.saved_percent = percent
+        self.app.call_from_thread(setattr, self, "label", f"{self.fname} ({percent}%)")
+
+    def finish_saving(self, status):
+        self.label = f"{self.fname} ({status})"
+        self.disabled = False
 
 
 class EmailHeadersWidget(Static):
@@ -309,6 +357,8 @@ class MessageScreen(ModalScreen):
 
     msg = reactive(None, init=False, recompose=True)
     text = reactive("No text.")
+    # Text already rendered for the next `msg`.
+    rendered_text = None
 
     def compose(self):
         yield Header()
@@ -318,7 +368,7 @@ class MessageScreen(ModalScreen):
         text_area = CopyableTextArea(self.text, id="msg-text", read_only=True)
         message_text_area = ScrollableContainer(text_area, id="message-text-area")
         yield message_text_area
-        attachments = get_attachments(self.msg)
+        attachments = get_attachments(self.msg, self.app.attachment_store)
         buttons = create_attachment_buttons(attachments)
         if len(buttons) > 0:
             message_text_area.add_class("attachments")
@@ -332,19 +382,21 @@ class MessageScreen(ModalScreen):
         if msg is None:
             logger.debug("msg is None.  Exiting function.")
             return
-        text = get_text_from_message(msg, "text/plain")
-        if text is None or text.strip() == "":
-            logger.debug("No message text with content-type text/plain.")
-            text = get_text_from_message(msg, "text/html")
-            if text is None or text.strip() == "":
-                logger.debug("No message text with content-type text/html.")
-                text = ""
-            else:
-                logger.debug("Got HTML text.")
-                text = html2text.html2text(text)
-        text = text.lstrip()
+        text = self.rendered_text
+        if text is None:
+            text = get_message_text(msg)
         self.text = text
 
+    def show_message(self, rendered):
+        """
+        Show a message parsed and rendered by `render_message()`.
+        """
+        self.rendered_text = rendered.text
+        try:
+            self.msg = rendered.msg
+        finally:
+            self.rendered_text = None
+
     def action_back(self):
         self.dismiss(MessageDismissResult.EXIT)
 
@@ -400,6 +452,54 @@ class InboxMessageScreen(MessageScreen):
         self.dismiss(MessageDismissResult.TRASH)
 
 
+class RenderedMessage:
+    """
+    A parsed email message and the text `MessageScreen` shows for it.
+    `size` estimates the memory both take, in bytes.  `has_body` is False if
+    only the headers of the message were available.
+    """
+
+    def __init__(self, msg, text, size, has_body=True):
+        self.msg = msg
+        self.text = text
+        self.size = size
+        self.has_body = has_body
+
+
+def render_message(message_string, has_body=True):
+    """
+    Parse a serialized email message and render its text for display.
+    `has_body` is False if `message_string` only holds the headers.
+    Returns a RenderedMessage.
+    """
+    msg = str_to_email_msg(message_string)
+    if has_body:
+        text = get_message_text(msg)
+    else:
+        text = "Downloading message ..."
+    # The parsed message holds about as much text as the string it came from.
+    size = sys.getsizeof(message_string) + sys.getsizeof(text)
+    return RenderedMessage(msg, text, size, has_body)
+
+
+def get_message_text(msg):
+    """
+    Return the text shown for an email message: its plain text part, or else
+    its HTML part converted to text.
+    """
+    text = get_text_from_message(msg, "text/plain")
+    if text is None or text.strip() == "":
+        logger.debug("No message text with content-type text/plain.")
+        text = get_text_from_message(msg, "text/html")
+        if text is None or text.strip() == "":
+            logger.debug("No message text with content-type text/html.")
+            text = ""
+        else:
+            logger.debug("Got HTML text.")
+            text = html2text.html2text(text)
+    return text.lstrip()
+
+
 def get_text_from_message(msg, content_type="text/plain"):
     """
     Extract text from email message.
@@ -422,33 +522,148 @@ def get_text_from_message(msg, content_type="text/plain"):
     return None
 
 
-def get_attachments(msg):
+def get_display_fields(msg, size):
+    """
+    Extract the fields shown in message lists from the headers of an email
+    message, decoding any encoded words.
+    Returns a dict with keys "date_epoch", "sender", "subject" and "size".
+    """
+    date_epoch = None
+    date = msg.get("Date")
+    if date is not None:
+        try:
+            date_epoch = int(parse_date(str(date)).timestamp())
+        except (ValueError, OverflowError):
+            logger.debug(f"Could not parse message date: {date}")
+    return {
+        "date_epoch": date_epoch,
+        "sender": decode_header_value(msg.get("From")),
+        "subject": decode_header_value(msg.get("Subject")),
+        "size": size,
+    }
+
+
+def decode_header_value(value):
+    """
+    Decode a raw header value into a string.
+    """
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(str(value))))
+    except (LookupError, UnicodeError, ValueError):
+        return str(value)
+
+
+def get_search_fields(msg):
     """
-    Extract attachments from an email message.
-    Return a list of (name, binary_data)
+    Extract the text indexed for local search from an email message.
+    Returns a dict with keys "subject", "sender", "recipients" and "body".
+    """
+    recipients = [
+        decode_header_value(value)
+        for name in ("To", "Cc")
+        for value in (msg.get_all(name) or [])
+    ]
+    body = get_body_text(msg, "text/plain")
+    if body is None:
+        body = get_body_text(msg, "text/html")
+        if body is not None:
+            body = html.unescape(html_tag_pattern.sub(" ", body))
+    return {
+        "subject": decode_header_value(msg.get("Subject")),
+        "sender": decode_header_value(msg.get("From")),
+        "recipients": " ".join(recipients),
+        "body": body or "",
+    }
+
+
+def get_body_text(msg, content_type):
+    """
+    Return the decoded text of the first non-attachment part of an email
+    message with `content_type`, or None.
+    Unlike `get_text_from_message()`, undecodable text never raises.
+    """
+    for part in msg.walk():
+        if part.get_content_type() != content_type:
+            continue
+        if part.get_content_disposition() == "attachment":
+            continue
+        payload = part.get_payload(decode=True)
+        if not isinstance(payload, bytes):
+            continue
+        charset = part.get_content_charset() or "utf-8"
+        try:
+            return payload.decode(charset, "replace")
+        except LookupError:
+            return payload.decode("utf-8", "replace")
+    return None
+
+
+def format_date_epoch(date_epoch, tz):
+    """
+    Format a POSIX timestamp for display in the time zone `tz`.
+    """
+    if date_epoch is None:
+        return ""
+    return datetime.datetime.fromtimestamp(date_epoch, tz).isoformat()
+
+
+def get_attachments(msg, store=None):
+    """
+    Find the attachments of an email message.
+    Return a list of (part_id, name, size), where `part_id` is the index of
+    the part in `msg.walk()`.  Payloads are only decoded or read from the
+    attachment store when an attachment is saved.
     """
     attachments = []
     if msg is None:
         return attachments
+    part_ids = {id(part): part_id for part_id, part in enumerate(msg.walk())}
     for attachment in msg.iter_attachments():
         fname = attachment.get_filename()
-        data = attachment.get_payload(decode=True)
-        attachments.append((fname, data))
+        size = get_part_size(attachment, store)
+        attachments.append((part_ids[id(attachment)], fname, size))
     return attachments
 
 
+def get_message_part(msg, part_id):
+    """
+    Return the part of an email message with index `part_id` in
+    `msg.walk()`, or None.
+    """
+    for index, part in enumerate(msg.walk()):
+        if index == part_id:
+            return part
+    return None
+
+
 def create_attachment_buttons(attachments):
     """
     Returns a list of attachment buttons.
     """
     buttons = []
-    for fname, data in attachments:
-        button = AttachmentButton(label=fname)
-        button.binary_data = data
+    for part_id, fname, size in attachments:
+        label = fname if size is None else f"{fname} ({format_size(size)})"
+        button = AttachmentButton(label=label)
+        button.part_id = part_id
+        button.fname = fname
+        button.attachment_size = size
         buttons.append(button)
     return buttons
 
 
+def format_size(size):
+    """
+    Format a size in bytes for display.
+    """
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
 def msg_to_email_msg(msg):
     """
     Convert email.message.Message to email.message.EmailMessage.
@@ -1,14 +1,21 @@
+import datetime
 import json
+import os
 import pathlib
-import sys
+import tempfile
+import threading
+
+import requests
 from dateutil.parser import parse as parse_date
-import datetime
 from dateutil.tz import tzlocal
-import requests
+from logzero import logger
 
 # The URL root for accessing Google Accounts.
 GOOGLE_ACCOUNTS_BASE_URL = "https://accounts.google.com"
 
+_token_manager = None
+_token_manager_lock = threading.Lock()
+
 
 def accounts_url(command):
     """
@@ -32,59 +39,195 @@ def get_client_config(imap_config):
     return client_id, client_secret
 
 
-def get_oauth2_access_token(config):
+class TokenManager:
     """
-    Get a valid OAuth2 access token to be used with IMAP.
+    Holds the OAuth2 tokens in memory and keeps the access token fresh.
+
+    Concurrent callers that find the access token expired share a single
+    refresh.  Once started, the manager renews the token in the background
+    `refresh_margin` seconds before it expires, so callers normally never
+    wait on the token file or on Google Accounts.
     """
-    oauth2_config = config.get("oauth2", {})
-    expired = True
-    client_id, client_secret = get_client_config(oauth2_config)
-    token_path = pathlib.Path("~/.gmail_tui/access-tokens.json").expanduser()
-    if token_path.exists():
-        with open(token_path, "r") as f:
-            tokens = json.load(f)
-        expires_at = tokens["expires_at"]
-        dt_expires = parse_date(expires_at)
-        dt = datetime.datetime.today().replace(tzinfo=tzlocal())
-        if dt < dt_expires:
-            print("Access token is still valid.", file=sys.stderr)
-            expired = False
-        else:
-            print("Refreshing tokens ...", file=sys.stderr)
+
+    refresh_margin = 300
+    retry_interval = 60
+
+    def __init__(self, config, token_path="~/.gmail_tui/access-tokens.json"):
+        self.config = config
+        self.token_path = pathlib.Path(token_path).expanduser()
+        self.session = requests.Session()
+        self._client_config = None
+        self._tokens = None
+        self._expires_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+        self._stopped = False
+
+    def start(self):
+        """
+        Load the tokens and schedule background renewal.
+        If the tokens cannot be loaded or refreshed, renewal is retried
+        after `retry_interval` seconds and the error is raised.
+        """
+        self._stopped = False
+        try:
+            self.get_access_token()
+        except Exception:
+            self._schedule_refresh(delay=self.retry_interval)
+            raise
+        self._schedule_refresh()
+
+    def stop(self):
+        """
+        Cancel background renewal.
+        """
+        self._stopped = True
+        with self._lock:
+            timer = self._timer
+            self._timer = None
+        if timer is not None:
+            timer.cancel()
+
+    def get_access_token(self):
+        """
+        Return a valid access token, refreshing it first if needed.
+        """
+        with self._lock:
+            if self._tokens is not None and not self._is_expired(0):
+                return self._tokens["access_token"]
+        return self.refresh(force=False)
+
+    def refresh(self, force=True):
+        """
+        Refresh the access token.
+        Callers that arrive while a refresh is in flight wait for it and
+        share its result.  If `force` is False, the refresh is skipped when
+        the current token is still valid.
+        """
+        with self._refresh_lock:
+            with self._lock:
+                if self._tokens is None:
+                    self._load()
+                tokens = self._tokens
+                if not (force or self._is_expired(0)):
+                    return tokens["access_token"]
+            logger.debug("Refreshing OAuth2 tokens ...")
+            client_id, client_secret = self._get_client_config()
             new_tokens = refresh_tokens(
-                client_id, client_secret, tokens["refresh_token"]
+                client_id,
+                client_secret,
+                tokens["refresh_token"],
+                session=self.session,
             )
+            tokens = dict(tokens)
             tokens.update(new_tokens)
-            print(tokens)
-            print("Tokens refreshed.", file=sys.stderr)
-            expired = False
-    if expired:
-        raise Exception("Could not obtain valid access token.")
-    refresh_token = tokens["refresh_token"]
-    access_token = tokens["access_token"]
-    expires_in = tokens["expires_in"]
-    issued_at = tokens["issued_at"]
-    dt = parse_date(issued_at)
-    expires_at = dt + datetime.timedelta(seconds=expires_in)
-    print(f"Refresh Token: {refresh_token}")
-    print(f"Access Token: {access_token}")
-    print(f"Access Token issued at: {issued_at}")
-    print(f"Access Token Expiration Seconds: {expires_in}")
-    print(f"Access token expires at: {expires_at.isoformat()}")
-    tokens["expires_at"] = expires_at.isoformat()
-    with open(token_path, "w") as f:
-        json.dump(tokens, f, indent=4)
-    return access_token
-
-
-def refresh_tokens(client_id, client_secret, refresh_token):
+            expires_at = compute_expiration(tokens)
+            tokens["expires_at"] = expires_at.isoformat()
+            with self._lock:
+                self._tokens = tokens
+                self._expires_at = expires_at
+            write_tokens(self.token_path, tokens)
+            logger.debug(f"OAuth2 tokens refreshed.  Expire at {tokens['expires_at']}.")
+        self._schedule_refresh()
+        return tokens["access_token"]
+
+    def _load(self):
+        if not self.token_path.exists():
+            raise Exception("Could not obtain valid access token.")
+        with open(self.token_path, "r") as f:
+            tokens = json.load(f)
+        self._tokens = tokens
+        self._expires_at = parse_date(tokens["expires_at"])
+
+    def _get_client_config(self):
+        if self._client_config is None:
+            oauth2_config = self.config.get("oauth2", {})
+            self._client_config = get_client_config(oauth2_config)
+        return self._client_config
+
+    def _is_expired(self, margin):
+        dt = datetime.datetime.now(tzlocal())
+        return dt + datetime.timedelta(seconds=margin) >= self._expires_at
+
+    def _schedule_refresh(self, delay=None):
+        if self._stopped:
+            return
+        with self._lock:
+            if delay is None:
+                dt = datetime.datetime.now(tzlocal())
+                remaining = (self._expires_at - dt).total_seconds()
+                delay = max(0, remaining - self.refresh_margin)
+            if self._timer is not None:
+                self._timer.cancel()
+            timer = threading.Timer(delay, self._background_refresh)
+            timer.daemon = True
+            self._timer = timer
+        timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh(force=True)
+        except Exception as ex:
+            logger.debug(f"Background token refresh failed: {ex}")
+            self._schedule_refresh(delay=self.retry_interval)
+
+
+def get_token_manager(config):
+    """
+    Return the process-wide TokenManager.
+    """
+    global _token_manager
+    with _token_manager_lock:
+        if _token_manager is None:
+            _token_manager = TokenManager(config)
+        return _token_manager
+
+
+def get_oauth2_access_token(config):
+    """
+    Get a valid OAuth2 access token to be used with IMAP.
+    """
+    return get_token_manager(config).get_access_token()
+
+
+def compute_expiration(tokens):
+    """
+    Compute when an access token expires from when it was issued.
+    """
+    dt = parse_date(tokens["issued_at"])
+    return dt + datetime.timedelta(seconds=tokens["expires_in"])
+
+
+def write_tokens(token_path, tokens):
+    """
+    Atomically replace the token file.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=token_path.parent, prefix=".access-tokens-", suffix=".json"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(tokens, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, token_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def refresh_tokens(client_id, client_secret, refresh_token, session=None):
     params = {}
     params["client_id"] = client_id
     params["client_secret"] = client_secret
     params["refresh_token"] = refresh_token
     params["grant_type"] = "refresh_token"
     request_url = accounts_url("o/oauth2/token")
-    response = requests.post(request_url, data=params)
+    if session is None:
+        session = requests
+    response = session.post(request_url, data=params)
+    response.raise_for_status()
     tokens = response.json()
     issued_at = datetime.datetime.today().replace(tzinfo=tzlocal())
     tokens["issued_at"] = issued_at.isoformat()
@@ -0,0 +1,104 @@
+import time
+
+from imap_tools.consts import MailMessageFlags
+
+from gmailtuilib.imap import UIDSet
+from gmailtuilib.sqllib import (
+    sql_delete_failed_outbox_actions,
+    sql_delete_message_label_by_uid,
+    sql_delete_outbox_read_status,
+    sql_failed_outbox_actions,
+    sql_insert_outbox_action,
+    sql_outbox_actions,
+    sql_update_message_unread_by_uid_and_label,
+)
+
+ACTION_SEEN = "seen"
+ACTION_UNSEEN = "unseen"
+ACTION_ARCHIVE = "archive"
+ACTION_TRASH = "trash"
+
+# Flag changes are sent before the messages leave their folders.
+ACTION_ORDER = [ACTION_SEEN, ACTION_UNSEEN, ACTION_ARCHIVE, ACTION_TRASH]
+
+
+def queue_actions(cursor, folder, uids, action):
+    """
+    Apply `action` to the cached messages with `uids` in `folder` and record
+    it in the outbox, to be sent to the server by `send_action()`.
+    The caller is responsible for committing.
+    """
+    uids = [int(uid) for uid in uids]
+    if action in (ACTION_SEEN, ACTION_UNSEEN):
+        unread = int(action == ACTION_UNSEEN)
+        cursor.executemany(
+            sql_update_message_unread_by_uid_and_label,
+            ([unread, folder, uid] for uid in uids),
+        )
+        cursor.executemany(
+            sql_delete_outbox_read_status, ([folder, uid] for uid in uids)
+        )
+    elif action in (ACTION_ARCHIVE, ACTION_TRASH):
+        cursor.executemany(
+            sql_delete_message_label_by_uid, ([folder, uid] for uid in uids)
+        )
+    else:
+        raise ValueError(f"Unknown outbox action: {action!r}")
+    created_epoch = int(time.time())
+    cursor.executemany(
+        sql_insert_outbox_action,
+        ([folder, uid, action, created_epoch] for uid in uids),
+    )
+
+
+def pending_action_groups(cursor):
+    """
+    Return the actions in the outbox merged into one group per folder and
+    action, as a list of (folder, action, uid_set, outbox_ids).
+    Flag changes come before archiving and trashing.
+    """
+    cursor.execute(sql_outbox_actions)
+    groups = {}
+    for outbox_id, folder, uid, action in cursor.fetchall():
+        uids, outbox_ids = groups.setdefault((folder, action), ([], []))
+        uids.append(uid)
+        outbox_ids.append(outbox_id)
+    return [
+        (folder, action, UIDSet(uids), outbox_ids)
+        for (folder, action), (uids, outbox_ids) in sorted(
+            groups.items(), key=lambda item: ACTION_ORDER.index(item[0][1])
+        )
+    ]
+
+
+def remove_failed_actions(cursor, max_attempts):
+    """
+    Remove the actions that failed `max_attempts` times from the outbox.
+    Returns a list of (folder, action, uid_set) for them.
+    The caller is responsible for committing.
+    """
+    cursor.execute(sql_failed_outbox_actions, [max_attempts])
+    groups = {}
+    for folder, uid, action in cursor.fetchall():
+        groups.setdefault((folder, action), []).append(uid)
+    cursor.execute(sql_delete_failed_outbox_actions, [max_attempts])
+    return [(folder, action, UIDSet(uids)) for (folder, action), uids in groups.items()]
+
+
+def send_action(mailbox, action, uid_set):
+    """
+    Apply `action` to the messages in `uid_set` on the server with a single
+    command.  `mailbox` must have the messages' folder selected.
+    """
+    uids = str(uid_set)
+    if action == ACTION_SEEN:
+        mailbox.flag(uids, MailMessageFlags.SEEN, True)
+    elif action == ACTION_UNSEEN:
+        mailbox.flag(uids, MailMessageFlags.SEEN, False)
+    elif action == ACTION_ARCHIVE:
+        # Gmail archives messages deleted from the inbox.
+        mailbox.delete(uids)
+    elif action == ACTION_TRASH:
+        mailbox.move(uids, "[Gmail]/Trash")
+    else:
+        raise ValueError(f"Unknown outbox action: {action!r}")
@@ -1,25 +1,62 @@
 #! /usr/bin/env python
 import csv
+import re
 
-import parsley
-
-imap_gmail_uid_fetch_response_grammar = """\
-line = msg_number:m ws plist:x end -> (m, x)
-msg_number = digit+:dl -> int("".join(dl))
-plist = '(' items:x ')' -> x
-items = item_space*:x -> x
-item_space = item:x ws -> x
-item = string_item | plist
-string_item = atom | qstring
-atom = (letterOrDigit | punctuation)+:c -> ''.join(c)
-punctuation = anything:c ?(c in '!#$%&*+,-./:;<=>?@[]^_`{|}~') -> c
-qstring = '"' qstring_contents:a '"' -> a
-qstring_contents = qstring_chars+:c -> ''.join(c)
-qstring_chars = anything:c ?(c not in '"') -> c
-"""
-imap_gmail_uid_fetch_response_parser = parsley.makeGrammar(
-    imap_gmail_uid_fetch_response_grammar, {}
+# One token of a FETCH response: an opening or closing parenthesis, a quoted
+# string, the `{n}` announcing a literal at the end of a line, or an atom.
+fetch_response_token_pattern = re.compile(
+    r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))'
 )
+fetch_response_number_pattern = re.compile(r"\s*(\d+)\s+(?:FETCH\s+)?")
+
+
+def parse_fetch_response(data):
+    """
+    Parse the data of an imaplib FETCH response.
+    `data` is the list imaplib returns: bytes for each line, and a
+    (line, literal) tuple for a line that ends by announcing a literal.
+    Yields a (message_number, items) tuple per message, where items is the
+    parenthesized list of the response as nested lists.  Quoted strings are
+    returned without their quotes, but backslash escapes are kept as sent.
+    Literals are returned as bytes.
+    """
+    stack = None
+    message_number = None
+    for chunk in data:
+        if isinstance(chunk, tuple):
+            line, literal = chunk
+        else:
+            line, literal = chunk, None
+        if line is None:
+            continue
+        line = line.decode("utf-8", "replace")
+        pos = 0
+        if stack is None:
+            m = fetch_response_number_pattern.match(line)
+            if m is None:
+                # Not the start of a FETCH response.
+                continue
+            message_number = int(m.group(1))
+            pos = m.end()
+            stack = [[]]
+        for m in fetch_response_token_pattern.finditer(line, pos):
+            opening, closing, qstring, literal_size, atom = m.groups()
+            if opening is not None:
+                items = []
+                stack[-1].append(items)
+                stack.append(items)
+            elif closing is not None:
+                stack.pop()
+                if len(stack) == 1:
+                    yield message_number, stack[0][0]
+                    stack = None
+                    break
+            elif qstring is not None:
+                stack[-1].append(qstring)
+            elif literal_size is not None:
+                stack[-1].append(literal)
+            elif atom is not None:
+                stack[-1].append(atom)
 
 
 def parse_maybe_quoted_csv(s):
@@ -11,10 +11,13 @@ from textual.screen import ModalScreen
 from textual.widgets import (Button, Footer, Header, Input, Label, ListItem,
                              ListView, LoadingIndicator, Switch)
 
-from gmailtuilib.imap import (fetch_google_messages, get_mailbox, is_starred,
-                              is_unread, quote_imap_string)
-from gmailtuilib.message import MessageItem, msg_to_email_msg, str_to_email_msg
-from gmailtuilib.oauth2 import get_oauth2_access_token
+from gmailtuilib.compression import decode_message_string
+from gmailtuilib.imap import (fetch_google_messages, is_starred, is_unread,
+                              quote_imap_string)
+from gmailtuilib.ingest import ingest_messages
+from gmailtuilib.message import (MessageItem, format_date_epoch,
+                                 msg_to_email_msg, str_to_email_msg)
+from gmailtuilib.sqllib import sql_search_cached_messages
 
 
 class SearchScreen(ModalScreen):
@@ -25,6 +28,9 @@ class SearchScreen(ModalScreen):
         with Horizontal(classes="search-row"):
             yield Label("Search All Mailboxes:", classes="search-label")
             yield Switch(value=True, id="search-all-mbox")
+        with Horizontal(classes="search-row"):
+            yield Label("Search Local Cache:", classes="search-label")
+            yield Switch(value=False, id="search-local")
         with Horizontal(classes="search-row"):
             yield Label("Search:", classes="search-label")
             yield Input(value="", id="search-criteria")
@@ -36,8 +42,10 @@ class SearchScreen(ModalScreen):
         if event.button.id == "search-ok":
             fields = {}
             all_mbox_switch = self.query_one("#search-all-mbox")
+            local_switch = self.query_one("#search-local")
             criteria = self.query_one("#search-criteria").value
             fields["all_mbox"] = all_mbox_switch.value
+            fields["local"] = local_switch.value
             fields["criteria"] = criteria
             self.dismiss(fields)
         else:
@@ -98,64 +106,135 @@ class SearchResultsScreen(ModalScreen):
             return
         li = lv.children[index]
         mi = li.children[0]
-        uid = mi.uid
-        self.app.restore_to_inbox(uid, from_curr_label=False)
+        # UIDs are per folder, so a UID from another label cannot be copied
+        # from All Mail.  Without one the message is found by X-GM-MSGID.
+        if self.search_fields["all_mbox"]:
+            uid = mi.uid
+        else:
+            uid = None
+        self.app.restore_to_inbox(
+            uid, from_curr_label=False, gmessage_id=mi.gmessage_id
+        )
         mi.inbox = True
 
     @work(exclusive=True, group="fetch-search-results", thread=True)
     def fetch_search_results(self):
         """
-        Fetch search results from IMAP server.
+        Fetch search results from the local cache or the IMAP server.
         """
         search_fields = self.search_fields
+        if search_fields.get("local"):
+            results = self.search_local_cache(search_fields)
+        else:
+            results = self.search_imap(search_fields)
+        self.app.call_from_thread(self.display_search_results, results)
+
+    def search_local_cache(self, search_fields, limit=50):
+        """
+        Search the full-text index of cached messages.
+        Returns a list of keyword arguments for `MessageItem`, best matches
+        first.
+        """
+        results = []
+        query = to_fts_query(search_fields["criteria"])
+        if query == "":
+            return results
+        if search_fields["all_mbox"]:
+            label = "[Gmail]/All Mail"
+        else:
+            label = self.app.label
+        tz = tzlocal()
+        start = datetime.datetime.now()
+        with sqlite3.connect(self.app.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            cursor = conn.cursor()
+            cursor.execute(
+                sql_search_cached_messages,
+                {
+                    "label": label,
+                    "query": query,
+                    "all_labels": search_fields["all_mbox"],
+                    "limit": limit,
+                },
+            )
+            for (
+                gmessage_id,
+                date_epoch,
+                sender,
+                subject,
+                unread,
+                starred,
+                uid,
+                inbox,
+            ) in cursor.fetchall():
+                results.append(
+                    {
+                        "gmessage_id": gmessage_id,
+                        "uid": uid,
+                        "date_str": format_date_epoch(date_epoch, tz),
+                        "sender": sender,
+                        "subject": subject,
+                        "unread": bool(unread),
+                        "starred": bool(starred),
+                        "inbox": bool(inbox),
+                        "glabels": [],
+                    }
+                )
+        stop = datetime.datetime.now()
+        td = stop - start
+        logger.debug(f"Total seconds for local search: {td.total_seconds()}")
+        return results
+
+    def search_imap(self, search_fields):
+        """
+        Search with Gmail's search syntax on the IMAP server.
+        Returns a list of keyword arguments for `MessageItem`.
+        """
         results = []
         criteria = f'X-GM-RAW {quote_imap_string(search_fields["criteria"])}'
-        config = self.app.config
-        access_token = get_oauth2_access_token(config)
-        with get_mailbox(config, access_token) as mailbox:
-            if search_fields["all_mbox"]:
-                mailbox.folder.set("[Gmail]/All Mail")
-            else:
-                mailbox.folder.set(self.app.label)
+        if search_fields["all_mbox"]:
+            folder = "[Gmail]/All Mail"
+        else:
+            folder = self.app.label
+        with self.app.imap_pool.mailbox(folder) as mailbox:
             start = datetime.datetime.now()
             for gmessage_id, gthread_id, glabels, msg in fetch_google_messages(
                 mailbox, criteria=criteria, headers_only=False, batch_size=50, limit=50
             ):
-                results.append((gmessage_id, glabels, msg))
+                date = msg.obj.get("Date")
+                dt = parse_date(date)
+                dt = dt.astimezone(tzlocal())
+                date_str = dt.isoformat()
+                if "\\\\Inbox" in glabels:
+                    inbox = True
+                else:
+                    inbox = False
+                results.append(
+                    {
+                        "gmessage_id": gmessage_id,
+                        "uid": msg.uid,
+                        "date_str": date_str,
+                        "sender": msg.from_,
+                        "subject": msg.subject,
+                        "unread": is_unread(msg.flags),
+                        "starred": is_starred(msg.flags),
+                        "inbox": inbox,
+                        "glabels": glabels,
+                    }
+                )
             stop = datetime.datetime.now()
             td = stop - start
             logger.debug(f"Total seconds for IMAP query: {td.total_seconds()}")
-        self.app.call_from_thread(self.display_search_results, results)
+        return results
 
     def display_search_results(self, search_results):
         """
         Display search results.
         """
         lv = self.query_one("#search-results")
-        for n, (gmessage_id, glabels, msg) in enumerate(search_results):
-            date = msg.obj.get("Date")
-            dt = parse_date(date)
-            dt = dt.astimezone(tzlocal())
-            date_str = dt.isoformat()
-            sender = msg.from_
-            subject = msg.subject
-            unread = is_unread(msg.flags)
-            starred = is_starred(msg.flags)
-            if "\\\\Inbox" in glabels:
-                inbox = True
-            else:
-                inbox = False
-            message_item = MessageItem(
-                gmessage_id,
-                msg.uid,
-                date_str,
-                sender,
-                subject,
-                unread=unread,
-                starred=starred,
-                inbox=inbox,
-                glabels=glabels,
-            )
+        for n, result in enumerate(search_results):
+            message_item = MessageItem(**result)
             if n % 2 == 0:
                 message_item.add_class("item-even")
             else:
@@ -199,10 +278,7 @@ class SearchResultsScreen(ModalScreen):
             result = self.app.get_cached_message(cursor, gmessage_id)
             if result is None:
                 logger.debug(f"Fetching message with ID {gmessage_id}.")
-                config = self.app.config
-                access_token = get_oauth2_access_token(config)
-                with get_mailbox(config, access_token) as mailbox:
-                    mailbox.folder.set(label)
+                with self.app.imap_pool.mailbox(label) as mailbox:
                     criteria = A(uid=[uid])
                     for gmessage_id, gthread_id, glabels, msg in fetch_google_messages(
                         mailbox, criteria=criteria, headers_only=False, limit=1
@@ -215,29 +291,21 @@ class SearchResultsScreen(ModalScreen):
                         )
                         break
                 logger.debug(f"Preparing to cache {gmessage_id}")
-                self.cache_message(cursor, gmessage_id, gthread_id, glabels, msg)
+                ingest_messages(
+                    cursor,
+                    None,
+                    [(gmessage_id, gthread_id, glabels, msg)],
+                    codec=self.app.message_codec,
+                    attachment_store=self.app.attachment_store,
+                )
                 conn.commit()
             else:
                 logger.debug(f"Using cached message: {gmessage_id}.")
-                _, gthread_id, message_string, unread, starred = result
-                msg = str_to_email_msg(message_string)
+                _, gthread_id, message_string, unread, starred, codec = result
+                msg = str_to_email_msg(decode_message_string(message_string, codec))
                 result = (gmessage_id, gthread_id, glabels, msg)
         self.app.call_from_thread(self.display_message, *result)
 
-    def cache_message(self, cursor, gmessage_id, gthread_id, glabels, msg):
-        flags = msg.flags
-        unread = is_unread(flags)
-        starred = is_starred(flags)
-        sql = """\
-            INSERT INTO messages
-                (gmessage_id, gthread_id, message_string, unread, starred)
-                VALUES (?, ?, ?, ?, ?)
-            """
-        cursor.execute(
-            sql,
-            [gmessage_id, gthread_id, msg.obj.as_string(), unread, starred],
-        )
-
     def display_message(self, gmessage_id, gthread_id, glabels, msg):
         loading = self.query_one("#search-loading")
         loading.add_class("invisible")
@@ -246,3 +314,21 @@ class SearchResultsScreen(ModalScreen):
         screen = self.app.SCREENS["msg_screen"]
         screen.msg = msg
         self.app.push_screen(screen)
+
+
+def to_fts_query(criteria):
+    """
+    Turn search criteria into an FTS5 query that matches messages containing
+    all of the words.  A trailing "*" on a word matches it as a prefix.
+    """
+    terms = []
+    for word in criteria.split():
+        is_prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word == "":
+            continue
+        term = '"{}"'.format(word.replace('"', '""'))
+        if is_prefix:
+            term = f"{term}*"
+        terms.append(term)
+    return " ".join(terms)
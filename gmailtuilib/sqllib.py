@@ -1,147 +1,364 @@
 sql_get_message_string_by_uid_and_label = """\
     SELECT
-        message_string
-    FROM messages
-        INNER JOIN message_labels
-            ON messages.id = message_labels.message_id
-        INNER JOIN labels
-            ON message_labels.label_id = labels.id
-    WHERE labels.label = ?
-    AND message_labels.uid = ?
-    """
-
-sql_all_uids_for_label = """\
-    SELECT
-        message_labels.rowid,
-        message_labels.uid
+        message_string,
+        codec,
+        has_body
     FROM message_labels
-        INNER JOIN labels
-            ON message_labels.label_id = labels.id
-    WHERE labels.label = ?
+        INNER JOIN messages
+            ON message_labels.message_id = messages.id
+    WHERE message_labels.label_id = (
+        SELECT id
+        FROM labels
+        WHERE label = ?
+    )
+    AND message_labels.uid = ?
     """
 
-sql_delete_message_label = """\
+sql_delete_message_labels_in_uid_ranges = """\
     DELETE FROM message_labels
-    WHERE rowid = ?
+    WHERE rowid IN (
+        SELECT message_labels.rowid
+        FROM json_each(?) AS uid_ranges
+            -- One index range scan per range.
+            CROSS JOIN message_labels
+        WHERE message_labels.label_id = (
+            SELECT id
+            FROM labels
+            WHERE label = ?
+        )
+        AND message_labels.uid
+            BETWEEN json_extract(uid_ranges.value, '$[0]')
+            AND json_extract(uid_ranges.value, '$[1]')
+    )
     """
 
-sql_get_message_labels_in_uid_range = """\
-    SELECT
-        rowid,
-        uid
-    FROM message_labels
-    WHERE CAST(uid AS INTEGER) >= ?
-    AND CAST(uid AS INTEGER) <= ?
+sql_get_label_id = """\
+    SELECT id
+    FROM labels
+    WHERE label = ?
     """
 
-sql_find_ml = """\
-    SELECT message_id, label_id
-    FROM message_labels
-    WHERE message_id = (
-        SELECT id
-        FROM messages
-        WHERE gmessage_id = ?
-    )
-    AND label_id = (
-        SELECT id
-        FROM labels
-        WHERE label = ?
+sql_upsert_message_label = """\
+    INSERT INTO message_labels (message_id, label_id, uid)
+    SELECT messages.id, params.label_id, params.uid
+    FROM (SELECT ? AS label_id, ? AS uid) AS params
+        INNER JOIN messages
+            ON messages.gmessage_id = ?
+    -- Messages archived or trashed here but not yet on the server stay out.
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM outbox
+            INNER JOIN labels
+                ON labels.label = outbox.folder
+        WHERE labels.id = params.label_id
+        AND outbox.uid = params.uid
+        AND outbox.action IN ('archive', 'trash')
     )
+    ON CONFLICT (message_id, label_id) DO UPDATE
+    SET uid = excluded.uid
+    WHERE message_labels.uid IS NOT excluded.uid
     """
 
-sql_insert_ml = """\
-    INSERT INTO message_labels (message_id, label_id, uid)
-    VALUES (
-        (
-        SELECT id
-        FROM messages
-        WHERE gmessage_id = ?
-        ),
-        (
+sql_fetch_thread_heads_for_label = """\
+    SELECT
+        gmessage_id,
+        gthread_id,
+        date_epoch,
+        sender,
+        subject,
+        -- Only rows whose display fields have not been extracted yet need
+        -- the message itself.
+        CASE
+            WHEN size IS NULL THEN message_string
+        END unparsed_message_string,
+        codec,
+        unread,
+        starred,
+        has_body,
+        thread_heads.uid
+    FROM thread_heads
+        INNER JOIN messages
+            ON thread_heads.message_id = messages.id
+    WHERE thread_heads.label_id = (
         SELECT id
         FROM labels
         WHERE label = ?
-        ),
-        ?
     )
+    AND thread_heads.uid < ?
+    ORDER BY thread_heads.uid DESC
+    LIMIT ?
     """
 
-sql_fetch_msgs_for_label = """\
+sql_message_exists = """\
     SELECT
         gmessage_id,
         gthread_id,
         message_string,
         unread,
         starred,
-        uid
-    FROM (
-        SELECT
+        codec
+    FROM messages
+    WHERE gmessage_id = ?
+    AND has_body = 1
+    """
+
+sql_upsert_message = """\
+    INSERT INTO messages
+        (
             gmessage_id,
             gthread_id,
             message_string,
             unread,
             starred,
-            uid,
-            thread_number,
-            thread_rank,
-            ROW_NUMBER()
-            OVER
-            (
-                ORDER BY uid DESC
-            ) row_num
-        FROM (
-            SELECT
-                *,
-                ROW_NUMBER()
-                OVER
-                (
-                    PARTITION BY thread_number
-                    ORDER BY gmessage_id DESC
-                ) thread_rank
-            FROM (
-                SELECT
-                    gmessage_id,
-                    gthread_id,
-                    message_string,
-                    unread,
-                    starred,
-                    uid,
-                    DENSE_RANK()
-                    OVER (
-                        ORDER BY gthread_id DESC
-                    ) thread_number
-                FROM messages
-                    INNER JOIN message_labels
-                        ON message_labels.message_id = messages.id
-                    INNER JOIN labels
-                        ON message_labels.label_id = labels.id
-                WHERE labels.label = ?
-            ) in1_table
-        ) outer_table
-        WHERE thread_rank = 1
-    ) final
-    WHERE row_num > ?
-    AND row_num < 500
-    ORDER BY uid DESC
+            date_epoch,
+            sender,
+            subject,
+            size,
+            thread_id,
+            codec,
+            has_body
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (gmessage_id) DO UPDATE
+    SET unread = excluded.unread,
+        starred = excluded.starred,
+        -- A downloaded body replaces the headers cached in its place.
+        message_string = CASE
+            WHEN excluded.has_body > messages.has_body THEN excluded.message_string
+            ELSE messages.message_string
+        END,
+        codec = CASE
+            WHEN excluded.has_body > messages.has_body THEN excluded.codec
+            ELSE messages.codec
+        END,
+        has_body = MAX(messages.has_body, excluded.has_body)
     """
 
-sql_message_exists = """\
+sql_update_message_flags = """\
+    UPDATE messages
+    SET unread = ?, starred = ?
+    WHERE gmessage_id = ?
+    """
+
+sql_messages_missing_display_fields = """\
     SELECT
-        gmessage_id,
-        gthread_id,
+        id,
         message_string,
-        unread,
-        starred
+        codec
+    FROM messages
+    WHERE id > ?
+    AND size IS NULL
+    ORDER BY id
+    LIMIT ?
+    """
+
+sql_messages_to_recode = """\
+    SELECT
+        id,
+        message_string,
+        codec,
+        has_body
+    FROM messages
+    WHERE id > ?
+    AND codec <> ?
+    ORDER BY id
+    LIMIT ?
+    """
+
+sql_update_message_string = """\
+    UPDATE messages
+    SET message_string = ?, codec = ?
+    WHERE id = ?
+    -- Leave the row alone if it was rewritten since it was read, e.g. its
+    -- body was downloaded.
+    AND codec = ?
+    AND has_body = ?
+    """
+
+sql_update_message_display_fields = """\
+    UPDATE messages
+    SET date_epoch = ?, sender = ?, subject = ?, size = ?
+    WHERE id = ?
+    """
+
+sql_insert_message_attachment = """\
+    INSERT INTO message_attachments
+        (message_id, part_index, sha256, filename, content_type, size)
+    SELECT id, ?, ?, ?, ?, ?
+    FROM messages
+    WHERE gmessage_id = ?
+    ON CONFLICT (message_id, part_index) DO NOTHING
+    """
+
+sql_index_message_text = """\
+    INSERT INTO messages_fts (rowid, subject, sender, recipients, body)
+    SELECT id, ?, ?, ?, ?
     FROM messages
     WHERE gmessage_id = ?
+    AND fts_indexed = 0
     """
 
-sql_update_message_unread = """\
+sql_mark_message_text_indexed = """\
     UPDATE messages
-    SET unread = ?
+    SET fts_indexed = 1
     WHERE gmessage_id = ?
     """
 
+sql_messages_to_index = """\
+    SELECT
+        id,
+        gmessage_id,
+        message_string,
+        codec
+    FROM messages
+    WHERE id > ?
+    AND fts_indexed = 0
+    AND has_body = 1
+    ORDER BY id
+    LIMIT ?
+    """
+
+sql_message_uids_without_body_for_label = """\
+    SELECT message_labels.uid
+    -- CROSS JOIN makes SQLite start from the few messages without a body
+    -- instead of scanning every message in the label.
+    FROM messages
+        CROSS JOIN message_labels
+            ON message_labels.message_id = messages.id
+    WHERE messages.has_body = 0
+    AND message_labels.label_id = (
+        SELECT id
+        FROM labels
+        WHERE label = ?
+    )
+    ORDER BY message_labels.uid DESC
+    """
+
+sql_search_cached_messages = """\
+    SELECT
+        messages.gmessage_id,
+        messages.date_epoch,
+        messages.sender,
+        messages.subject,
+        messages.unread,
+        messages.starred,
+        (
+            SELECT uid
+            FROM message_labels
+            WHERE message_labels.message_id = messages.id
+            AND message_labels.label_id = (
+                SELECT id
+                FROM labels
+                WHERE label = :label
+            )
+        ) uid,
+        EXISTS (
+            SELECT 1
+            FROM message_labels
+            WHERE message_labels.message_id = messages.id
+            AND message_labels.label_id = (
+                SELECT id
+                FROM labels
+                WHERE label = 'INBOX'
+            )
+        ) inbox
+    FROM messages_fts
+        INNER JOIN messages
+            ON messages.id = messages_fts.rowid
+    WHERE messages_fts MATCH :query
+    AND (:all_labels OR uid IS NOT NULL)
+    -- bm25() weights: subject, sender, recipients, body.
+    ORDER BY bm25(messages_fts, 4.0, 2.0, 2.0, 1.0)
+    LIMIT :limit
+    """
+
+sql_update_message_unread_by_uid_and_label = """\
+    UPDATE messages
+    SET unread = ?
+    WHERE id = (
+        SELECT message_id
+        FROM message_labels
+        WHERE label_id = (
+            SELECT id
+            FROM labels
+            WHERE label = ?
+        )
+        AND uid = ?
+    )
+    """
+
+sql_insert_outbox_action = """\
+    INSERT INTO outbox (folder, uid, action, created_epoch)
+    VALUES (?, ?, ?, ?)
+    """
+
+# Only the last read status set for a message has to reach the server.
+sql_delete_outbox_read_status = """\
+    DELETE FROM outbox
+    WHERE folder = ?
+    AND uid = ?
+    AND action IN ('seen', 'unseen')
+    """
+
+# Flags fetched from the server do not know about read status changes that
+# are still in the outbox; this puts the queued status back.
+sql_reapply_outbox_read_status = """\
+    WITH pending AS (
+        SELECT
+            message_labels.message_id,
+            outbox.action
+        FROM outbox
+            INNER JOIN labels
+                ON labels.label = outbox.folder
+            INNER JOIN message_labels
+                ON message_labels.label_id = labels.id
+                AND message_labels.uid = outbox.uid
+        WHERE outbox.action IN ('seen', 'unseen')
+    )
+    UPDATE messages
+    SET unread = (
+        SELECT pending.action = 'unseen'
+        FROM pending
+        WHERE pending.message_id = messages.id
+    )
+    WHERE id IN (SELECT message_id FROM pending)
+    """
+
+sql_outbox_actions = """\
+    SELECT
+        id,
+        folder,
+        uid,
+        action
+    FROM outbox
+    ORDER BY id
+    """
+
+sql_delete_outbox_action = """\
+    DELETE FROM outbox
+    WHERE id = ?
+    """
+
+sql_outbox_action_failed = """\
+    UPDATE outbox
+    SET attempts = attempts + 1
+    WHERE id = ?
+    """
+
+sql_failed_outbox_actions = """\
+    SELECT
+        folder,
+        uid,
+        action
+    FROM outbox
+    WHERE attempts >= ?
+    """
+
+sql_delete_failed_outbox_actions = """\
+    DELETE FROM outbox
+    WHERE attempts >= ?
+    """
+
 sql_ddl_messages = """\
     CREATE TABLE IF NOT EXISTS messages (
         id INTEGER PRIMARY KEY,
@@ -156,6 +373,90 @@ sql_ddl_messages_idx0 = """\
     create unique index if not exists idx0_messages
         on messages (gmessage_id)
     """
+# Actions taken on cached messages that have not been sent to the server yet.
+sql_ddl_outbox = """\
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        folder TEXT NOT NULL,
+        uid INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_epoch INTEGER
+    )
+    """
+sql_ddl_outbox_idx0 = """\
+    create index if not exists idx0_outbox
+        on outbox (folder, uid)
+    """
+sql_ddl_message_attachments = """\
+    CREATE TABLE IF NOT EXISTS message_attachments (
+        message_id INTEGER NOT NULL
+            REFERENCES messages (id) ON DELETE CASCADE,
+        part_index INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        filename TEXT,
+        content_type TEXT,
+        size INTEGER,
+        PRIMARY KEY (message_id, part_index)
+    )
+    """
+sql_ddl_message_attachments_idx0 = """\
+    create index if not exists idx0_message_attachments
+        on message_attachments (sha256)
+    """
+sql_ddl_messages_fts_indexed = """\
+    ALTER TABLE messages ADD COLUMN fts_indexed INTEGER NOT NULL DEFAULT 0
+    """
+# Contentless full-text index of cached messages; its rowids are message ids.
+sql_ddl_messages_fts = """\
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+        subject,
+        sender,
+        recipients,
+        body,
+        content='',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """
+# 0 while only the headers of a message are cached in `message_string`.
+sql_ddl_messages_has_body = """\
+    ALTER TABLE messages ADD COLUMN has_body INTEGER NOT NULL DEFAULT 1
+    """
+sql_ddl_messages_idx3 = """\
+    create index if not exists idx3_messages
+        on messages (id) where has_body = 0
+    """
+sql_ddl_messages_codec = """\
+    ALTER TABLE messages ADD COLUMN codec INTEGER NOT NULL DEFAULT 0
+    """
+sql_ddl_messages_date_epoch = """\
+    ALTER TABLE messages ADD COLUMN date_epoch INTEGER
+    """
+sql_ddl_messages_sender = """\
+    ALTER TABLE messages ADD COLUMN sender TEXT
+    """
+sql_ddl_messages_subject = """\
+    ALTER TABLE messages ADD COLUMN subject TEXT
+    """
+sql_ddl_messages_size = """\
+    ALTER TABLE messages ADD COLUMN size INTEGER
+    """
+sql_ddl_messages_idx1 = """\
+    create index if not exists idx1_messages
+        on messages (date_epoch)
+    """
+sql_ddl_messages_thread_id = """\
+    ALTER TABLE messages ADD COLUMN thread_id INTEGER
+    """
+sql_populate_messages_thread_id = """\
+    UPDATE messages
+    SET thread_id = CAST(gthread_id AS INTEGER)
+    WHERE gthread_id IS NOT NULL
+    """
+sql_ddl_messages_idx2 = """\
+    create index if not exists idx2_messages
+        on messages (thread_id)
+    """
 sql_ddl_labels = """\
     CREATE TABLE IF NOT EXISTS labels (
         id INTEGER PRIMARY KEY,
@@ -174,3 +475,291 @@ sql_ddl_message_labels = """\
        PRIMARY KEY (message_id, label_id)
     )
     """
+sql_ddl_label_sync_state = """\
+    CREATE TABLE IF NOT EXISTS label_sync_state (
+        label_id INTEGER PRIMARY KEY REFERENCES labels(id) ON DELETE CASCADE,
+        highestmodseq INTEGER
+    )
+    """
+
+sql_ddl_label_sync_state_uidvalidity = """\
+    ALTER TABLE label_sync_state ADD COLUMN uidvalidity INTEGER
+    """
+
+sql_ddl_label_sync_state_uidnext = """\
+    ALTER TABLE label_sync_state ADD COLUMN uidnext INTEGER
+    """
+
+sql_ddl_label_sync_state_last_uid = """\
+    ALTER TABLE label_sync_state ADD COLUMN last_uid INTEGER
+    """
+
+sql_get_label_sync_state = """\
+    SELECT
+        uidvalidity,
+        uidnext,
+        last_uid,
+        highestmodseq
+    FROM label_sync_state
+        INNER JOIN labels
+            ON label_sync_state.label_id = labels.id
+    WHERE labels.label = ?
+    """
+
+sql_save_label_sync_state = """\
+    INSERT INTO label_sync_state
+        (label_id, uidvalidity, uidnext, last_uid, highestmodseq)
+    VALUES (
+        (
+        SELECT id
+        FROM labels
+        WHERE label = ?
+        ),
+        ?,
+        ?,
+        ?,
+        ?
+    )
+    ON CONFLICT (label_id) DO UPDATE
+    SET uidvalidity = excluded.uidvalidity,
+        uidnext = excluded.uidnext,
+        last_uid = excluded.last_uid,
+        highestmodseq = excluded.highestmodseq
+    """
+
+sql_delete_label_sync_state = """\
+    DELETE FROM label_sync_state
+    WHERE label_id = (
+        SELECT id
+        FROM labels
+        WHERE label = ?
+    )
+    """
+
+sql_delete_message_labels_for_label = """\
+    DELETE FROM message_labels
+    WHERE label_id = (
+        SELECT id
+        FROM labels
+        WHERE label = ?
+    )
+    """
+
+sql_update_message_flags_by_uid_and_label = """\
+    UPDATE messages
+    SET unread = ?, starred = ?
+    WHERE id = (
+        SELECT message_id
+        FROM message_labels
+        WHERE label_id = (
+            SELECT id
+            FROM labels
+            WHERE label = ?
+        )
+        AND uid = ?
+    )
+    """
+
+sql_delete_message_label_by_uid = """\
+    DELETE FROM message_labels
+    WHERE label_id = (
+        SELECT id
+        FROM labels
+        WHERE label = ?
+    )
+    AND uid = ?
+    """
+
+sql_drop_message_labels_delete_trigger = """\
+    DROP TRIGGER IF EXISTS trg1_message_labels
+    """
+sql_drop_message_labels_update_trigger = """\
+    DROP TRIGGER IF EXISTS trg2_message_labels
+    """
+
+sql_ddl_message_labels_idx0 = """\
+    create index if not exists idx0_message_labels
+        on message_labels (label_id, uid)
+    """
+sql_convert_message_labels_uids = """\
+    UPDATE message_labels
+    SET uid = CAST(uid AS INTEGER)
+    WHERE typeof(uid) <> 'integer'
+    """
+
+# The newest message (highest UID) of each thread in each label.
+# Maintained by the triggers on message_labels below.
+sql_ddl_thread_heads = """\
+    CREATE TABLE IF NOT EXISTS thread_heads (
+        label_id INTEGER REFERENCES labels(id) ON DELETE CASCADE,
+        thread_id INTEGER,
+        uid INTEGER,
+        message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+        PRIMARY KEY (label_id, thread_id)
+    )
+    """
+sql_ddl_thread_heads_idx0 = """\
+    create index if not exists idx0_thread_heads
+        on thread_heads (label_id, uid)
+    """
+sql_populate_thread_heads = """\
+    INSERT OR REPLACE INTO thread_heads (label_id, thread_id, uid, message_id)
+    SELECT
+        message_labels.label_id,
+        messages.thread_id,
+        MAX(message_labels.uid),
+        -- SQLite takes the bare column from the row with the MAX() UID.
+        message_labels.message_id
+    FROM message_labels
+        INNER JOIN messages
+            ON message_labels.message_id = messages.id
+    WHERE messages.thread_id IS NOT NULL
+    GROUP BY message_labels.label_id, messages.thread_id
+    """
+sql_ddl_message_labels_insert_trigger = """\
+    CREATE TRIGGER IF NOT EXISTS trg0_message_labels
+    AFTER INSERT ON message_labels
+    BEGIN
+        INSERT INTO thread_heads (label_id, thread_id, uid, message_id)
+        SELECT NEW.label_id, messages.thread_id, NEW.uid, NEW.message_id
+        FROM messages
+        WHERE messages.id = NEW.message_id
+        AND messages.thread_id IS NOT NULL
+        ON CONFLICT (label_id, thread_id) DO UPDATE
+        SET uid = excluded.uid, message_id = excluded.message_id
+        WHERE excluded.uid > thread_heads.uid;
+    END
+    """
+sql_ddl_message_labels_delete_trigger = """\
+    CREATE TRIGGER IF NOT EXISTS trg1_message_labels
+    AFTER DELETE ON message_labels
+    BEGIN
+        DELETE FROM thread_heads
+        WHERE label_id = OLD.label_id
+        AND thread_id = (
+            SELECT thread_id
+            FROM messages
+            WHERE id = OLD.message_id
+        )
+        AND message_id = OLD.message_id;
+        INSERT OR IGNORE INTO thread_heads (label_id, thread_id, uid, message_id)
+        SELECT
+            message_labels.label_id,
+            messages.thread_id,
+            MAX(message_labels.uid),
+            message_labels.message_id
+        -- CROSS JOIN makes SQLite find the thread's messages first instead
+        -- of scanning every message in the label.
+        FROM messages
+            CROSS JOIN message_labels
+                ON message_labels.message_id = messages.id
+                AND message_labels.label_id = OLD.label_id
+        WHERE messages.thread_id = (
+            SELECT thread_id
+            FROM messages
+            WHERE id = OLD.message_id
+        )
+        GROUP BY message_labels.label_id, messages.thread_id;
+    END
+    """
+sql_ddl_message_labels_update_trigger = """\
+    CREATE TRIGGER IF NOT EXISTS trg2_message_labels
+    AFTER UPDATE OF uid ON message_labels
+    BEGIN
+        DELETE FROM thread_heads
+        WHERE label_id = OLD.label_id
+        AND thread_id = (
+            SELECT thread_id
+            FROM messages
+            WHERE id = OLD.message_id
+        )
+        AND message_id = OLD.message_id;
+        INSERT INTO thread_heads (label_id, thread_id, uid, message_id)
+        SELECT
+            message_labels.label_id,
+            messages.thread_id,
+            MAX(message_labels.uid),
+            message_labels.message_id
+        -- CROSS JOIN makes SQLite find the thread's messages first instead
+        -- of scanning every message in the label.
+        FROM messages
+            CROSS JOIN message_labels
+                ON message_labels.message_id = messages.id
+                AND message_labels.label_id = NEW.label_id
+        WHERE messages.thread_id = (
+            SELECT thread_id
+            FROM messages
+            WHERE id = NEW.message_id
+        )
+        GROUP BY message_labels.label_id, messages.thread_id
+        ON CONFLICT (label_id, thread_id) DO UPDATE
+        SET uid = excluded.uid, message_id = excluded.message_id;
+    END
+    """
+
+# Each entry is the list of SQL statements that upgrades the cache schema by
+# one version.  The schema version is kept in `PRAGMA user_version`.
+sql_schema_versions = [
+    [
+        sql_ddl_messages,
+        sql_ddl_messages_idx0,
+        sql_ddl_labels,
+        sql_ddl_labels_idx0,
+        sql_ddl_message_labels,
+    ],
+    [
+        sql_ddl_label_sync_state,
+    ],
+    [
+        sql_ddl_label_sync_state_uidvalidity,
+        sql_ddl_label_sync_state_uidnext,
+        sql_ddl_label_sync_state_last_uid,
+    ],
+    [
+        sql_ddl_messages_date_epoch,
+        sql_ddl_messages_sender,
+        sql_ddl_messages_subject,
+        sql_ddl_messages_size,
+        sql_ddl_messages_idx1,
+    ],
+    [
+        sql_ddl_messages_thread_id,
+        sql_populate_messages_thread_id,
+        sql_ddl_messages_idx2,
+        sql_ddl_thread_heads,
+        sql_ddl_thread_heads_idx0,
+        sql_populate_thread_heads,
+        sql_ddl_message_labels_insert_trigger,
+        sql_ddl_message_labels_delete_trigger,
+        sql_ddl_message_labels_update_trigger,
+    ],
+    [
+        sql_convert_message_labels_uids,
+        sql_ddl_message_labels_idx0,
+    ],
+    [
+        sql_drop_message_labels_delete_trigger,
+        sql_drop_message_labels_update_trigger,
+        sql_ddl_message_labels_delete_trigger,
+        sql_ddl_message_labels_update_trigger,
+    ],
+    [
+        sql_ddl_messages_codec,
+    ],
+    [
+        sql_ddl_message_attachments,
+        sql_ddl_message_attachments_idx0,
+    ],
+    [
+        sql_ddl_messages_fts_indexed,
+        sql_ddl_messages_fts,
+    ],
+    [
+        sql_ddl_messages_has_body,
+        sql_ddl_messages_idx3,
+    ],
+    [
+        sql_ddl_outbox,
+        sql_ddl_outbox_idx0,
+    ],
+]
@@ -0,0 +1,119 @@
+"""
+A minimal IMAP server for exercising the asyncio IMAP client locally.
+"""
+
+import asyncio
+import re
+
+
+class IMAPStandIn:
+    """
+    Serves one folder of Gmail-style messages over plain TCP.
+
+    `messages` maps each UID to the X-GM-LABELS value to send for it, as raw
+    IMAP text.  Setting `labels_before_uid` sends X-GM-LABELS first in FETCH
+    responses, as Gmail sometimes does.  `unsolicited` FETCH responses are
+    sent before each tagged NOOP response.  `stall()` stops answering on the
+    open connections, like a half-open socket.
+    """
+
+    def __init__(self, messages, labels_before_uid=False, unsolicited=0):
+        self.messages = messages
+        self.labels_before_uid = labels_before_uid
+        self.unsolicited = unsolicited
+        self.connections = 0
+        self.stalled = set()
+        self.server = None
+
+    async def start(self):
+        """
+        Start listening on a free port and return it.
+        """
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self.server.close()
+
+    def stall(self):
+        """
+        Stop answering commands on the connections open so far.
+        """
+        self.stalled.update(range(1, self.connections + 1))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        connection = self.connections
+        writer.write(b"* OK IMAP stand-in ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                if connection in self.stalled:
+                    continue
+                writer.write(self.respond(line.decode().rstrip("\r\n")))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, line):
+        tag, name, *args = line.split(" ")
+        name = name.upper()
+        if name == "AUTHENTICATE":
+            return f"{tag} OK Authenticated\r\n".encode()
+        if name == "SELECT":
+            uidnext = max(self.messages, default=0) + 1
+            return (
+                f"* {len(self.messages)} EXISTS\r\n"
+                "* OK [UIDVALIDITY 7] UIDs valid\r\n"
+                f"* OK [UIDNEXT {uidnext}] Predicted next UID\r\n"
+                f"{tag} OK [READ-WRITE] Selected\r\n"
+            ).encode()
+        if name == "NOOP":
+            response = b"".join(
+                f"* {n} FETCH (FLAGS (\\Seen))\r\n".encode()
+                for n in range(1, self.unsolicited + 1)
+            )
+            return response + f"{tag} OK NOOP completed\r\n".encode()
+        if name == "LOGOUT":
+            return f"* BYE\r\n{tag} OK LOGOUT completed\r\n".encode()
+        if name == "UID" and args[0].upper() == "SEARCH":
+            uids = " ".join(str(uid) for uid in sorted(self.messages))
+            return f"* SEARCH {uids}\r\n{tag} OK SEARCH completed\r\n".encode()
+        if name == "UID" and args[0].upper() == "FETCH":
+            uids = [uid for uid in parse_uid_set(args[1]) if uid in self.messages]
+            response = b"".join(self.fetch_response(uid) for uid in uids)
+            return response + f"{tag} OK FETCH completed\r\n".encode()
+        return f"{tag} BAD Unknown command\r\n".encode()
+
+    def fetch_response(self, uid):
+        header = (
+            f"Subject: Message {uid}\r\n"
+            "From: sender@example.com\r\n"
+            f"Message-ID: <{uid}@example.com>\r\n\r\n"
+        ).encode()
+        labels = f"X-GM-LABELS {self.messages[uid]}"
+        ids = f"X-GM-MSGID {1000 + uid} X-GM-THRID {2000 + uid}"
+        items = f"UID {uid} FLAGS (\\Seen) RFC822.SIZE {len(header)} {ids}"
+        if self.labels_before_uid:
+            items = f"{labels} {items}"
+        else:
+            items = f"{items} {labels}"
+        return (
+            f"* {uid} FETCH ({items} BODY[HEADER] {{{len(header)}}}\r\n".encode()
+            + header
+            + b")\r\n"
+        )
+
+
+def parse_uid_set(uid_set):
+    uids = []
+    for part in uid_set.split(","):
+        match = re.fullmatch(r"(\d+)(?::(\d+))?", part)
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        uids.extend(range(min(start, end), max(start, end) + 1))
+    return uids
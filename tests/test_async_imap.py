@@ -0,0 +1,97 @@
+import asyncio
+import imaplib
+import unittest
+
+from gmailtuilib.imap import AsyncIMAPPool, fetch_google_message_batch
+from tests.imap_standin import IMAPStandIn
+
+
+class AsyncIMAPTestCase(unittest.IsolatedAsyncioTestCase):
+    async def start_server(self, messages, **kwds):
+        self.server = IMAPStandIn(messages, **kwds)
+        port = await self.server.start()
+        self.addCleanup(self.server.close)
+        self.pool = AsyncIMAPPool(
+            {"oauth2": {"email": "user@example.com"}},
+            lambda: "token",
+            host="127.0.0.1",
+            port=port,
+            ssl=False,
+            timeout=0.5,
+        )
+        self.addCleanup(self.pool.close)
+
+    async def fetch(self, uids):
+        async with self.pool.client("INBOX") as client:
+            batch = await fetch_google_message_batch(client, uids)
+        return [(msg.uid, glabels) for gid, gthread_id, glabels, msg in batch]
+
+
+class TestFetchRouting(AsyncIMAPTestCase):
+    async def test_labels_literal_before_uid(self):
+        await self.start_server(
+            {
+                1: '("\\\\Inbox")',
+                2: '({7}\r\nProject "\\\\Inbox")',
+                3: "()",
+            },
+            labels_before_uid=True,
+        )
+        self.assertEqual(
+            await self.fetch([3, 2, 1]),
+            [("3", []), ("2", ["Project", "\\\\Inbox"]), ("1", ["\\\\Inbox"])],
+        )
+
+    async def test_uid_in_quoted_label(self):
+        await self.start_server({2: '("UID 7")', 7: "()"}, labels_before_uid=True)
+        self.assertEqual(await self.fetch([2]), [("2", ["UID 7"])])
+
+    async def test_concurrent_fetches_share_a_session(self):
+        await self.start_server({uid: "()" for uid in range(1, 9)})
+        batches = await asyncio.gather(
+            self.fetch([1, 2, 3]), self.fetch([4, 5]), self.fetch([6, 7, 8])
+        )
+        self.assertEqual(
+            [[uid for uid, glabels in batch] for batch in batches],
+            [["1", "2", "3"], ["4", "5"], ["6", "7", "8"]],
+        )
+        self.assertEqual(self.server.connections, 1)
+
+
+class TestSessionHealth(AsyncIMAPTestCase):
+    async def test_unclaimed_responses_are_bounded(self):
+        await self.start_server({1: "()"}, unsolicited=500)
+        async with self.pool.client() as client:
+            for _ in range(3):
+                await client.noop()
+        self.assertEqual(
+            len(client.untagged_responses["FETCH"]), client.max_untagged_responses
+        )
+
+    async def test_stalled_session_times_out_and_is_replaced(self):
+        await self.start_server({1: "()"})
+        async with self.pool.client("INBOX") as client:
+            await client.uid_search()
+        self.server.stall()
+        with self.assertRaises(imaplib.IMAP4.abort):
+            async with self.pool.client("INBOX") as client:
+                await client.uid_search()
+        self.assertTrue(client.is_closed())
+        async with self.pool.client("INBOX") as replacement:
+            self.assertEqual(await replacement.uid_search(), [1])
+        self.assertIsNot(replacement, client)
+
+    async def test_idle_session_is_checked_with_noop(self):
+        await self.start_server({1: "()"})
+        self.pool.noop_after = 0
+        async with self.pool.client("INBOX") as client:
+            pass
+        self.server.stall()
+        async with self.pool.client("INBOX") as replacement:
+            self.assertEqual(await replacement.uid_search(), [1])
+        self.assertTrue(client.is_closed())
+        self.assertEqual(self.server.connections, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()